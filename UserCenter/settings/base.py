@@ -6,6 +6,7 @@ from pathlib import Path
 from django.core.exceptions import ImproperlyConfigured
 
 import environ
+from corsheaders.defaults import default_headers
 from django.utils.translation import gettext_lazy as _
 
 # 导入日志配置
@@ -70,6 +71,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',  # 添加这一行
+    'user.ratelimit.RateLimitHeadersMiddleware',  # 限流响应头
 ]
 
 ROOT_URLCONF = 'UserCenter.urls'
@@ -98,21 +100,56 @@ DATABASES = {
 }
 
 # 密码验证
+# 相似度和常见密码校验使用 user/password_validation.py 中的实现，规则与 Django 自带的相同
+# 常见密码列表在部署时用 compile_common_passwords 编译到 data 目录（不能被其他用户写入），
+# 文件不存在或校验失败时退回 Django 的内存集合
 AUTH_PASSWORD_VALIDATORS = [
     {
-        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+        'NAME': 'user.password_validation.UserAttributeSimilarityValidator',
     },
     {
         'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+        'NAME': 'user.password_validation.CommonPasswordValidator',
+        'OPTIONS': {
+            'compiled_path': os.path.join(BASE_DIR, 'data', 'common-passwords.txt'),
+        },
     },
     {
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
     },
 ]
 
+# 密码哈希：PASSWORD_HASHER 选择新密码使用的算法（pbkdf2 / scrypt / argon2），
+# 其余算法仍可校验已有哈希，登录成功后自动升级为首选算法和当前参数
+_PASSWORD_HASHER_CHOICES = {
+    'pbkdf2': 'user.hashers.TunedPBKDF2PasswordHasher',
+    'scrypt': 'user.hashers.ScryptPasswordHasher',
+    'argon2': 'user.hashers.TunedArgon2PasswordHasher',  # 需要安装 argon2-cffi
+}
+_PREFERRED_PASSWORD_HASHER = _PASSWORD_HASHER_CHOICES[env('PASSWORD_HASHER', default='pbkdf2')]
+PASSWORD_HASHERS = [_PREFERRED_PASSWORD_HASHER] + [
+    name for name in _PASSWORD_HASHER_CHOICES.values() if name != _PREFERRED_PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+PASSWORD_HASHING = {
+    'PBKDF2_ITERATIONS': env.int('PBKDF2_ITERATIONS', default=260000),
+    'SCRYPT_WORK_FACTOR': env.int('SCRYPT_WORK_FACTOR', default=2 ** 14),  # n，内存约 128 * n * r 字节
+    'SCRYPT_BLOCK_SIZE': 8,
+    'SCRYPT_PARALLELISM': 1,
+    'ARGON2_TIME_COST': env.int('ARGON2_TIME_COST', default=2),
+    'ARGON2_MEMORY_COST': env.int('ARGON2_MEMORY_COST', default=102400),  # KiB
+    'ARGON2_PARALLELISM': env.int('ARGON2_PARALLELISM', default=8),
+    # 哈希进程池大小，0 表示在请求线程中计算；适合 gthread 等多线程 worker，同步 worker 启用后没有收益
+    'POOL_WORKERS': env.int('PASSWORD_HASH_WORKERS', default=0),
+    'POOL_MAX_PENDING': env.int('PASSWORD_HASH_MAX_PENDING', default=64),
+    'POOL_TIMEOUT': 10,  # 秒
+}
+
 # 国际化
 USE_I18N = True
 USE_L10N = True
@@ -148,9 +185,8 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # REST Framework 设置
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'user.authentication.BearerTokenAuthentication',  # 使用自定义认证类
-        'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
-        'rest_framework.authentication.SessionAuthentication',
+        # 按令牌形态分发到 DRF 令牌、签名令牌、OAuth2 或会话认证之一
+        'user.authentication.DispatchingAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -173,6 +209,136 @@ CACHES = {
     }
 }
 
+# 认证缓存设置：进程内 LRU + 共享缓存，失效消息通过 Redis pub/sub 广播
+AUTH_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'LOCAL_MAXSIZE': env.int('AUTH_CACHE_LOCAL_MAXSIZE', default=10000),
+    'LOCAL_TIMEOUT': env.int('AUTH_CACHE_LOCAL_TIMEOUT', default=30),  # 秒
+    'TIMEOUT': env.int('AUTH_CACHE_TIMEOUT', default=300),  # 秒
+    'PUBSUB_CHANNEL': 'usercenter:auth-cache:invalidate',
+}
+
+# DRF 令牌有效期，使用记录保存在缓存中，请求不写数据库
+TOKEN_EXPIRY = {
+    'ENABLED': env.bool('TOKEN_EXPIRY_ENABLED', default=True),
+    # 秒，自创建起，上线前签发的令牌从开始记录使用情况时算起
+    'ABSOLUTE_LIFETIME': env.int('TOKEN_ABSOLUTE_LIFETIME', default=86400 * 180),
+    'IDLE_TIMEOUT': env.int('TOKEN_IDLE_TIMEOUT', default=86400 * 30),  # 秒，自最后一次使用起
+    'TOUCH_INTERVAL': 300,  # 同一 worker 对同一令牌的续期间隔（秒）
+    'CACHE_ALIAS': 'default',
+    # 匿名用户只有令牌一个凭证，令牌不过期，账号由 purge_anonymous_users 清理
+    'EXEMPT_ANONYMOUS': env.bool('TOKEN_EXPIRY_EXEMPT_ANONYMOUS', default=True),
+}
+
+# 登录统计写缓冲：缓存为 Redis 时先写入 Redis，由 flush_login_stats 定期写回用户表
+LOGIN_STATS = {
+    'ENABLED': env.bool('LOGIN_STATS_BUFFER_ENABLED', default=True),
+    'CACHE_ALIAS': 'default',
+    'LAST_SEEN_INTERVAL': env.int('LOGIN_STATS_LAST_SEEN_INTERVAL', default=300),  # 秒
+    'FLUSH_BATCH_SIZE': 500,
+}
+
+# 应用前面的反向代理层数，客户端IP取 X-Forwarded-For 从右往左第该数个地址，0 表示忽略该请求头，见 user/utils.py
+TRUSTED_PROXY_COUNT = env.int('TRUSTED_PROXY_COUNT', default=1)
+
+# 接口限流（Redis 滑动窗口），频率格式为 '次数/周期'，见 user/ratelimit.py
+RATE_LIMITS = {
+    'ENABLED': env.bool('RATE_LIMITS_ENABLED', default=True),
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'ratelimit',
+    'POLICIES': {
+        'login': {
+            # 不按用户名单独限流：用户名由请求方填写，任何人都可以借此让指定用户无法登录
+            'rates': {'ip': '30/m'},
+            # 同一 IP 对同一用户名 15 分钟内失败 5 次后锁定 60 秒，之后每次失败锁定时长翻倍，最长 1 小时
+            'failures': {'keys': ['ip+username'], 'window': 900, 'threshold': 5, 'lockout': 60, 'max_lockout': 3600},
+        },
+        'register': {
+            'rates': {'ip': '10/h'},
+        },
+        'anonymous_login': {
+            'rates': {'ip': '30/h'},
+        },
+        'redeem_code': {
+            'rates': {'user': '10/h'},
+            'failures': {'keys': ['user'], 'window': 3600, 'threshold': 5, 'lockout': 300, 'max_lockout': 86400},
+        },
+        'feedback': {
+            'rates': {'ip': '10/h'},
+        },
+        'availability': {
+            'rates': {'ip': '120/m'},
+        },
+    },
+}
+
+# 匿名登录：同一设备复用匿名账号，设备 -> 用户ID 的映射缓存时长（秒）
+ANONYMOUS_LOGIN = {
+    'CACHE_ALIAS': 'default',
+    'DEVICE_CACHE_TIMEOUT': env.int('ANONYMOUS_DEVICE_CACHE_TIMEOUT', default=3600),
+    # 超过该天数未登录、未活跃的匿名用户由 purge_anonymous_users 删除
+    'PURGE_AFTER_DAYS': env.int('ANONYMOUS_PURGE_AFTER_DAYS', default=90),
+}
+
+# 幂等请求：注册、第三方登录、匿名登录和兑换优惠码支持 Idempotency-Key 请求头，见 user/idempotency.py
+IDEMPOTENCY = {
+    'ENABLED': env.bool('IDEMPOTENCY_ENABLED', default=True),
+    'CACHE_ALIAS': 'default',
+    'TTL': env.int('IDEMPOTENCY_TTL', default=86400),  # 响应保存的秒数
+    'WAIT_TIMEOUT': env.int('IDEMPOTENCY_WAIT_TIMEOUT', default=10),  # 重复请求等待首个请求完成的最长秒数
+}
+
+# 用户名、邮箱可用性检查使用的布隆过滤器，见 user/availability.py
+AVAILABILITY = {
+    'ENABLED': env.bool('AVAILABILITY_FILTER_ENABLED', default=True),
+    'CACHE_ALIAS': 'default',
+    'CAPACITY': env.int('AVAILABILITY_FILTER_CAPACITY', default=1000000),  # 用户名和邮箱各算一条
+    'ERROR_RATE': 0.001,
+}
+
+# 第三方登录提供商的 HTTP 客户端：长连接池、(连接超时, 读取超时) 秒和有限次数的重试，见 user/provider_http.py
+PROVIDER_HTTP = {
+    'TIMEOUTS': {
+        'default': (3.05, 10),
+        'wechat': (3.05, 5),
+        'apple': (3.05, 10),
+    },
+    'RETRIES': env.int('PROVIDER_HTTP_RETRIES', default=2),
+    'POOL_MAXSIZE': env.int('PROVIDER_HTTP_POOL_MAXSIZE', default=20),
+}
+
+# 苹果登录的 client_secret（ES256 签名的 JWT）按提供商缓存在 worker 中，见 user/apple.py
+APPLE_LOGIN = {
+    'CLIENT_SECRET_LIFETIME': 86400 * 180,  # 秒，苹果允许的最长有效期
+    'REFRESH_BEFORE': 86400,  # 距离过期不足该秒数时重新签名
+}
+
+# 第三方登录提供商配置的进程内注册表，worker 每隔 CHECK_INTERVAL 秒确认一次版本号，见 user/providers.py
+OAUTH_PROVIDER_REGISTRY = {
+    'CACHE_ALIAS': 'default',
+    'CHECK_INTERVAL': env.int('OAUTH_PROVIDER_REGISTRY_CHECK_INTERVAL', default=5),
+}
+
+# 批量令牌内省每次最多校验的令牌数
+TOKEN_INTROSPECTION_BATCH_LIMIT = env.int('TOKEN_INTROSPECTION_BATCH_LIMIT', default=500)
+
+# 令牌内省快速通道路径，由 wsgi.py/asgi.py 在中间件之前处理
+TOKEN_INTROSPECTION_PATH = '/api/auth/introspect/'
+
+# 签名访问令牌（JWT）设置，开启后登录接口额外返回 access_token 和 refresh_token
+SIGNED_TOKENS = {
+    'ENABLED': env.bool('SIGNED_TOKENS_ENABLED', default=False),
+    'ALGORITHM': 'RS256',
+    'PRIVATE_KEY': env('SIGNED_TOKENS_PRIVATE_KEY', default=''),  # PEM 格式的 RSA 私钥
+    'PRIVATE_KEY_PATH': env('SIGNED_TOKENS_PRIVATE_KEY_PATH', default=''),
+    'KEY_ID': env('SIGNED_TOKENS_KEY_ID', default=''),  # 为空时使用公钥指纹
+    'PREVIOUS_PUBLIC_KEYS': [],  # 密钥轮换期间仍然接受的旧公钥（PEM）
+    'ISSUER': 'usercenter',
+    'ACCESS_TOKEN_LIFETIME': env.int('SIGNED_TOKENS_ACCESS_LIFETIME', default=900),  # 秒
+    'REFRESH_TOKEN_LIFETIME': env.int('SIGNED_TOKENS_REFRESH_LIFETIME', default=86400 * 30),  # 秒
+    'JWKS_MAX_AGE': 3600,  # JWKS 响应的缓存时间（秒）
+}
+
 # 邮件设置
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = env('EMAIL_HOST', default='')
@@ -190,7 +356,9 @@ AUTH_USER_MODEL = 'user.User'
 
 # Django AllAuth设置
 AUTHENTICATION_BACKENDS = [
-    # Django管理后台登录
+    # 用户名或邮箱登录，一次查询、一次密码校验
+    'user.backends.UsernameOrEmailBackend',
+    # Django管理后台登录（兼容已有会话）
     'django.contrib.auth.backends.ModelBackend',
     # AllAuth邮箱登录
     'allauth.account.auth_backends.AuthenticationBackend',
@@ -207,10 +375,21 @@ SOCIALACCOUNT_ADAPTER = 'user.adapters.CustomSocialAccountAdapter'
 OAUTH2_PROVIDER = {
     'SCOPES': {'read': 'Read scope', 'write': 'Write scope'},
     'ACCESS_TOKEN_EXPIRE_SECONDS': 86400,  # 24小时
+    # 刷新令牌在吊销或其访问令牌过期超过该时长后由 purge_expired_oauth2 清理
+    'REFRESH_TOKEN_EXPIRE_SECONDS': env.int('OAUTH2_REFRESH_TOKEN_EXPIRE_SECONDS', default=86400 * 90),
+    'OAUTH2_VALIDATOR_CLASS': 'user.oauth.CachingOAuth2Validator',
+}
+
+# OAuth2 令牌端点：缓存客户端密钥校验结果，复用客户端凭证模式下未过期的访问令牌
+OAUTH2_TOKEN_ENDPOINT = {
+    'SECRET_CACHE_TIMEOUT': env.int('OAUTH2_SECRET_CACHE_TIMEOUT', default=300),  # 秒
+    'REUSE_CLIENT_CREDENTIALS_TOKENS': env.bool('OAUTH2_REUSE_CLIENT_CREDENTIALS_TOKENS', default=True),
+    'REUSE_MIN_REMAINING': 600,  # 剩余有效期不足该秒数的令牌不再复用
 }
 
 # CORS设置
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = list(default_headers) + ['idempotency-key']
 CORS_ORIGIN_WHITELIST = [
     'http://localhost:8000',
     'http://127.0.0.1:8000',
@@ -15,3 +15,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'UserCenter.settings')
 
 application = get_wsgi_application()
+
+# 令牌内省快速通道，在 Django 中间件之前处理
+from user.fastpath import IntrospectionWSGIApp  # noqa: E402
+
+application = IntrospectionWSGIApp(application)
@@ -0,0 +1,45 @@
+"""
+匿名登录 /api/anonymous/login/ 的吞吐
+
+    python benchmarks/bench_anonymous_login.py [--iterations 300]
+
+使用 Django 默认的 PBKDF2 哈希器，每次请求创建一个新的匿名用户和令牌，同时统计每次登录的 SQL 语句数。
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.utils import measure, report, setup_django  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=300)
+    args = parser.parse_args()
+
+    from django.conf import global_settings
+    setup_django(PASSWORD_HASHERS=global_settings.PASSWORD_HASHERS)
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client()
+
+    def anonymous_login():
+        response = client.post('/api/anonymous/login/')
+        assert response.status_code == 200, response.content
+
+    with CaptureQueriesContext(connection) as queries:
+        anonymous_login()
+    writes = [q for q in queries.captured_queries if not q['sql'].startswith('SELECT')]
+    print(f'SQL per login: {len(queries.captured_queries)} ({len(writes)} writes)')
+
+    latencies, elapsed = measure(anonymous_login, args.iterations, warmup=10)
+    report('anonymous login', latencies, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+客户端凭证模式令牌端点 /o/token/ 的吞吐对比
+
+    python benchmarks/bench_client_credentials.py [--iterations 200]
+
+客户端密钥使用 Django 默认的 PBKDF2 哈希保存，分别用 DOT 默认校验器和 CachingOAuth2Validator
+处理同一客户端的重复令牌请求。
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.utils import measure, report, setup_django  # noqa: E402
+
+VALIDATORS = (
+    ('oauth2_provider.oauth2_validators.OAuth2Validator', 'DOT OAuth2Validator'),
+    ('user.oauth.CachingOAuth2Validator', 'CachingOAuth2Validator'),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    from django.conf import global_settings
+    setup_django(PASSWORD_HASHERS=global_settings.PASSWORD_HASHERS)
+
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.test import Client
+    from django.test.utils import override_settings
+    from oauth2_provider.models import Application
+
+    secret = 'benchmark-client-secret'
+    application = Application.objects.create(
+        name='benchmark',
+        client_type=Application.CLIENT_CONFIDENTIAL,
+        authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS,
+        client_secret=secret,
+    )
+    client = Client()
+    data = {
+        'grant_type': 'client_credentials',
+        'client_id': application.client_id,
+        'client_secret': secret,
+        'scope': 'read',
+    }
+
+    def request_token():
+        response = client.post('/o/token/', data)
+        assert response.status_code == 200, response.content
+
+    for validator_class, name in VALIDATORS:
+        cache.clear()
+        # TokenView 默认缓存首次创建的 oauthlib 核心，这里每次请求重新创建以便切换校验器
+        oauth2_provider = {
+            **settings.OAUTH2_PROVIDER,
+            'OAUTH2_VALIDATOR_CLASS': validator_class,
+            'ALWAYS_RELOAD_OAUTHLIB_CORE': True,
+        }
+        with override_settings(OAUTH2_PROVIDER=oauth2_provider):
+            latencies, elapsed = measure(request_token, args.iterations, warmup=5)
+        report(name, latencies, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+令牌内省快速通道与 /api/users/me/ 的对比
+
+    python benchmarks/bench_introspection.py [--iterations 5000]
+
+两条路径都在同一个 WSGI 入口上调用，令牌缓存已预热，
+差别来自中间件、URL 解析、DRF 认证/内容协商和序列化。
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.utils import measure, report, setup_django  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from django.test.client import RequestFactory
+    from rest_framework.authtoken.models import Token
+
+    from UserCenter.wsgi import application
+
+    user = get_user_model().objects.create_user(username='bench', password='benchpassword123')
+    token = Token.objects.create(user=user)
+
+    def call(path):
+        environ = RequestFactory()._base_environ(
+            PATH_INFO=path,
+            REQUEST_METHOD='GET',
+            HTTP_AUTHORIZATION=token.key,
+            HTTP_ACCEPT='application/json',
+        )
+
+        def run():
+            response = application(dict(environ), lambda status, headers, exc_info=None: None)
+            b''.join(response)
+            close = getattr(response, 'close', None)
+            if close is not None:
+                close()
+        return run
+
+    for name, path in (('fast path /api/auth/introspect/', '/api/auth/introspect/'),
+                       ('django /api/users/me/', '/api/users/me/')):
+        latencies, elapsed = measure(call(path), args.iterations)
+        report(name, latencies, elapsed)
+
+
+if __name__ == '__main__':
+    main()
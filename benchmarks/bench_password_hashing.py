@@ -0,0 +1,87 @@
+"""
+各密码哈希配置下的登录吞吐
+
+    python benchmarks/bench_password_hashing.py [--iterations 20] [--pool-workers 4]
+
+每种配置先用该配置创建用户，再重复调用 authenticate()（一次查询 + 一次校验，不触发升级）。
+Argon2 的 parallelism 会使用多个线程，因此按进程 CPU 时间折算每核每秒登录数，
+而不是直接使用墙钟吞吐。--pool-workers 大于 0 时另外测量多线程经进程池校验的总吞吐。
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.utils import measure, report, setup_django  # noqa: E402
+
+CONFIGS = (
+    ('pbkdf2 260000', 'user.hashers.TunedPBKDF2PasswordHasher', {'PBKDF2_ITERATIONS': 260000}),
+    ('pbkdf2 600000', 'user.hashers.TunedPBKDF2PasswordHasher', {'PBKDF2_ITERATIONS': 600000}),
+    ('scrypt n=2^14 r=8 p=1', 'user.hashers.ScryptPasswordHasher', {'SCRYPT_WORK_FACTOR': 2 ** 14}),
+    ('scrypt n=2^15 r=8 p=1', 'user.hashers.ScryptPasswordHasher', {'SCRYPT_WORK_FACTOR': 2 ** 15}),
+    ('argon2 t=2 m=100MiB p=8', 'user.hashers.TunedArgon2PasswordHasher', {}),
+    ('argon2 t=3 m=64MiB p=1', 'user.hashers.TunedArgon2PasswordHasher', {
+        'ARGON2_TIME_COST': 3, 'ARGON2_MEMORY_COST': 65536, 'ARGON2_PARALLELISM': 1,
+    }),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--pool-workers', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.contrib.auth import authenticate, get_user_model
+    from django.test.utils import override_settings
+
+    from user import hashers
+
+    User = get_user_model()
+    password = 'benchmark-password-123'
+    print(f'cpu_count={os.cpu_count()}')
+
+    for index, (name, hasher, params) in enumerate(CONFIGS):
+        with override_settings(PASSWORD_HASHERS=[hasher], PASSWORD_HASHING=params):
+            try:
+                User.objects.create_user(username=f'bench{index}', password=password)
+            except ImportError:
+                print(f'{name:<32} 跳过：未安装依赖')
+                continue
+
+            def login():
+                assert authenticate(username=f'bench{index}', password=password) is not None
+
+            cpu_started = time.process_time()
+            latencies, elapsed = measure(login, args.iterations, warmup=2)
+            cpu_seconds = time.process_time() - cpu_started
+            report(name, latencies, elapsed)
+            # measure() 包含 warmup，CPU 时间按总次数折算
+            print(f'{"":<32} logins/s/core={(args.iterations + 2) / cpu_seconds:8.1f}')
+
+            if args.pool_workers <= 0:
+                continue
+            encoded = User.objects.get(username=f'bench{index}').password
+            pool_params = {**params, 'POOL_WORKERS': args.pool_workers}
+            with override_settings(PASSWORD_HASHING=pool_params):
+                hashers.run(os.getpid)  # 预先启动进程池
+                total = args.iterations * args.pool_workers
+                started = time.perf_counter()
+                with ThreadPoolExecutor(args.pool_workers * 2) as executor:
+                    results = list(executor.map(
+                        lambda _: hashers.check_password(password, encoded), range(total)
+                    ))
+                elapsed = time.perf_counter() - started
+                hashers.shutdown_pool()
+            assert all(results)
+            print(f'{"":<32} pool({args.pool_workers}) logins/s={total / elapsed:8.1f} '
+                  f'per worker={total / elapsed / args.pool_workers:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+基准测试公共工具
+
+使用测试环境设置（内存 SQLite + 本地内存缓存），关闭 DEBUG 和调试工具栏，
+结果只用于同一台机器上前后对比，不代表线上绝对值。
+"""
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(**overrides):
+    """初始化 Django 并建表，overrides 用于覆盖设置"""
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_ENV', 'testing')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'UserCenter.settings')
+
+    import django
+    from django.conf import settings
+
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+
+    overrides.setdefault('DEBUG', False)
+    overrides.setdefault(
+        'MIDDLEWARE', [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar')]
+    )
+    override_settings(**overrides).enable()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def measure(func, iterations, warmup=100):
+    """执行 func 若干次，返回每次耗时（秒）和总耗时"""
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - begin)
+    return latencies, time.perf_counter() - started
+
+
+def percentile(latencies, value):
+    ordered = sorted(latencies)
+    index = min(len(ordered) - 1, int(round(value / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, latencies, elapsed):
+    """输出 p50/p99 延迟（微秒）和单 worker 吞吐"""
+    print(
+        f'{name:<32} p50={percentile(latencies, 50) * 1e6:9.1f}us '
+        f'p99={percentile(latencies, 99) * 1e6:9.1f}us '
+        f'mean={statistics.mean(latencies) * 1e6:9.1f}us '
+        f'rps/worker={len(latencies) / elapsed:10.0f}'
+    )
@@ -1,6 +1,6 @@
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from django.utils import timezone
 from django.utils.translation import gettext as _
@@ -10,6 +10,9 @@ import string
 
 from .models import MagicCode, MagicCodeUsage
 from .serializers import MagicCodeSerializer, MagicCodeUsageSerializer, RedeemCodeSerializer
+from user import ratelimit
+from user.idempotency import idempotent
+from user.ratelimit import RedeemCodeThrottle
 from user.utils import api_response, datetime_to_timestamp
 
 logger = logging.getLogger(__name__)
@@ -147,6 +150,8 @@ class MagicCodeViewSet(viewsets.ModelViewSet):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes([RedeemCodeThrottle])
+@idempotent('redeem_code')
 def redeem_code(request):
     """兑换优惠码"""
     serializer = RedeemCodeSerializer(data=request.data)
@@ -183,6 +188,7 @@ def redeem_code(request):
                 }
             ))
         else:
+            ratelimit.record_failure('redeem_code', request)
             return Response(api_response(
                 code=402,
                 message=_('优惠码无效或已过期'),
@@ -190,6 +196,8 @@ def redeem_code(request):
             ), status=status.HTTP_400_BAD_REQUEST)
     
     except MagicCode.DoesNotExist:
+        # 连续猜错优惠码后临时锁定
+        ratelimit.record_failure('redeem_code', request)
         return Response(api_response(
             code=404,
             message=_('优惠码不存在'),
@@ -3,6 +3,8 @@ from allauth.socialaccount.adapter import DefaultSocialAccountAdapter
 from django.conf import settings
 from django.http import HttpRequest
 
+from . import login_stats
+
 class CustomAccountAdapter(DefaultAccountAdapter):
     """
     自定义账号适配器
@@ -44,14 +46,8 @@ class CustomSocialAccountAdapter(DefaultSocialAccountAdapter):
         user.is_verified = True
         user.save()
         
-        # 记录登录IP
+        # 记录登录统计
         if request:
-            x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-            if x_forwarded_for:
-                user.last_login_ip = x_forwarded_for.split(',')[0]
-            else:
-                user.last_login_ip = request.META.get('REMOTE_ADDR')
-            user.login_count += 1
-            user.save(update_fields=['last_login_ip', 'login_count'])
+            login_stats.record_login(user, request)
         
         return user 
\ No newline at end of file
@@ -1,9 +1,26 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.auth.forms import UserCreationForm
 from django.utils.translation import gettext_lazy as _
 from .models import User, OAuthProvider, UserOAuth
+from . import login_stats, providers
+from .usernames import save_with_unique_username
 from django.contrib import messages
 
+
+class UserAdminCreationForm(UserCreationForm):
+    """后台新建用户的表单，用户名可以留空，由系统按邮箱生成"""
+    
+    class Meta(UserCreationForm.Meta):
+        model = User
+        fields = ('username', 'email')
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['username'].required = False
+        self.fields['username'].help_text = _('留空时根据邮箱生成，生成的用户名已被占用时自动加随机后缀')
+
+
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     list_display = ('id', 'username', 'email', 'nickname', 'phone', 'is_verified', 'is_staff', 'date_joined', 'is_premium', 'premium_expiry')
@@ -15,10 +32,50 @@ class UserAdmin(BaseUserAdmin):
         (_('状态信息'), {'fields': ('is_verified', 'is_premium', 'premium_expiry')}),
         (_('权限'), {'fields': ('is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions')}),
         (_('设置'), {'fields': ('language', 'timezone')}),
-        (_('统计'), {'fields': ('login_count', 'last_login_ip')}),
-        (_('重要日期'), {'fields': ('last_login', 'date_joined')}),
+        (_('统计'), {'fields': ('buffered_login_count', 'buffered_last_login_ip', 'buffered_last_seen')}),
+        (_('重要日期'), {'fields': ('buffered_last_login', 'date_joined')}),
+    )
+    add_form = UserAdminCreationForm
+    add_fieldsets = (
+        (None, {
+            'classes': ('wide',),
+            'fields': ('username', 'email', 'password1', 'password2'),
+        }),
     )
-    readonly_fields = ('login_count', 'last_login_ip', 'last_login', 'date_joined')
+    # 登录统计合并 Redis 中尚未写回的值，只读展示，保存时不会写回这些字段
+    readonly_fields = ('buffered_login_count', 'buffered_last_login_ip', 'buffered_last_seen', 'buffered_last_login', 'date_joined')
+    
+    def merged_login_stats(self, obj):
+        if not hasattr(obj, '_login_stats'):
+            entry = login_stats.pending([obj.pk]).get(obj.pk, {})
+            obj._login_stats = login_stats.merged(obj, entry)
+        return obj._login_stats
+    
+    @admin.display(description=_('登录次数'))
+    def buffered_login_count(self, obj):
+        return self.merged_login_stats(obj)['login_count']
+    
+    @admin.display(description=_('最后登录IP'))
+    def buffered_last_login_ip(self, obj):
+        return self.merged_login_stats(obj)['last_login_ip']
+    
+    @admin.display(description=_('最后活跃时间'))
+    def buffered_last_seen(self, obj):
+        return self.merged_login_stats(obj)['last_seen']
+    
+    @admin.display(description=_('上次登录'))
+    def buffered_last_login(self, obj):
+        return self.merged_login_stats(obj)['last_login']
+    
+    def save_model(self, request, obj, form, change):
+        if change:
+            return super().save_model(request, obj, form, change)
+        # 新建用户与第三方登录使用同一个用户名分配逻辑，并发创建同名用户时不会报错
+        requested = obj.username
+        base = requested or (obj.email.split('@')[0] if obj.email else '') or 'user'
+        save_with_unique_username(obj, base)
+        if obj.username != requested:
+            self.message_user(request, f"用户名已设为 {obj.username}", level=messages.INFO)
 
 @admin.register(OAuthProvider)
 class OAuthProviderAdmin(admin.ModelAdmin):
@@ -44,6 +101,7 @@ class OAuthProviderAdmin(admin.ModelAdmin):
                 self.message_user(request, f"读取私钥文件失败: {str(e)}", level=messages.ERROR)
         
         super().save_model(request, obj, form, change)
+        providers.invalidate()
 
 @admin.register(UserOAuth)
 class UserOAuthAdmin(admin.ModelAdmin):
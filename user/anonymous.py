@@ -0,0 +1,170 @@
+"""
+匿名账号
+
+移动端在重装、冷启动和重试时都会调用匿名登录。请求带有设备标识时复用该设备已有的匿名账号：
+先查缓存中的 设备 -> 用户ID 映射，未命中时按 (device_id, is_anonymous_user) 部分唯一索引查询，
+都没有时才创建新账号。多个请求同时首次登录时由唯一约束兜底，冲突的一方改为读取已创建的账号。
+
+长期不活跃、也没有转为正式用户的匿名账号由 purge_anonymous_users 分批删除。
+"""
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import login_stats, token_expiry
+from .authentication import create_token, issue_token, token_cache
+from .utils import get_client_ip
+
+logger = logging.getLogger('user')
+
+User = get_user_model()
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'DEVICE_CACHE_TIMEOUT': 3600,
+    'PURGE_AFTER_DAYS': 90,
+}
+
+
+def get_config():
+    """读取 ANONYMOUS_LOGIN 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'ANONYMOUS_LOGIN', {}))
+    return config
+
+
+def device_cache_key(device_id):
+    # 设备标识由客户端提供，长度和字符不受控，缓存键使用摘要
+    return 'anon_device:' + hashlib.sha256(device_id.encode('utf-8')).hexdigest()
+
+
+def find_device_user(device_id):
+    """查找设备对应的匿名账号，不存在时返回 None"""
+    config = get_config()
+    cache = caches[config['CACHE_ALIAS']]
+    cache_key = device_cache_key(device_id)
+
+    user_id = cache.get(cache_key)
+    if user_id is not None:
+        # 映射可能已过时（账号已转正或被清理），以数据库为准
+        user = User.objects.filter(pk=user_id, device_id=device_id, is_anonymous_user=True).first()
+        if user is not None:
+            return user
+
+    user = User.objects.filter(device_id=device_id, is_anonymous_user=True).first()
+    if user is None:
+        if user_id is not None:
+            cache.delete(cache_key)
+        return None
+    cache.set(cache_key, user.pk, config['DEVICE_CACHE_TIMEOUT'])
+    return user
+
+
+def _reuse(user, request):
+    if not user.is_active:
+        return user, None, False
+    token, _ = issue_token(user)
+    login_stats.record_login(user, request)
+    return user, token, False
+
+
+def anonymous_login(request, device_id=None):
+    """
+    匿名登录，返回 (用户, 令牌, 是否新建)
+
+    带设备标识时优先复用该设备的匿名账号；复用的账号已被禁用时令牌为 None。
+    """
+    if device_id:
+        user = find_device_user(device_id)
+        if user is not None:
+            return _reuse(user, request)
+
+    # 匿名用户使用不可用密码（无需计算哈希），登录信息随创建一起写入，
+    # 用户和令牌在同一事务中各插入一次
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            user = User.objects.create_anonymous_user(
+                username=f"anon_{uuid.uuid4().hex[:12]}",
+                nickname="username",
+                device_id=device_id or None,
+                login_count=1,
+                last_login=now,
+                last_seen=now,
+                last_login_ip=get_client_ip(request),
+            )
+            token = create_token(user)
+    except IntegrityError:
+        # 同一设备的并发请求已经创建了账号
+        user = find_device_user(device_id) if device_id else None
+        if user is None:
+            raise
+        return _reuse(user, request)
+
+    if device_id:
+        config = get_config()
+        caches[config['CACHE_ALIAS']].set(device_cache_key(device_id), user.pk, config['DEVICE_CACHE_TIMEOUT'])
+    return user, token, True
+
+
+def stale_users(cutoff):
+    """
+    最后一次登录早于 cutoff 的匿名用户，没有登录时间的按注册时间
+
+    条件落在 (is_anonymous_user, last_login) 索引上，最后活跃时间由 purge_users 在删除前核对。
+    """
+    return User.objects.filter(is_anonymous_user=True).filter(
+        Q(last_login__lt=cutoff) | Q(last_login__isnull=True, date_joined__lt=cutoff)
+    )
+
+
+def _recently_active(user_ids, cutoff):
+    """缓冲中的登录统计表明 cutoff 之后仍有活动的用户ID"""
+    active = set()
+    for user_id, entry in login_stats.pending(user_ids).items():
+        if any(entry.get(name) and entry[name] >= cutoff for name in login_stats.TIMESTAMP_FIELDS):
+            active.add(user_id)
+    return active
+
+
+def purge_users(user_ids, cutoff):
+    """
+    删除一批不活跃的匿名用户，令牌、第三方账号关联和优惠码使用记录随之级联删除
+
+    删除前在事务中锁定并重新核对条件，期间登录过、使用过令牌或已转为正式用户的账号会被跳过。
+
+    Returns:
+        (删除的用户数, {模型: 删除的记录数})
+    """
+    skip = _recently_active(user_ids, cutoff)
+    with transaction.atomic():
+        rows = list(
+            stale_users(cutoff)
+            .filter(pk__in=[user_id for user_id in user_ids if user_id not in skip])
+            .filter(Q(last_seen__isnull=True) | Q(last_seen__lt=cutoff))
+            .select_for_update()
+            .values_list('pk', 'device_id')
+        )
+        if not rows:
+            return 0, {}
+        ids = [user_id for user_id, _ in rows]
+        keys = list(Token.objects.filter(user_id__in=ids).values_list('key', flat=True))
+        _, per_model = User.objects.filter(pk__in=ids).delete()
+
+    # 提交后再清理缓存，认证缓存和设备映射不再指向已删除的用户
+    token_cache.delete(*(f'uid:{user_id}' for user_id in ids), *keys)
+    if keys:
+        token_expiry.forget(keys)
+    device_keys = [device_cache_key(device_id) for _, device_id in rows if device_id]
+    if device_keys:
+        caches[get_config()['CACHE_ALIAS']].delete_many(device_keys)
+    login_stats.discard(ids)
+    return per_model.get(User._meta.label, 0), per_model
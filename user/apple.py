@@ -0,0 +1,131 @@
+"""
+苹果登录的客户端密钥
+
+苹果要求用开发者私钥以 ES256 签名的 JWT 作为 client_secret，有效期最长 180 天。
+原来每次苹果登录都要读取私钥文件、解析 PEM 并签名一次，这里按提供商缓存在当前 worker 中：
+
+- 解析后的私钥对象按私钥内容的摘要缓存，同一私钥只解析一次；
+- 签名后的 client_secret 按提供商缓存，距离过期不足 REFRESH_BEFORE 秒时重新签名；
+- 缓存条目带有 team_id、client_id、key_id、私钥内容（或私钥文件名）的摘要，
+  管理员修改这些字段后，下一次登录取到的提供商配置与缓存不一致，自动重新生成。
+
+常见情况下苹果登录不再读取文件，也不做任何加解密运算。
+"""
+import hashlib
+import logging
+import threading
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from django.conf import settings
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    'CLIENT_SECRET_LIFETIME': 86400 * 180,  # 苹果允许的最长有效期
+    'REFRESH_BEFORE': 86400,  # 距离过期不足该秒数时重新签名
+}
+
+AUDIENCE = 'https://appleid.apple.com'
+
+_lock = threading.Lock()
+# 提供商主键 -> (配置摘要, client_secret, 过期时间)
+_secrets = {}
+# 私钥内容摘要 -> 解析后的私钥对象
+_keys = {}
+
+
+def get_config():
+    """读取 APPLE_LOGIN 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'APPLE_LOGIN', {}))
+    return config
+
+
+def config_fingerprint(provider):
+    """参与签名的字段的摘要，私钥只在数据库中保存文件路径时以文件名代替内容"""
+    key_source = provider.private_key or (provider.private_key_path.name if provider.private_key_path else '')
+    message = '\x00'.join([provider.team_id, provider.client_id, provider.key_id, key_source])
+    return hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+
+def read_private_key(provider):
+    """私钥内容，数据库中没有时从私钥文件读取"""
+    if provider.private_key or not provider.private_key_path:
+        return provider.private_key
+    try:
+        logger.info("从文件读取私钥: %s", provider.private_key_path)
+        return provider.private_key_path.read().decode('utf-8')
+    except Exception as e:
+        logger.error("读取苹果私钥文件失败: %s", e)
+        raise ValueError(f"读取苹果私钥文件失败: {str(e)}")
+    finally:
+        provider.private_key_path.close()
+
+
+def load_private_key(pem):
+    """解析 PEM 私钥，同一私钥在当前 worker 中只解析一次"""
+    digest = hashlib.sha256(pem.encode('utf-8')).hexdigest()
+    key = _keys.get(digest)
+    if key is None:
+        key = serialization.load_pem_private_key(pem.encode('utf-8'), password=None)
+        with _lock:
+            _keys[digest] = key
+    return key
+
+
+def sign_client_secret(provider, config=None):
+    """签名新的 client_secret，返回 (client_secret, 过期时间)"""
+    config = config or get_config()
+    private_key = read_private_key(provider)
+
+    missing = [
+        name for name, value in (
+            ('team_id', provider.team_id), ('client_id', provider.client_id),
+            ('key_id', provider.key_id), ('private_key', private_key),
+        ) if not value
+    ]
+    if missing:
+        raise ValueError(f"苹果登录配置不完整，缺少: {', '.join(missing)}")
+
+    logger.info(
+        "生成Apple客户端密钥: team_id=%s, client_id=%s, key_id=%s",
+        provider.team_id, provider.client_id, provider.key_id,
+    )
+    now = int(time.time())
+    expires_at = now + config['CLIENT_SECRET_LIFETIME']
+    payload = {
+        'iss': provider.team_id,
+        'iat': now,
+        'exp': expires_at,
+        'aud': AUDIENCE,
+        'sub': provider.client_id,
+    }
+    client_secret = jwt.encode(
+        payload, load_private_key(private_key), algorithm='ES256', headers={'kid': provider.key_id}
+    )
+    return client_secret, expires_at
+
+
+def client_secret(provider):
+    """提供商当前的 client_secret，缓存未命中、配置已变化或即将过期时重新签名"""
+    config = get_config()
+    fingerprint = config_fingerprint(provider)
+    entry = _secrets.get(provider.pk)
+    if entry is not None:
+        cached_fingerprint, secret, expires_at = entry
+        if cached_fingerprint == fingerprint and time.time() < expires_at - config['REFRESH_BEFORE']:
+            return secret
+
+    secret, expires_at = sign_client_secret(provider, config)
+    with _lock:
+        _secrets[provider.pk] = (fingerprint, secret, expires_at)
+    return secret
+
+
+def clear():
+    """清空当前 worker 的缓存"""
+    with _lock:
+        _secrets.clear()
+        _keys.clear()
@@ -1,20 +1,361 @@
-from rest_framework.authentication import TokenAuthentication
+import hashlib
+import os
+import re
+
+import jwt
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.models import get_access_token_model, get_application_model
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, SessionAuthentication, TokenAuthentication
 from rest_framework.authtoken.models import Token
 
+from . import login_stats, token_expiry, tokens
+from .cache import TwoTierCache
+from .principal import PRINCIPAL_FIELDS, PrincipalUser, build_principal
+from .utils import datetime_to_timestamp
+
+User = get_user_model()
+
+# 令牌（或 uid:<用户ID>）-> 认证主体 的两级缓存
+token_cache = TwoTierCache('principal')
+
+# OAuth2 访问令牌摘要 -> 已校验的访问令牌字段 的两级缓存
+oauth2_cache = TwoTierCache('oauth2')
+
+# 缓存的访问令牌和应用字段，覆盖 is_valid() 和权限判断所需的列
+ACCESS_TOKEN_FIELDS = ('id', 'user_id', 'application_id', 'expires', 'scope', 'created', 'updated')
+APPLICATION_FIELDS = ('id', 'client_id', 'user_id', 'client_type', 'authorization_grant_type', 'name', 'skip_authorization')
+
+
+def load_principals(keys):
+    """
+    从数据库批量加载令牌对应的认证主体（一次查询），并写入缓存
+
+    返回 ({令牌: 认证主体}, {令牌: 创建时间})
+    """
+    principals = {}
+    created = {}
+    for token in Token.objects.filter(key__in=keys).select_related('user').only(
+        'key', 'user_id', 'created', *(f'user__{name}' for name in PRINCIPAL_FIELDS)
+    ):
+        principals[token.key] = build_principal(token.user)
+        created[token.key] = token.created
+    token_cache.set_many(principals)
+    return principals, created
+
+
+def resolve_principals(keys):
+    """
+    批量解析 DRF 令牌
+
+    先查询两级缓存，未命中的令牌合并为一次数据库查询，结果写回缓存。
+    返回 {令牌: 认证主体}，无效或已过期的令牌不在结果中。有效令牌的用户记录最后活跃时间，
+    只经网关内省使用的匿名账号不会被当作不活跃清理。
+    """
+    principals = token_cache.get_many(keys)
+    created = {}
+    missing = [key for key in keys if key not in principals]
+    if missing:
+        loaded, created = load_principals(missing)
+        principals.update(loaded)
+    principals = drop_expired(principals, created)
+    login_stats.touch_many([principal.id for principal in principals.values() if principal.is_active])
+    return principals
+
+
+def introspection_payload(principal):
+    """令牌内省结果，付费状态按到期时间实时计算"""
+    return {
+        'user_id': principal.id,
+        'active': principal.is_active,
+        'is_premium': principal.premium_active,
+        'premium_expiry': datetime_to_timestamp(principal.premium_expiry),
+        'is_anonymous_user': principal.is_anonymous_user,
+    }
+
+
+def user_principal(user_id):
+    """
+    按用户ID获取认证主体，签名令牌和 OAuth2 访问令牌共用 uid:<用户ID> 缓存
+
+    Raises:
+        User.DoesNotExist: 用户不存在
+    """
+    cache_key = f'uid:{user_id}'
+    principal = token_cache.get(cache_key)
+    if principal is None:
+        principal = build_principal(User.objects.only(*PRINCIPAL_FIELDS).get(pk=user_id))
+        token_cache.set(cache_key, principal)
+    return principal
+
+
+def oauth2_cache_key(token):
+    """OAuth2 缓存键使用令牌摘要，缓存中不保存令牌原文"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _from_db(model, values):
+    # from_db 要求取值顺序与模型字段定义顺序一致
+    field_names = [f.attname for f in model._meta.concrete_fields if f.attname in values]
+    return model.from_db(router.db_for_read(model), field_names, [values[name] for name in field_names])
+
+
+def invalidate_user_tokens(user_id):
+    """使用户所有令牌的缓存失效，需在删除令牌之前调用"""
+    keys = list(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+    token_cache.delete(f'uid:{user_id}', *keys)
+
+
+def revoke_tokens(keys):
+    """删除令牌，同时清理认证缓存和使用记录"""
+    token_cache.delete(*keys)
+    token_expiry.forget(keys)
+    Token.objects.filter(key__in=keys).delete()
+
+
+def drop_expired(principals, created=None):
+    """
+    从 {令牌: 认证主体} 中去掉已过期的令牌并将其删除，有效令牌随之续期
+
+    created 为已知的 {令牌: 创建时间}，可以省去一次查询
+    """
+    created = created or {}
+    anonymous = {key for key, principal in principals.items() if principal.is_anonymous_user}
+    active = token_expiry.active_tokens({key: created.get(key) for key in principals}, exempt=anonymous)
+    expired = [key for key in principals if key not in active]
+    if expired:
+        revoke_tokens(expired)
+    return {key: principal for key, principal in principals.items() if key in active}
+
+
+def issue_token(user):
+    """
+    获取或创建用户的 DRF 令牌，并记录一次使用
+
+    已过期的令牌会被替换为新令牌。返回 (令牌, 是否新建)。
+    """
+    token, created = Token.objects.get_or_create(user=user)
+    exempt = {token.key} if user.is_anonymous_user else ()
+    if not created and token_expiry.expired_tokens({token.key: token.created}, exempt=exempt):
+        revoke_tokens([token.key])
+        token, created = Token.objects.get_or_create(user=user)
+    token_expiry.record_activity(token)
+    return token, created
+
+
+def create_token(user):
+    """为新建的用户创建 DRF 令牌并记录一次使用，不查询已有令牌"""
+    token = Token.objects.create(user=user)
+    token_expiry.record_activity(token)
+    return token
+
+
 class BearerTokenAuthentication(TokenAuthentication):
     """
     自定义令牌认证类，允许不带前缀的令牌
     不需要 'Token' 前缀，直接使用令牌值
     """
     keyword = ''  # 空字符串意味着不需要前缀
-    
+
     def authenticate(self, request):
         auth = request.META.get('HTTP_AUTHORIZATION', '').strip()
         if not auth:
             return None
-            
+
+        # 迁移期间同时接受签名令牌（可带 Bearer 前缀）和 DRF 令牌
+        signed = auth[len('Bearer '):].strip() if auth.startswith('Bearer ') else auth
+        if tokens.looks_like_jwt(signed):
+            return self.authenticate_signed(signed)
+        return self.authenticate_key(auth)
+
+    def authenticate_key(self, key):
+        """校验 DRF 令牌，优先使用缓存的认证主体"""
+        principal = token_cache.get(key)
+        created = None
+        if principal is None:
+            try:
+                token = Token.objects.select_related('user').only(
+                    'key', 'user_id', 'created', *(f'user__{name}' for name in PRINCIPAL_FIELDS)
+                ).get(key=key)
+            except Token.DoesNotExist:
+                return None
+            principal = build_principal(token.user)
+            created = token.created
+            token_cache.set(key, principal)
+
+        exempt = {key} if principal.is_anonymous_user else ()
+        if key not in token_expiry.active_tokens({key: created}, exempt=exempt):
+            revoke_tokens([key])
+            raise exceptions.AuthenticationFailed(_('令牌已过期'))
+        if not principal.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (PrincipalUser(principal), Token(key=key, user_id=principal.id))
+
+    def authenticate_signed(self, value):
+        """校验签名访问令牌，认证主体按用户ID缓存"""
+        try:
+            claims = tokens.decode_signed_token(value)
+        except jwt.InvalidTokenError:
+            raise exceptions.AuthenticationFailed(_('令牌无效或已过期'))
+
+        try:
+            principal = user_principal(claims['sub'])
+        except User.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('用户不存在'))
+
+        if not principal.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (PrincipalUser(principal), claims)
+
+
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """
+    缓存校验通过的 OAuth2 访问令牌
+
+    缓存中保存访问令牌和应用的少量字段，有效期不超过令牌本身的 expires；命中后仍按 is_valid()
+    检查过期时间和权限范围。令牌被吊销、刷新或修改时由 signals.py 中的信号处理删除缓存。
+    用户信息与签名令牌共用 uid:<用户ID> 认证主体缓存，随用户信息变更一起失效。
+    """
+
+    def authenticate(self, request):
+        auth = request.META.get('HTTP_AUTHORIZATION', '').strip()
+        value = auth[len('Bearer '):].strip() if auth.startswith('Bearer ') else ''
+        if not value:
+            return super().authenticate(request)
+
+        cache_key = oauth2_cache_key(value)
+        entry = oauth2_cache.get(cache_key)
+        if entry is not None:
+            access_token = self.restore(value, entry)
+            if access_token.is_valid():
+                return (self.get_user(access_token.user_id), access_token)
+            oauth2_cache.delete(cache_key)
+
+        result = super().authenticate(request)
+        if result is None:
+            return None
+        user, access_token = result
+        self.store(cache_key, user, access_token)
+        # 与命中缓存时一样返回精简主体，request.user 的类型不随缓存状态变化
+        return (self.get_user(access_token.user_id), access_token)
+
+    def get_user(self, user_id):
+        if user_id is None:
+            # 客户端凭证模式的令牌不属于任何用户
+            return None
         try:
-            token = Token.objects.get(key=auth)
-            return (token.user, token)
-        except Token.DoesNotExist:
-            return None 
\ No newline at end of file
+            return PrincipalUser(user_principal(user_id))
+        except User.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+    def restore(self, value, entry):
+        access_token = _from_db(get_access_token_model(), {**entry['token'], 'token': value})
+        access_token.application = _from_db(get_application_model(), entry['application'])
+        return access_token
+
+    def store(self, cache_key, user, access_token):
+        timeout = int((access_token.expires - timezone.now()).total_seconds())
+        if timeout <= 0:
+            return
+        application = access_token.application
+        oauth2_cache.set(cache_key, {
+            'token': {name: getattr(access_token, name) for name in ACCESS_TOKEN_FIELDS},
+            'application': {name: getattr(application, name) for name in APPLICATION_FIELDS},
+        }, timeout)
+        if user is not None:
+            token_cache.set(f'uid:{user.pk}', build_principal(user))
+
+
+# DRF 令牌为 40 位十六进制（Token.generate_key）
+DRF_TOKEN_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
+
+def split_authorization(auth):
+    """
+    把 Authorization 头拆分为 (小写的认证方案, 凭证)
+
+    不带认证方案的头（直接是令牌值）返回 ('', 令牌值)。
+    """
+    auth = auth.strip()
+    scheme, _, credentials = auth.partition(' ')
+    credentials = credentials.strip()
+    if not credentials:
+        return '', auth
+    return scheme.lower(), credentials
+
+# 各认证后端被选中的次数（当前 worker）
+_dispatch_counts = {'token': 0, 'signed': 0, 'oauth2': 0, 'session': 0, 'unsupported': 0}
+
+
+def dispatch_stats():
+    """当前 worker 各认证后端的查找次数"""
+    return {**_dispatch_counts, 'pid': os.getpid()}
+
+
+class DispatchingAuthentication(BaseAuthentication):
+    """
+    按 Authorization 头的形态把请求交给唯一的认证后端
+
+    - 无 Authorization 头：会话认证
+    - 不带前缀或 "Token" 前缀：签名令牌（三段式）或 DRF 令牌（40 位十六进制，其他格式不处理）
+    - "Bearer" 前缀：签名令牌（三段式）或 OAuth2 访问令牌
+    - 其他前缀：不处理
+
+    依次尝试所有后端时，OAuth2 客户端每次请求都要先白查一次 DRF 令牌表。
+    """
+
+    def __init__(self):
+        self.token_backend = BearerTokenAuthentication()
+        self.oauth2_backend = CachedOAuth2Authentication()
+        self.session_backend = SessionAuthentication()
+
+    def select_backend(self, request):
+        """返回 (后端名称, 令牌值)"""
+        auth = request.META.get('HTTP_AUTHORIZATION', '').strip()
+        if not auth:
+            return 'session', None
+
+        scheme, credentials = split_authorization(auth)
+        if not scheme:
+            if tokens.looks_like_jwt(credentials):
+                return 'signed', credentials
+            return self.drf_token(credentials)
+        if scheme == 'token':
+            return self.drf_token(credentials)
+        if scheme == 'bearer':
+            return ('signed' if tokens.looks_like_jwt(credentials) else 'oauth2'), credentials
+        return 'unsupported', None
+
+    @staticmethod
+    def drf_token(value):
+        # 不符合 DRF 令牌格式的值不查询令牌表，直接视为未认证
+        return ('token', value) if DRF_TOKEN_PATTERN.match(value) else ('unsupported', None)
+
+    def authenticate(self, request):
+        backend, credentials = self.select_backend(request)
+        _dispatch_counts[backend] += 1
+
+        if backend == 'token':
+            result = self.token_backend.authenticate_key(credentials)
+        elif backend == 'signed':
+            result = self.token_backend.authenticate_signed(credentials)
+        elif backend == 'oauth2':
+            result = self.oauth2_backend.authenticate(request)
+        elif backend == 'session':
+            return self.session_backend.authenticate(request)
+        else:
+            return None
+
+        # 令牌认证成功时记录最后活跃时间（有节流，不会每次请求都写入）
+        if result is not None and result[0] is not None:
+            login_stats.touch(result[0].pk)
+        return result
+
+    def authenticate_header(self, request):
+        # 与原先首个认证类保持一致，未认证时返回 403
+        return self.token_backend.authenticate_header(request)
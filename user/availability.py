@@ -0,0 +1,254 @@
+"""
+用户名、邮箱是否可用
+
+注册表单在用户输入时实时检查用户名和邮箱是否已被占用。Redis 中保存一个布隆过滤器（位图），
+包含所有用户名和小写邮箱：过滤器判断"不存在"时直接返回可用，判断"可能存在"时才用索引精确查询。
+
+- 过滤器由 rebuild 从用户表分批构建，先写入临时键，完成后设置哨兵位并 RENAME 为正式键；
+  构建期间保存的用户同时写入临时键。
+- 用户保存后（事务提交时）把用户名和邮箱加入过滤器。布隆过滤器不支持删除，删除用户或修改用户名、
+  邮箱后旧值仍在过滤器中，只会多一次精确查询；删除的用户计入 stale 计数，
+  rebuild_availability_filter 可以在计数达到阈值时重建。
+- 哨兵位与过滤器位在同一次往返中读取。过滤器尚未构建、已被淘汰、缓存不是 Redis 或 Redis 不可用时
+  全部改用精确查询。
+"""
+import hashlib
+import logging
+import math
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .cache import uses_redis
+from .maintenance import keyset_batches
+
+logger = logging.getLogger('user')
+
+User = get_user_model()
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'availability',
+    # 预计的条目数（用户名和邮箱各算一条）和误判率，决定位图大小和哈希函数个数
+    'CAPACITY': 1000000,
+    'ERROR_RATE': 0.001,
+    'REBUILD_BATCH_SIZE': 5000,
+}
+
+# KEYS: 正式键, 构建中的临时键
+# ARGV: 位置...
+# 正式键总是写入，临时键只在构建期间（已存在时）写入
+ADD_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if i == 1 or redis.call('EXISTS', key) == 1 then
+        for j = 1, #ARGV do
+            redis.call('SETBIT', key, tonumber(ARGV[j]), 1)
+        end
+    end
+end
+return 0
+"""
+
+_scripts = {}
+
+
+def get_config():
+    """读取 AVAILABILITY 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'AVAILABILITY', {}))
+    return config
+
+
+def filter_size(config):
+    """(位数, 哈希函数个数)"""
+    bits = math.ceil(-config['CAPACITY'] * math.log(config['ERROR_RATE']) / math.log(2) ** 2)
+    hashes = max(1, round(bits / config['CAPACITY'] * math.log(2)))
+    return bits, hashes
+
+
+def _keys(config):
+    prefix = config['KEY_PREFIX']
+    return f'{prefix}:bloom', f'{prefix}:bloom:next', f'{prefix}:stale'
+
+
+def username_item(username):
+    return f'u:{username}'
+
+
+def email_item(email):
+    return f'e:{email.strip().lower()}'
+
+
+def user_items(username, email):
+    items = [username_item(username)] if username else []
+    if email:
+        items.append(email_item(email))
+    return items
+
+
+def positions(item, bits, hashes):
+    """双重哈希得到 item 在位图中的 hashes 个位置"""
+    digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:], 'big') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+def _connection(config):
+    if not config['ENABLED'] or not uses_redis(config['CACHE_ALIAS']):
+        return None
+    from django_redis import get_redis_connection
+
+    return get_redis_connection(config['CACHE_ALIAS'])
+
+
+def _add_script(connection):
+    script = _scripts.get('add')
+    if script is None:
+        script = _scripts['add'] = connection.register_script(ADD_SCRIPT)
+    return script
+
+
+def add(items):
+    """把用户名、邮箱加入过滤器"""
+    config = get_config()
+    connection = _connection(config)
+    if connection is None or not items:
+        return
+    bits, hashes = filter_size(config)
+    live, building, _ = _keys(config)
+    args = [position for item in items for position in positions(item, bits, hashes)]
+    try:
+        _add_script(connection)(keys=[live, building], args=args, client=connection)
+    except Exception:
+        logger.warning("更新可用性过滤器失败", exc_info=True)
+
+
+def mark_stale(count=1):
+    """记录过滤器中失效的条目数"""
+    config = get_config()
+    connection = _connection(config)
+    if connection is None:
+        return
+    try:
+        connection.incrby(_keys(config)[2], count)
+    except Exception:
+        logger.warning("更新可用性过滤器失效计数失败", exc_info=True)
+
+
+def stale_count():
+    config = get_config()
+    connection = _connection(config)
+    if connection is None:
+        return 0
+    return int(connection.get(_keys(config)[2]) or 0)
+
+
+def enabled():
+    """已启用且缓存为 Redis"""
+    config = get_config()
+    return config['ENABLED'] and uses_redis(config['CACHE_ALIAS'])
+
+
+def ready():
+    """过滤器是否已构建完成（哨兵位已设置）"""
+    return might_contain([]) is not None
+
+
+def might_contain(items):
+    """
+    批量判断条目是否可能在过滤器中，返回与 items 对应的布尔值列表
+
+    过滤器不可用时返回 None，调用方改用精确查询。
+    """
+    config = get_config()
+    connection = _connection(config)
+    if connection is None:
+        return None
+    bits, hashes = filter_size(config)
+    live = _keys(config)[0]
+    try:
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.getbit(live, bits)
+        for item in items:
+            for position in positions(item, bits, hashes):
+                pipeline.getbit(live, position)
+        results = pipeline.execute()
+    except Exception:
+        logger.warning("读取可用性过滤器失败，改用数据库查询", exc_info=True)
+        return None
+    if not results[0]:
+        # 没有哨兵位：过滤器尚未构建完成或已被淘汰
+        return None
+    return [all(results[1 + i * hashes:1 + (i + 1) * hashes]) for i in range(len(items))]
+
+
+def _username_taken(username):
+    return User.objects.filter(username=username).exists()
+
+
+def _email_taken(email):
+    return User.objects.email_exists(email)
+
+
+def check(username=None, email=None):
+    """
+    返回 {'username': 是否可用, 'email': 是否可用}，只包含传入的项
+
+    过滤器判断不存在时直接返回可用，否则按唯一索引精确查询。
+    """
+    checks = []
+    if username:
+        checks.append(('username', username_item(username), lambda: _username_taken(username)))
+    if email:
+        checks.append(('email', email_item(email), lambda: _email_taken(email)))
+    if not checks:
+        return {}
+
+    maybe = might_contain([item for _, item, _ in checks])
+    result = {}
+    for index, (name, _, taken) in enumerate(checks):
+        if maybe is not None and not maybe[index]:
+            result[name] = True
+        else:
+            result[name] = not taken()
+    return result
+
+
+def rebuild(batch_size=None, progress=None):
+    """
+    从用户表重建过滤器，返回写入的用户数
+
+    按主键分批读取用户名和邮箱写入临时键，全部完成后设置哨兵位并原子替换正式键。
+    progress 为可选的回调，每批调用一次，参数为累计用户数。
+    """
+    config = get_config()
+    connection = _connection(config)
+    if connection is None:
+        return 0
+    batch_size = batch_size or config['REBUILD_BATCH_SIZE']
+    bits, hashes = filter_size(config)
+    live, building, stale = _keys(config)
+
+    # 先创建临时键，构建期间保存的用户会同时写入
+    connection.delete(building)
+    connection.setbit(building, bits, 0)
+    total = 0
+    for rows in keyset_batches(User.objects.all(), ('pk', 'username', 'email'), batch_size):
+        pipeline = connection.pipeline(transaction=False)
+        for _, username, email in rows:
+            for item in user_items(username, email):
+                for position in positions(item, bits, hashes):
+                    pipeline.setbit(building, position, 1)
+        pipeline.execute()
+        total += len(rows)
+        if progress is not None:
+            progress(total)
+
+    pipeline = connection.pipeline(transaction=True)
+    pipeline.setbit(building, bits, 1)
+    pipeline.rename(building, live)
+    pipeline.delete(stale)
+    pipeline.execute()
+    return total
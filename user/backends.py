@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+User = get_user_model()
+
+
+class UsernameOrEmailBackend(ModelBackend):
+    """
+    用户名或邮箱登录
+
+    一次查询同时匹配用户名和邮箱（使用 LOWER(email) 唯一索引），只做一次密码校验。
+    登录失败时抛出 PermissionDenied，Django 不再尝试后续的认证后端，避免重复查询和重复计算哈希。
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            # 交给其他后端处理，例如 allauth 的 email= 登录
+            return None
+
+        user = User._default_manager.get_by_login(username)
+        if user is None:
+            # 与 ModelBackend 相同，执行一次哈希以消除用户存在与否的时间差
+            User().set_password(password)
+            raise PermissionDenied
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        raise PermissionDenied
@@ -0,0 +1,292 @@
+"""
+认证相关的两级缓存
+
+第一级为进程内有界 LRU，第二级为配置的 Django 缓存（生产环境为 django-redis）。
+失效时除了删除两级缓存外，还会通过 Redis pub/sub 通知其他 worker 清理各自的本地 LRU。
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'LOCAL_MAXSIZE': 10000,
+    'LOCAL_TIMEOUT': 30,
+    'TIMEOUT': 300,
+    'PUBSUB_CHANNEL': 'usercenter:auth-cache:invalidate',
+}
+
+# 已注册的缓存实例，按命名空间索引，供 pub/sub 监听线程分发失效消息
+_registry = {}
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+
+def get_config():
+    """读取 AUTH_CACHE 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'AUTH_CACHE', {}))
+    return config
+
+
+def uses_redis(alias):
+    """判断指定缓存别名是否由 django-redis 提供"""
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+    return backend.startswith('django_redis')
+
+
+class LocalLRU:
+    """
+    线程安全的有界 LRU，每个条目带有过期时间
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        if self.maxsize <= 0 or timeout <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache:
+    """
+    两级缓存：进程内 LRU 在前，共享缓存在后
+
+    本地条目的有效期远短于共享缓存，即使错过了 pub/sub 消息，
+    本地的陈旧数据也最多保留 LOCAL_TIMEOUT 秒。
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._local = None
+        self._stats = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'invalidations': 0,
+        }
+        _registry[namespace] = self
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = LocalLRU(get_config()['LOCAL_MAXSIZE'])
+        return self._local
+
+    @property
+    def shared(self):
+        return caches[get_config()['CACHE_ALIAS']]
+
+    def make_key(self, key):
+        return f'auth:{self.namespace}:{key}'
+
+    def get(self, key):
+        """依次查询本地 LRU 和共享缓存，未命中返回 None"""
+        _ensure_listener()
+        value = self.local.get(key)
+        if value is not None:
+            self._stats['local_hits'] += 1
+            return value
+
+        try:
+            value = self.shared.get(self.make_key(key))
+        except Exception:
+            logger.warning("读取共享认证缓存失败: namespace=%s", self.namespace, exc_info=True)
+            value = None
+
+        if value is None:
+            self._stats['misses'] += 1
+            return None
+
+        self._stats['shared_hits'] += 1
+        self.local.set(key, value, get_config()['LOCAL_TIMEOUT'])
+        return value
+
+    def get_many(self, keys):
+        """批量查询，共享缓存只需一次往返，返回命中的 {key: value}"""
+        _ensure_listener()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        self._stats['local_hits'] += len(found)
+
+        if missing:
+            try:
+                shared = self.shared.get_many([self.make_key(key) for key in missing])
+            except Exception:
+                logger.warning("批量读取共享认证缓存失败: namespace=%s", self.namespace, exc_info=True)
+                shared = {}
+            local_timeout = get_config()['LOCAL_TIMEOUT']
+            for key in missing:
+                value = shared.get(self.make_key(key))
+                if value is None:
+                    self._stats['misses'] += 1
+                    continue
+                self._stats['shared_hits'] += 1
+                self.local.set(key, value, local_timeout)
+                found[key] = value
+        return found
+
+    def set(self, key, value, timeout=None):
+        """写入两级缓存，timeout 不会超过 AUTH_CACHE['TIMEOUT']"""
+        config = get_config()
+        timeout = config['TIMEOUT'] if timeout is None else min(timeout, config['TIMEOUT'])
+        if timeout <= 0:
+            return
+        self._stats['sets'] += 1
+        try:
+            self.shared.set(self.make_key(key), value, timeout)
+        except Exception:
+            logger.warning("写入共享认证缓存失败: namespace=%s", self.namespace, exc_info=True)
+        self.local.set(key, value, min(timeout, config['LOCAL_TIMEOUT']))
+
+    def set_many(self, mapping, timeout=None):
+        """批量写入，共享缓存只需一次往返"""
+        config = get_config()
+        timeout = config['TIMEOUT'] if timeout is None else min(timeout, config['TIMEOUT'])
+        if not mapping or timeout <= 0:
+            return
+        self._stats['sets'] += len(mapping)
+        try:
+            self.shared.set_many({self.make_key(key): value for key, value in mapping.items()}, timeout)
+        except Exception:
+            logger.warning("批量写入共享认证缓存失败: namespace=%s", self.namespace, exc_info=True)
+        local_timeout = min(timeout, config['LOCAL_TIMEOUT'])
+        for key, value in mapping.items():
+            self.local.set(key, value, local_timeout)
+
+    def delete(self, *keys):
+        """从两级缓存中删除，并通知其他 worker 清理本地 LRU"""
+        if not keys:
+            return
+        self._stats['invalidations'] += len(keys)
+        for key in keys:
+            self.local.delete(key)
+        try:
+            self.shared.delete_many([self.make_key(key) for key in keys])
+        except Exception:
+            logger.warning("删除共享认证缓存失败: namespace=%s", self.namespace, exc_info=True)
+        _publish(self.namespace, keys)
+
+    def clear_local(self):
+        """清空当前进程的本地 LRU"""
+        self.local.clear()
+
+    def stats(self):
+        """当前 worker 的命中统计，用于评估缓存容量"""
+        lookups = self._stats['local_hits'] + self._stats['shared_hits'] + self._stats['misses']
+        hits = self._stats['local_hits'] + self._stats['shared_hits']
+        return {
+            **self._stats,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'local_size': len(self.local),
+            'local_maxsize': self.local.maxsize,
+            'pid': os.getpid(),
+        }
+
+
+def _publish(namespace, keys):
+    config = get_config()
+    if not uses_redis(config['CACHE_ALIAS']):
+        return
+    try:
+        from django_redis import get_redis_connection
+
+        pipeline = get_redis_connection(config['CACHE_ALIAS']).pipeline(transaction=False)
+        for key in keys:
+            pipeline.publish(config['PUBSUB_CHANNEL'], f'{namespace}\x00{key}')
+        pipeline.execute()
+    except Exception:
+        logger.warning("发布认证缓存失效消息失败", exc_info=True)
+
+
+def _dispatch(message):
+    if isinstance(message, bytes):
+        message = message.decode('utf-8')
+    namespace, _, key = message.partition('\x00')
+    cache = _registry.get(namespace)
+    if cache is not None:
+        cache.local.delete(key)
+
+
+def _listen(alias, channel):
+    from django_redis import get_redis_connection
+
+    while True:
+        try:
+            pubsub = get_redis_connection(alias).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            for message in pubsub.listen():
+                _dispatch(message['data'])
+        except Exception:
+            logger.warning("认证缓存失效订阅中断，1秒后重连", exc_info=True)
+            time.sleep(1)
+
+
+def _ensure_listener():
+    """
+    每个进程启动一个订阅线程
+
+    按 pid 判断，gunicorn fork 出的 worker 会各自启动自己的线程。
+    """
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+        config = get_config()
+        if not uses_redis(config['CACHE_ALIAS']):
+            return
+        thread = threading.Thread(
+            target=_listen,
+            args=(config['CACHE_ALIAS'], config['PUBSUB_CHANNEL']),
+            name='auth-cache-invalidation',
+            daemon=True,
+        )
+        thread.start()
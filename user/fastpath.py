@@ -0,0 +1,156 @@
+"""
+绕过中间件的令牌内省快速通道
+
+挂载在 WSGI/ASGI 入口处，匹配 TOKEN_INTROSPECTION_PATH 的请求不经过 Django 中间件、
+URL 解析、DRF 内容协商和序列化，直接把 Authorization 头解析为预先生成的 JSON。
+"""
+import json
+
+import jwt
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import login_stats, tokens
+from .authentication import (
+    DRF_TOKEN_PATTERN, drop_expired, introspection_payload, load_principals, split_authorization, token_cache,
+)
+from .cache import LocalLRU, get_config
+
+# 令牌 -> (认证主体, JSON)；认证主体对象不同说明缓存已失效或刷新，需要重新生成
+_blobs = None
+
+
+def _blob_cache():
+    global _blobs
+    if _blobs is None:
+        _blobs = LocalLRU(get_config()['LOCAL_MAXSIZE'])
+    return _blobs
+
+
+def _render(payload):
+    return json.dumps(
+        {'code': 200, 'msg': '成功', 'data': payload},
+        ensure_ascii=False,
+        separators=(',', ':'),
+    ).encode('utf-8')
+
+
+INACTIVE = _render({'active': False})
+
+
+def _touch(user_id):
+    """记录最后活跃时间，见 login_stats.touch；未启用 Redis 写缓冲时会写数据库，写入后释放连接"""
+    if login_stats.touch(user_id):
+        close_old_connections()
+
+
+def _introspect_signed(value):
+    try:
+        claims = tokens.decode_signed_token(value)
+    except jwt.InvalidTokenError:
+        return INACTIVE
+    _touch(claims['user_id'])
+    return _render({
+        'user_id': claims['user_id'],
+        'active': True,
+        'is_premium': claims['is_premium'],
+        'premium_expiry': claims['premium_expiry'],
+        'is_anonymous_user': claims['is_anonymous_user'],
+    })
+
+
+def introspect(authorization):
+    """
+    把 Authorization 头解析为内省结果的 JSON 字节串
+
+    支持 Token、Bearer 认证方案和不带方案的令牌值，与 DispatchingAuthentication 相同；
+    快速通道不校验 OAuth2 令牌，不符合 DRF 令牌格式的值不查询数据库。
+    """
+    scheme, key = split_authorization(authorization)
+    if not key or scheme not in ('', 'token', 'bearer'):
+        return INACTIVE
+    if scheme != 'token' and tokens.looks_like_jwt(key):
+        return _introspect_signed(key)
+    if not DRF_TOKEN_PATTERN.match(key):
+        return INACTIVE
+
+    principal = token_cache.get(key)
+    created = {}
+    if principal is None:
+        # 未命中缓存时才访问数据库，按 Django 请求周期的方式管理连接
+        close_old_connections()
+        try:
+            principals, created = load_principals([key])
+        finally:
+            close_old_connections()
+        principal = principals.get(key)
+        if principal is None:
+            return INACTIVE
+
+    if not drop_expired({key: principal}, created):
+        return INACTIVE
+    if principal.is_active:
+        _touch(principal.id)
+
+    blobs = _blob_cache()
+    entry = blobs.get(key)
+    if entry is not None and entry[0] is principal:
+        return entry[1]
+
+    blob = _render(introspection_payload(principal))
+    blobs.set(key, (principal, blob), get_config()['LOCAL_TIMEOUT'])
+    return blob
+
+
+def _response_headers(body):
+    return [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(body))),
+        ('Cache-Control', 'no-store'),
+    ]
+
+
+class IntrospectionWSGIApp:
+    """
+    WSGI 包装器，其余请求原样交给 Django
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.path = settings.TOKEN_INTROSPECTION_PATH
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path or environ.get('REQUEST_METHOD') not in ('GET', 'POST'):
+            return self.application(environ, start_response)
+
+        body = introspect(environ.get('HTTP_AUTHORIZATION', ''))
+        start_response('200 OK', _response_headers(body))
+        return [body]
+
+
+class IntrospectionASGIApp:
+    """
+    ASGI 包装器，令牌解析可能访问数据库，放到线程中执行
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.path = settings.TOKEN_INTROSPECTION_PATH
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get('path', '')
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        if scope['type'] != 'http' or path != self.path or scope.get('method') not in ('GET', 'POST'):
+            return await self.application(scope, receive, send)
+
+        authorization = dict(scope.get('headers', [])).get(b'authorization', b'').decode('latin-1')
+        body = await sync_to_async(introspect)(authorization)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in _response_headers(body)],
+        })
+        await send({'type': 'http.response.body', 'body': body})
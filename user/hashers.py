@@ -0,0 +1,265 @@
+"""
+密码哈希
+
+- 可调参数的哈希器：PBKDF2 迭代次数、scrypt 和 Argon2 的时间/内存成本都从 PASSWORD_HASHING 读取，
+  算法名与 Django 内置哈希器相同，已有的哈希可以直接校验；
+- scrypt 使用标准库 hashlib.scrypt，编码格式与 Django 4.0 的 ScryptPasswordHasher 一致；
+  Argon2 需要安装 argon2-cffi；
+- 计算哈希可以交给有界进程池执行（POOL_WORKERS > 0）。线程或协程 worker 中的多个登录请求可以同时占用多个核，
+  等待中的任务数不超过 POOL_MAX_PENDING；
+- 登录成功时，如果哈希使用的算法或参数与首选哈希器不同，会用新的参数重新哈希并保存（User.check_password）。
+"""
+import base64
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    UNUSABLE_PASSWORD_PREFIX, UNUSABLE_PASSWORD_SUFFIX_LENGTH, Argon2PasswordHasher, BasePasswordHasher,
+    PBKDF2PasswordHasher, get_hasher, get_hashers, get_hashers_by_algorithm, identify_hasher,
+    is_password_usable, mask_hash, must_update_salt,
+)
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare, get_random_string
+from django.utils.translation import gettext_noop as _
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    'PBKDF2_ITERATIONS': PBKDF2PasswordHasher.iterations,
+    'SCRYPT_WORK_FACTOR': 2 ** 14,
+    'SCRYPT_BLOCK_SIZE': 8,
+    'SCRYPT_PARALLELISM': 1,
+    'ARGON2_TIME_COST': Argon2PasswordHasher.time_cost,
+    'ARGON2_MEMORY_COST': Argon2PasswordHasher.memory_cost,
+    'ARGON2_PARALLELISM': Argon2PasswordHasher.parallelism,
+    'POOL_WORKERS': 0,
+    'POOL_MAX_PENDING': 64,
+    'POOL_TIMEOUT': 10,
+    'POOL_START_METHOD': 'spawn',
+}
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def get_config():
+    """读取 PASSWORD_HASHING 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'PASSWORD_HASHING', {}))
+    return config
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """迭代次数可配置的 PBKDF2，修改迭代次数后旧哈希在下次登录时升级"""
+
+    def __init__(self):
+        # 参数保存在实例上，哈希器随任务一起发送到进程池时参数保持一致
+        self.iterations = get_config()['PBKDF2_ITERATIONS']
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """时间、内存成本可配置的 Argon2"""
+
+    def __init__(self):
+        config = get_config()
+        self.time_cost = config['ARGON2_TIME_COST']
+        self.memory_cost = config['ARGON2_MEMORY_COST']
+        self.parallelism = config['ARGON2_PARALLELISM']
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+    """
+    scrypt 哈希，内存占用约为 128 * n * r * p 字节
+    """
+    algorithm = 'scrypt'
+
+    def __init__(self):
+        config = get_config()
+        self.work_factor = config['SCRYPT_WORK_FACTOR']
+        self.block_size = config['SCRYPT_BLOCK_SIZE']
+        self.parallelism = config['SCRYPT_PARALLELISM']
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash_ = hashlib.scrypt(
+            password.encode(),
+            salt=salt.encode(),
+            n=n,
+            r=r,
+            p=p,
+            # 默认的 32MB 上限不足以支撑较大的 n，按参数留出一倍余量
+            maxmem=2 * 128 * n * r * p,
+            dklen=64,
+        )
+        hash_ = base64.b64encode(hash_).decode('ascii').strip()
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, n, salt, r, p, hash_)
+
+    def decode(self, encoded):
+        algorithm, work_factor, salt, block_size, parallelism, hash_ = encoded.split('$', 6)
+        assert algorithm == self.algorithm
+        return {
+            'algorithm': algorithm,
+            'work_factor': int(work_factor),
+            'salt': salt,
+            'block_size': int(block_size),
+            'parallelism': int(parallelism),
+            'hash': hash_,
+        }
+
+    def verify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = self.encode(
+            password, decoded['salt'], decoded['work_factor'], decoded['block_size'], decoded['parallelism'],
+        )
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        return {
+            _('algorithm'): decoded['algorithm'],
+            _('work factor'): decoded['work_factor'],
+            _('block size'): decoded['block_size'],
+            _('parallelism'): decoded['parallelism'],
+            _('salt'): mask_hash(decoded['salt']),
+            _('hash'): mask_hash(decoded['hash']),
+        }
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        return (
+            decoded['work_factor'] != self.work_factor or
+            decoded['block_size'] != self.block_size or
+            decoded['parallelism'] != self.parallelism or
+            must_update_salt(decoded['salt'], self.salt_entropy)
+        )
+
+    def harden_runtime(self, password, encoded):
+        # 参数全部保存在哈希中，无需补齐耗时
+        pass
+
+
+def _encode(hasher, password, salt):
+    return hasher.encode(password, salt)
+
+
+def _verify(hasher, password, encoded):
+    return hasher.verify(password, encoded)
+
+
+def _harden(hasher, password, encoded):
+    hasher.harden_runtime(password, encoded)
+
+
+def _executor(config):
+    """当前进程的哈希进程池，fork 出的 worker 会各自创建"""
+    global _pool, _pool_pid, _pool_slots
+    pid = os.getpid()
+    if _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool_pid != pid:
+            _pool = ProcessPoolExecutor(
+                max_workers=config['POOL_WORKERS'],
+                mp_context=multiprocessing.get_context(config['POOL_START_METHOD']),
+            )
+            _pool_slots = threading.BoundedSemaphore(max(config['POOL_MAX_PENDING'], config['POOL_WORKERS']))
+            _pool_pid = pid
+    return _pool
+
+
+def shutdown_pool():
+    """关闭当前进程的哈希进程池，下次使用时重新创建"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False)
+        _pool = None
+        _pool_pid = None
+
+
+def run(func, *args):
+    """
+    在进程池中执行哈希计算，未启用进程池时直接执行
+
+    等待中的任务已满或进程池异常时在当前进程执行，登录不会因此失败。
+    """
+    config = get_config()
+    if config['POOL_WORKERS'] <= 0:
+        return func(*args)
+
+    executor = _executor(config)
+    slots = _pool_slots
+    if not slots.acquire(timeout=config['POOL_TIMEOUT']):
+        logger.warning("密码哈希进程池已满，改为在当前进程计算")
+        return func(*args)
+    try:
+        return executor.submit(func, *args).result(timeout=config['POOL_TIMEOUT'])
+    except BrokenProcessPool:
+        logger.warning("密码哈希进程池异常，重建后在当前进程计算", exc_info=True)
+        shutdown_pool()
+        return func(*args)
+    finally:
+        slots.release()
+
+
+def make_password(password):
+    """与 django.contrib.auth.hashers.make_password 相同，哈希计算可交给进程池"""
+    if password is None:
+        return UNUSABLE_PASSWORD_PREFIX + get_random_string(UNUSABLE_PASSWORD_SUFFIX_LENGTH)
+    if not isinstance(password, (bytes, str)):
+        raise TypeError(
+            'Password must be a string or bytes, got %s.'
+            % type(password).__qualname__
+        )
+    hasher = get_hasher('default')
+    return run(_encode, hasher, password, hasher.salt())
+
+
+def check_password(password, encoded, setter=None):
+    """
+    与 django.contrib.auth.hashers.check_password 相同，哈希计算可交给进程池
+
+    密码正确且哈希需要升级时调用 setter(password)。
+    """
+    if password is None or not is_password_usable(encoded):
+        return False
+
+    preferred = get_hasher('default')
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = run(_verify, hasher, password, encoded)
+
+    # 与 Django 一致：算法未变但参数变化时，补齐校验耗时，避免通过耗时判断哈希参数
+    if not is_correct and not hasher_changed and must_update:
+        run(_harden, hasher, password, encoded)
+
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
+
+
+@receiver(setting_changed)
+def reset_hashing(*, setting, **kwargs):
+    if setting == 'PASSWORD_HASHING':
+        # 哈希器实例在创建时读取参数，参数变化后需要重新创建
+        get_hashers.cache_clear()
+        get_hashers_by_algorithm.cache_clear()
+        shutdown_pool()
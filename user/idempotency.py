@@ -0,0 +1,165 @@
+"""
+Idempotency-Key 幂等请求
+
+移动端网络不稳定时会重试注册、登录、匿名登录和兑换优惠码，重复执行会重新计算密码哈希、
+重复创建匿名账号，或者让第二次兑换返回"已使用"。客户端为同一次操作的所有重试带上相同的
+Idempotency-Key 请求头后：
+
+- 第一个请求在缓存中占位（cache.add，使用 Redis 时多个节点共享）并正常执行，
+  状态码低于 500 的响应保存 TTL 秒，之后的重试直接返回保存的响应，响应头带 Idempotent-Replayed: true；
+- 第一个请求仍在执行时到达的重复请求等待其结果，最多等待 WAIT_TIMEOUT 秒，超时返回 409；
+- 执行出错（异常或 5xx）时删除占位，客户端可以用同一个 Key 重试；
+- 同一个 Key 用于参数不同的请求时返回 422。
+
+Key 按接口和调用方隔离：登录用户按用户ID，未登录的请求按客户端IP和 User-Agent。匿名登录等接口的响应中
+有令牌，其他调用方即使用相同的 Key 和参数也只会执行自己的请求，不会拿到别人保存的响应。
+没有 Idempotency-Key 请求头或未启用时按普通请求处理。
+"""
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .utils import api_response, get_client_ip
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'idempotency',
+    'TTL': 86400,
+    # 占位的有效期，应大于接口的最长执行时间，执行进程异常退出后占位自动失效
+    'LOCK_TIMEOUT': 60,
+    'WAIT_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.05,
+    'MAX_KEY_LENGTH': 255,
+}
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+PENDING = 'pending'
+DONE = 'done'
+
+
+def get_config():
+    """读取 IDEMPOTENCY 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return config
+
+
+def caller(request):
+    """调用方标识：登录用户为用户ID，未登录时为客户端IP和 User-Agent 的摘要"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return str(user.pk)
+    message = f"{get_client_ip(request)}\x00{request.META.get('HTTP_USER_AGENT', '')}".encode('utf-8')
+    return 'anon-' + hmac.new(settings.SECRET_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+
+def cache_key(config, scope, request, key):
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return f"{config['KEY_PREFIX']}:{scope}:{caller(request)}:{digest}"
+
+
+def fingerprint(request):
+    """
+    请求参数的摘要，用于识别同一个 Key 被用于不同的请求
+
+    请求参数中可能有密码，使用以 SECRET_KEY 为密钥的 HMAC，缓存中的摘要无法离线猜测。
+    """
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    message = f'{request.method}:{request.path}:{body}'.encode('utf-8')
+    return hmac.new(settings.SECRET_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def _error(code, message, http_status):
+    return Response(api_response(code=code, message=message, data=None), status=http_status)
+
+
+def _replay(entry):
+    response = Response(entry['data'], status=entry['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait(cache, key, config):
+    """等待执行中的请求完成，返回保存的结果，超时或占位已释放时返回 None"""
+    deadline = time.monotonic() + config['WAIT_TIMEOUT']
+    while time.monotonic() < deadline:
+        time.sleep(config['POLL_INTERVAL'])
+        entry = cache.get(key)
+        if entry is None or entry['state'] == DONE:
+            return entry
+    return None
+
+
+def idempotent(scope):
+    """
+    视图装饰器，支持函数视图和视图方法，放在 @api_view / @action 之下
+
+    scope 为接口名，同一个 Key 在不同接口之间互不影响。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            request = args[0] if isinstance(args[0], Request) else args[1]
+            key = request.META.get(HEADER)
+            config = get_config()
+            if not key or not config['ENABLED']:
+                return view(*args, **kwargs)
+            if len(key) > config['MAX_KEY_LENGTH']:
+                return _error(400, 'Idempotency-Key 过长', status.HTTP_400_BAD_REQUEST)
+
+            cache = caches[config['CACHE_ALIAS']]
+            storage_key = cache_key(config, scope, request, key)
+            request_fingerprint = fingerprint(request)
+            pending = {'state': PENDING, 'fingerprint': request_fingerprint}
+
+            try:
+                acquired = cache.add(storage_key, pending, config['LOCK_TIMEOUT'])
+            except Exception:
+                logger.warning("幂等请求占位失败，按普通请求处理: scope=%s", scope, exc_info=True)
+                return view(*args, **kwargs)
+
+            while not acquired:
+                entry = cache.get(storage_key)
+                if entry is not None and entry['fingerprint'] != request_fingerprint:
+                    return _error(422, 'Idempotency-Key 已用于参数不同的请求', status.HTTP_422_UNPROCESSABLE_ENTITY)
+                if entry is not None and entry['state'] == PENDING:
+                    entry = _wait(cache, storage_key, config)
+                    if entry is None and cache.get(storage_key) is not None:
+                        response = _error(409, '相同 Idempotency-Key 的请求正在处理中，请稍后重试', status.HTTP_409_CONFLICT)
+                        response['Retry-After'] = 1
+                        return response
+                if entry is not None:
+                    return _replay(entry)
+                # 占位已释放（之前的请求失败或已过期），重新尝试占位
+                acquired = cache.add(storage_key, pending, config['LOCK_TIMEOUT'])
+
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                cache.delete(storage_key)
+                raise
+
+            if response.status_code >= 500 or not hasattr(response, 'data'):
+                cache.delete(storage_key)
+                return response
+            cache.set(storage_key, {
+                'state': DONE,
+                'fingerprint': request_fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+            }, config['TTL'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,283 @@
+"""
+登录统计的写缓冲
+
+每次登录都更新用户行的 login_count、last_login、last_login_ip，热点账号的这一行会成为写入瓶颈。
+缓存为 Redis 时，这些值先写入 Redis 哈希 login_stats:<用户ID>，并把用户ID加入待写回集合，
+由 flush_login_stats 定期取出，按批次用 F() 累加写回用户表。令牌认证成功、令牌内省（含快速通道）
+和刷新签名令牌时还会记录最后活跃时间 last_seen，同一 worker 对同一用户在 LAST_SEEN_INTERVAL 秒内只记录一次。
+
+缓存不是 Redis 或写入 Redis 失败时直接更新数据库。读取用户信息时用 apply_pending 合并缓冲中的值。
+"""
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import LocalLRU, get_config as get_cache_config, uses_redis
+from .utils import get_client_ip
+
+logger = logging.getLogger('user')
+
+User = get_user_model()
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'LAST_SEEN_INTERVAL': 300,
+    'FLUSH_BATCH_SIZE': 500,
+}
+
+# 等待写回的用户ID集合
+DIRTY_KEY = 'login_stats:dirty'
+
+TIMESTAMP_FIELDS = ('last_login', 'last_seen')
+
+# 用户ID -> True，当前 worker 最近记录过活跃时间的用户
+_seen = None
+
+
+def get_config():
+    """读取 LOGIN_STATS 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'LOGIN_STATS', {}))
+    return config
+
+
+def stats_key(user_id):
+    return f'login_stats:{user_id}'
+
+
+def _local():
+    global _seen
+    if _seen is None:
+        _seen = LocalLRU(get_cache_config()['LOCAL_MAXSIZE'])
+    return _seen
+
+
+def _connection(config):
+    """写缓冲使用的 Redis 连接，未启用或缓存不是 Redis 时返回 None"""
+    if not config['ENABLED'] or not uses_redis(config['CACHE_ALIAS']):
+        return None
+    from django_redis import get_redis_connection
+
+    return get_redis_connection(config['CACHE_ALIAS'])
+
+
+def _decode(raw):
+    """Redis 哈希 -> {字段: 值}"""
+    entry = {}
+    for field, value in raw.items():
+        field = field.decode('utf-8') if isinstance(field, bytes) else field
+        value = value.decode('utf-8') if isinstance(value, bytes) else value
+        if field == 'login_count':
+            entry[field] = int(value)
+        elif field in TIMESTAMP_FIELDS:
+            entry[field] = datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+        else:
+            entry[field] = value
+    return entry
+
+
+def record_login(user, request=None):
+    """
+    记录一次登录：登录次数加一，更新最后登录时间、IP 和最后活跃时间
+
+    user 实例上的 last_login、last_login_ip、last_seen 同步更新；写入缓冲时 login_count 不变，
+    需要包含缓冲中的次数时使用 apply_pending。
+    """
+    config = get_config()
+    now = timezone.now()
+    ip = get_client_ip(request) if request is not None else None
+    fields = {'last_login': now, 'last_seen': now}
+    if ip:
+        fields['last_login_ip'] = ip
+
+    connection = _connection(config)
+    buffered = False
+    if connection is not None:
+        try:
+            key = stats_key(user.pk)
+            pipeline = connection.pipeline(transaction=True)
+            pipeline.hincrby(key, 'login_count', 1)
+            pipeline.hset(key, mapping={
+                name: value.timestamp() if name in TIMESTAMP_FIELDS else value
+                for name, value in fields.items()
+            })
+            pipeline.sadd(DIRTY_KEY, user.pk)
+            pipeline.execute()
+            buffered = True
+        except Exception:
+            logger.warning("写入登录统计缓冲失败，直接更新数据库", exc_info=True)
+
+    if not buffered:
+        User.objects.filter(pk=user.pk).update(login_count=F('login_count') + 1, **fields)
+        user.login_count = (user.login_count or 0) + 1
+
+    for name, value in fields.items():
+        setattr(user, name, value)
+    _local().set(user.pk, True, config['LAST_SEEN_INTERVAL'])
+
+
+def touch(user_id):
+    """记录一次令牌使用，同一用户在 LAST_SEEN_INTERVAL 秒内只记录一次；返回是否写入"""
+    return bool(touch_many([user_id]))
+
+
+def touch_many(user_ids):
+    """
+    批量记录令牌使用，用于令牌内省等一次校验多个用户令牌的场景，节流规则与 touch 相同
+
+    Returns:
+        本次写入了最后活跃时间的用户ID
+    """
+    config = get_config()
+    local = _local()
+    user_ids = [user_id for user_id in dict.fromkeys(user_ids) if not local.get(user_id)]
+    if not user_ids:
+        return []
+    for user_id in user_ids:
+        local.set(user_id, True, config['LAST_SEEN_INTERVAL'])
+
+    now = timezone.now()
+    connection = _connection(config)
+    if connection is not None:
+        try:
+            pipeline = connection.pipeline(transaction=True)
+            for user_id in user_ids:
+                pipeline.hset(stats_key(user_id), 'last_seen', now.timestamp())
+            pipeline.sadd(DIRTY_KEY, *user_ids)
+            pipeline.execute()
+            return user_ids
+        except Exception:
+            logger.warning("写入最后活跃时间缓冲失败，直接更新数据库", exc_info=True)
+
+    # 直接写数据库时跨 worker 节流
+    cache = caches[config['CACHE_ALIAS']]
+    user_ids = [user_id for user_id in user_ids
+                if cache.add(f'login_stats:seen:{user_id}', 1, config['LAST_SEEN_INTERVAL'])]
+    if user_ids:
+        User.objects.filter(pk__in=user_ids).update(last_seen=now)
+    return user_ids
+
+
+def pending(user_ids):
+    """批量读取缓冲中尚未写回的值，返回 {用户ID: {字段: 值}}"""
+    connection = _connection(get_config())
+    if connection is None or not user_ids:
+        return {}
+    try:
+        pipeline = connection.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.hgetall(stats_key(user_id))
+        results = pipeline.execute()
+    except Exception:
+        logger.warning("读取登录统计缓冲失败", exc_info=True)
+        return {}
+    return {user_id: _decode(raw) for user_id, raw in zip(user_ids, results) if raw}
+
+
+def merged(user, entry):
+    """数据库中的值与缓冲中的值合并后的登录统计"""
+    values = {
+        'login_count': (user.login_count or 0) + entry.get('login_count', 0),
+        'last_login_ip': entry.get('last_login_ip') or user.last_login_ip,
+    }
+    for name in TIMESTAMP_FIELDS:
+        current, buffered = getattr(user, name), entry.get(name)
+        values[name] = buffered if buffered and (current is None or buffered > current) else current
+    return values
+
+
+def apply_pending(users):
+    """
+    把缓冲中的值合并到用户实例上，用于展示
+
+    合并后的实例不应再以完整字段 save()，否则写回时会重复累加登录次数。
+    """
+    entries = pending([user.pk for user in users])
+    for user in users:
+        entry = entries.get(user.pk)
+        if entry:
+            for name, value in merged(user, entry).items():
+                setattr(user, name, value)
+    return users
+
+
+def discard(user_ids):
+    """丢弃已删除用户在缓冲中的值"""
+    connection = _connection(get_config())
+    if connection is None or not user_ids:
+        return
+    try:
+        pipeline = connection.pipeline(transaction=True)
+        pipeline.delete(*(stats_key(user_id) for user_id in user_ids))
+        pipeline.srem(DIRTY_KEY, *user_ids)
+        pipeline.execute()
+    except Exception:
+        logger.warning("清除登录统计缓冲失败", exc_info=True)
+
+
+def _write(entries):
+    with transaction.atomic():
+        for user_id, entry in entries.items():
+            updates = {name: entry[name] for name in ('last_login', 'last_login_ip', 'last_seen') if name in entry}
+            if entry.get('login_count'):
+                updates['login_count'] = F('login_count') + entry['login_count']
+            if updates:
+                User.objects.filter(pk=user_id).update(**updates)
+
+
+def _restore(connection, entries):
+    """写回数据库失败时把取出的值放回缓冲，期间产生的新值优先"""
+    pipeline = connection.pipeline(transaction=True)
+    for user_id, entry in entries.items():
+        key = stats_key(user_id)
+        if entry.get('login_count'):
+            pipeline.hincrby(key, 'login_count', entry['login_count'])
+        for name, value in entry.items():
+            if name != 'login_count':
+                pipeline.hsetnx(key, name, value.timestamp() if name in TIMESTAMP_FIELDS else value)
+        pipeline.sadd(DIRTY_KEY, user_id)
+    pipeline.execute()
+
+
+def flush(batch_size=None, budget=None):
+    """
+    把缓冲中的值分批写回用户表，返回写回的用户数
+
+    每批用 SPOP 取出一组用户ID，再在一个 MULTI 中读取并删除对应的哈希，多个进程同时执行也不会重复写回。
+    budget 为 maintenance.TimeBudget，用完后停止，剩余部分下次继续。
+    """
+    config = get_config()
+    connection = _connection(config)
+    if connection is None:
+        return 0
+    batch_size = batch_size or config['FLUSH_BATCH_SIZE']
+
+    total = 0
+    while budget is None or not budget.exhausted:
+        user_ids = [int(user_id) for user_id in connection.spop(DIRTY_KEY, batch_size) or []]
+        if not user_ids:
+            break
+
+        pipeline = connection.pipeline(transaction=True)
+        for user_id in user_ids:
+            pipeline.hgetall(stats_key(user_id))
+            pipeline.delete(stats_key(user_id))
+        results = pipeline.execute()
+        entries = {user_id: _decode(raw) for user_id, raw in zip(user_ids, results[::2]) if raw}
+
+        try:
+            _write(entries)
+        except Exception:
+            _restore(connection, entries)
+            raise
+        total += len(entries)
+        if len(user_ids) < batch_size:
+            break
+    return total
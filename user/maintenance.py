@@ -0,0 +1,130 @@
+"""
+批量清理工具
+
+按主键分批扫描和删除，每批一个短事务，避免长时间持有锁或一次性加载大量数据。
+定时任务可以设置时间预算，超时后停止，剩余数据留给下一次执行；多节点同时执行时用缓存锁互斥。
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.db import connections, router
+
+from .cache import uses_redis
+
+logger = logging.getLogger('user')
+
+
+def keyset_batches(queryset, fields, batch_size):
+    """
+    按主键顺序分批读取，每批返回 values_list 结果的列表
+
+    使用 pk > 上一批最大值 翻页，不依赖 OFFSET，删除当前批次不会影响后续翻页。
+    第一个字段必须是主键。
+    """
+    last = None
+    while True:
+        batch_queryset = queryset.order_by('pk')
+        if last is not None:
+            batch_queryset = batch_queryset.filter(pk__gt=last)
+        rows = list(batch_queryset.values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+        if len(rows) < batch_size:
+            return
+
+
+def pause(seconds):
+    """批次之间暂停，给线上请求让出数据库"""
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+class TimeBudget:
+    """单次执行的时间预算（秒），为 None 或 0 时不限制"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def exhausted(self):
+        return bool(self.seconds) and self.elapsed >= self.seconds
+
+
+def delete_in_batches(queryset, batch_size, budget, interval=0):
+    """
+    分批删除 queryset 匹配的记录
+
+    Returns:
+        (删除的记录数, 是否已全部删除)，时间预算用完时提前返回
+    """
+    model = queryset.model
+    deleted = 0
+    for rows in keyset_batches(queryset, ('pk',), batch_size):
+        if budget.exhausted:
+            return deleted, False
+        _, per_model = model.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        deleted += per_model.get(model._meta.label, 0)
+        pause(interval)
+    return deleted, True
+
+
+@contextmanager
+def cache_lock(name, timeout, alias='default'):
+    """
+    跨节点互斥锁，进入时返回是否获得锁
+
+    使用 django-redis 时基于 Redis 锁，否则使用 cache.add。timeout 秒后锁自动释放，
+    持有锁的进程异常退出也不会永久阻塞其他节点。
+    """
+    cache = caches[alias]
+    key = f'lock:{name}'
+
+    if uses_redis(alias):
+        lock = cache.lock(key, timeout=timeout)
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except Exception:
+                    logger.warning("释放锁失败: %s", key, exc_info=True)
+        return
+
+    token = uuid.uuid4().hex
+    acquired = cache.add(key, token, timeout)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def table_size(model):
+    """
+    表的行数和占用空间
+
+    PostgreSQL 使用 pg_class 的估算行数和 pg_total_relation_size（含索引），不做全表 COUNT；
+    其他数据库返回精确行数，占用空间为 None。
+    """
+    connection = connections[router.db_for_read(model)]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint, pg_total_relation_size(oid) FROM pg_class WHERE oid = %s::regclass',
+                [model._meta.db_table]
+            )
+            rows, size = cursor.fetchone()
+        return {'rows': max(rows, 0), 'bytes': size}
+    return {'rows': model.objects.count(), 'bytes': None}
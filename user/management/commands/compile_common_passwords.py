@@ -0,0 +1,40 @@
+"""
+编译常见密码校验器使用的密码列表
+
+部署时（构建镜像或升级 Django 后）执行一次，编译结果写入 AUTH_PASSWORD_VALIDATORS 中
+CommonPasswordValidator 的 compiled_path，说明见 user/password_validation.py。
+"""
+import os
+
+from django.conf import settings
+from django.contrib.auth.password_validation import CommonPasswordValidator as DjangoCommonPasswordValidator
+from django.core.management.base import BaseCommand, CommandError
+
+from user import password_validation
+
+VALIDATOR_NAME = 'user.password_validation.CommonPasswordValidator'
+
+
+class Command(BaseCommand):
+    help = '把常见密码列表编译为排序后的文本文件，供密码校验器用 mmap 共享'
+
+    def handle(self, *args, **options):
+        targets = [
+            validator.get('OPTIONS', {}) for validator in settings.AUTH_PASSWORD_VALIDATORS
+            if validator['NAME'] == VALIDATOR_NAME
+        ]
+        targets = [config for config in targets if config.get('compiled_path')]
+        if not targets:
+            self.stdout.write('CommonPasswordValidator 未配置 compiled_path，跳过')
+            return
+
+        for config in targets:
+            source = config.get('password_list_path', DjangoCommonPasswordValidator.DEFAULT_PASSWORD_LIST_PATH)
+            target = config['compiled_path']
+            directory = os.path.dirname(os.path.abspath(target))
+            if not os.path.isdir(directory):
+                raise CommandError(f'目录不存在: {directory}')
+            password_validation.compile_password_list(source, target)
+            if password_validation.load_compiled(source, target) is None:
+                raise CommandError(f'编译结果未通过校验，请检查文件和目录的属主及权限: {target}')
+            self.stdout.write(self.style.SUCCESS(f'已编译常见密码列表: {target}'))
@@ -0,0 +1,30 @@
+"""
+把 Redis 中缓冲的登录统计写回用户表
+
+缓冲的内容见 user/login_stats.py。建议用 cron 每分钟执行一次：
+
+    * * * * * python manage.py flush_login_stats --time-budget 50
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+
+from user import login_stats
+from user.maintenance import TimeBudget
+
+logger = logging.getLogger('user')
+
+
+class Command(BaseCommand):
+    help = '把缓冲的登录次数、最后登录时间/IP 和最后活跃时间分批写回用户表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='每批写回的用户数')
+        parser.add_argument('--time-budget', type=int, default=50, help='单次执行的最长秒数，0 表示不限制')
+
+    def handle(self, *args, **options):
+        budget = TimeBudget(options['time_budget'])
+        flushed = login_stats.flush(options['batch_size'], budget)
+        if flushed:
+            logger.info("登录统计写回 %s 个用户，耗时 %.1f 秒", flushed, budget.elapsed)
+        self.stdout.write(self.style.SUCCESS(f'写回 {flushed} 个用户，耗时 {budget.elapsed:.2f} 秒'))
@@ -0,0 +1,76 @@
+"""
+分批删除长期不活跃的匿名用户
+
+最后一次登录（没有登录时间的按注册时间）和最后活跃时间都早于 --days 天前的匿名用户会被删除，
+令牌、第三方账号关联和优惠码使用记录随之级联删除。按主键分批执行，每批一个短事务，
+时间预算用完或中断后再次执行即可从剩余部分继续。建议用 cron 每天执行：
+
+    30 4 * * * python manage.py purge_anonymous_users --time-budget 600
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user import anonymous
+from user.maintenance import TimeBudget, cache_lock, keyset_batches, pause
+
+logger = logging.getLogger('user')
+
+LOCK_NAME = 'purge_anonymous_users'
+
+
+class Command(BaseCommand):
+    help = '分批删除长期不活跃的匿名用户及其令牌、第三方账号关联和优惠码使用记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='不活跃天数，默认使用 ANONYMOUS_LOGIN 的 PURGE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批删除的用户数')
+        parser.add_argument('--sleep', type=float, default=0.05, help='批次之间暂停的秒数')
+        parser.add_argument('--time-budget', type=int, default=600, help='单次执行的最长秒数，0 表示不限制')
+        parser.add_argument('--dry-run', action='store_true', help='只统计，不删除')
+
+    def handle(self, *args, **options):
+        # 锁的有效期略长于时间预算，进程异常退出后锁会自动释放
+        lock_timeout = (options['time_budget'] or 3600) + 60
+        with cache_lock(LOCK_NAME, lock_timeout) as acquired:
+            if not acquired:
+                self.stdout.write('其他节点正在清理，跳过本次执行')
+                return
+            self.purge(options)
+
+    def purge(self, options):
+        days = options['days'] or anonymous.get_config()['PURGE_AFTER_DAYS']
+        cutoff = timezone.now() - timedelta(days=days)
+        queryset = anonymous.stale_users(cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{days} 天未活跃的匿名用户: 待删除约 {queryset.count()} 个'))
+            return
+
+        budget = TimeBudget(options['time_budget'])
+        totals = Counter()
+        scanned = deleted = 0
+        complete = True
+
+        for number, rows in enumerate(keyset_batches(queryset, ('pk',), options['batch_size']), 1):
+            if budget.exhausted:
+                complete = False
+                break
+            scanned += len(rows)
+            count, per_model = anonymous.purge_users([row[0] for row in rows], cutoff)
+            deleted += count
+            totals.update(per_model)
+            self.stdout.write(f'第 {number} 批: 扫描 {len(rows)} 个，删除 {count} 个，累计删除 {deleted} 个')
+            pause(options['sleep'])
+
+        for label, count in sorted(totals.items()):
+            self.stdout.write(f'{label}: 删除 {count} 条')
+
+        status = '已完成' if complete else '时间预算用完，剩余部分下次继续'
+        logger.info("匿名用户清理%s: 扫描 %s 个，删除 %s 个，耗时 %.1f 秒", status, scanned, deleted, budget.elapsed)
+        self.stdout.write(self.style.SUCCESS(
+            f'扫描 {scanned} 个匿名用户，删除 {deleted} 个，耗时 {budget.elapsed:.1f} 秒，{status}'
+        ))
@@ -0,0 +1,86 @@
+"""
+分批清理过期的 OAuth2 令牌和授权码
+
+清理规则与 django-oauth-toolkit 的 cleartokens 相同，区别在于按主键分批删除、每次执行有时间预算、
+输出删除数量和表大小，并通过缓存锁保证多个节点同时执行时只有一个真正工作。建议用 cron 定时执行：
+
+    */30 * * * * python manage.py purge_expired_oauth2 --time-budget 300
+"""
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from oauth2_provider.models import (
+    get_access_token_model, get_grant_model, get_id_token_model, get_refresh_token_model,
+)
+from oauth2_provider.settings import oauth2_settings
+
+from user.maintenance import TimeBudget, cache_lock, delete_in_batches, table_size
+
+logger = logging.getLogger('user')
+
+LOCK_NAME = 'purge_expired_oauth2'
+
+
+def purge_steps(now):
+    """(说明, queryset) 列表，先删刷新令牌，关联的访问令牌才能在后续步骤中删除"""
+    AccessToken = get_access_token_model()
+    RefreshToken = get_refresh_token_model()
+    steps = []
+
+    refresh_expire = oauth2_settings.REFRESH_TOKEN_EXPIRE_SECONDS
+    if refresh_expire:
+        if not isinstance(refresh_expire, timedelta):
+            refresh_expire = timedelta(seconds=refresh_expire)
+        refresh_expire_at = now - refresh_expire
+        steps += [
+            ('已吊销的刷新令牌', RefreshToken.objects.filter(revoked__lt=refresh_expire_at)),
+            ('已过期的刷新令牌', RefreshToken.objects.filter(access_token__expires__lt=refresh_expire_at)),
+        ]
+
+    steps += [
+        ('已过期的访问令牌', AccessToken.objects.filter(refresh_token__isnull=True, expires__lt=now)),
+        ('已过期的 ID 令牌', get_id_token_model().objects.filter(access_token__isnull=True, expires__lt=now)),
+        ('已过期的授权码', get_grant_model().objects.filter(expires__lt=now)),
+    ]
+    return steps
+
+
+class Command(BaseCommand):
+    help = '分批清理过期的 OAuth2 访问令牌、刷新令牌、ID 令牌和授权码'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批删除的记录数')
+        parser.add_argument('--sleep', type=float, default=0.05, help='批次之间暂停的秒数')
+        parser.add_argument('--time-budget', type=int, default=300, help='单次执行的最长秒数，0 表示不限制')
+
+    def handle(self, *args, **options):
+        # 锁的有效期略长于时间预算，进程异常退出后锁会自动释放
+        lock_timeout = (options['time_budget'] or 3600) + 60
+        with cache_lock(LOCK_NAME, lock_timeout) as acquired:
+            if not acquired:
+                self.stdout.write('其他节点正在清理，跳过本次执行')
+                return
+            self.purge(options)
+
+    def purge(self, options):
+        budget = TimeBudget(options['time_budget'])
+        complete = True
+        total = 0
+
+        for label, queryset in purge_steps(timezone.now()):
+            deleted, complete = delete_in_batches(queryset, options['batch_size'], budget, options['sleep'])
+            total += deleted
+            self.stdout.write(f'{label}: 删除 {deleted} 条')
+            if not complete:
+                break
+
+        for model in (get_access_token_model(), get_refresh_token_model(), get_id_token_model(), get_grant_model()):
+            size = table_size(model)
+            size_text = f", {size['bytes'] / 1024 / 1024:.1f} MB" if size['bytes'] is not None else ''
+            self.stdout.write(f"{model._meta.db_table}: {size['rows']} 行{size_text}")
+
+        status = '已完成' if complete else '时间预算用完，剩余部分下次继续'
+        logger.info("OAuth2 过期数据清理%s: 删除 %s 条，耗时 %.1f 秒", status, total, budget.elapsed)
+        self.stdout.write(self.style.SUCCESS(f'共删除 {total} 条，耗时 {budget.elapsed:.1f} 秒，{status}'))
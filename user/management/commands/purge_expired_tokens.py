@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+
+from user import token_expiry
+from user.authentication import revoke_tokens
+from user.maintenance import keyset_batches, pause
+
+
+class Command(BaseCommand):
+    help = '分批删除已过期的 DRF 令牌（超过绝对有效期或空闲超时），同时清理认证缓存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批扫描的令牌数')
+        parser.add_argument('--sleep', type=float, default=0.05, help='批次之间暂停的秒数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计，不删除')
+
+    def handle(self, *args, **options):
+        if not token_expiry.get_config()['ENABLED']:
+            self.stdout.write('令牌有效期未启用，跳过')
+            return
+
+        tokens = Token.objects.all()
+        if token_expiry.get_config()['EXEMPT_ANONYMOUS']:
+            # 匿名用户的令牌不过期，匿名账号由 purge_anonymous_users 清理
+            tokens = tokens.filter(user__is_anonymous_user=False)
+        scanned = deleted = 0
+        for rows in keyset_batches(tokens, ('key', 'created'), options['batch_size']):
+            scanned += len(rows)
+            expired = token_expiry.expired_tokens(dict(rows))
+            if expired and not options['dry_run']:
+                revoke_tokens(list(expired))
+            deleted += len(expired)
+            pause(options['sleep'])
+
+        action = '待删除' if options['dry_run'] else '已删除'
+        self.stdout.write(self.style.SUCCESS(f'扫描 {scanned} 个令牌，{action} {deleted} 个过期令牌'))
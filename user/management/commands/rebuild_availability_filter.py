@@ -0,0 +1,52 @@
+"""
+从用户表重建用户名、邮箱可用性检查使用的布隆过滤器
+
+过滤器的说明见 user/availability.py。部署后首次执行一次，之后可以用 cron 在删除的用户较多时重建：
+
+    0 5 * * * python manage.py rebuild_availability_filter --min-stale 10000
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+
+from user import availability
+from user.maintenance import TimeBudget, cache_lock
+
+logger = logging.getLogger('user')
+
+LOCK_NAME = 'rebuild_availability_filter'
+
+
+class Command(BaseCommand):
+    help = '从用户表分批重建用户名、邮箱可用性检查使用的布隆过滤器'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='每批读取的用户数')
+        parser.add_argument('--min-stale', type=int, default=0,
+                            help='过滤器已存在时，失效条目数达到该值才重建，0 表示总是重建')
+
+    def handle(self, *args, **options):
+        if not availability.enabled():
+            self.stdout.write('可用性过滤器未启用或缓存不是 Redis，跳过')
+            return
+
+        stale = availability.stale_count()
+        if availability.ready() and stale < options['min_stale']:
+            self.stdout.write(f'失效条目 {stale} 个，未达到 {options["min_stale"]}，跳过')
+            return
+
+        with cache_lock(LOCK_NAME, 3600) as acquired:
+            if not acquired:
+                self.stdout.write('其他节点正在重建，跳过本次执行')
+                return
+            budget = TimeBudget(None)
+            total = availability.rebuild(
+                options['batch_size'], progress=lambda count: self.stdout.write(f'已写入 {count} 个用户')
+            )
+
+        bits, hashes = availability.filter_size(availability.get_config())
+        logger.info("可用性过滤器已重建: %s 个用户，耗时 %.1f 秒", total, budget.elapsed)
+        self.stdout.write(self.style.SUCCESS(
+            f'已重建可用性过滤器: {total} 个用户，{bits / 8 / 1024 / 1024:.1f} MB，{hashes} 个哈希函数，'
+            f'耗时 {budget.elapsed:.1f} 秒'
+        ))
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:03
+
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+import user.models
+
+INDEX_NAME = 'user_user_email_ci_uniq'
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """已有仅大小写不同的重复邮箱时无法建立唯一索引，需要先人工合并或修改"""
+    User = apps.get_model('user', 'User')
+    duplicates = list(
+        User.objects.exclude(email='')
+        .annotate(email_lower=Lower('email'))
+        .values('email_lower')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('email_lower', flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError('以下邮箱被多个用户使用，请处理后再执行迁移: ' + ', '.join(duplicates))
+
+
+def create_index(apps, schema_editor):
+    # PostgreSQL 上并发建索引，不阻塞用户表的写入
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(
+        f"CREATE UNIQUE INDEX {concurrently}{INDEX_NAME} ON user_user (LOWER(email)) WHERE email <> ''"
+    )
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('user', '0004_user_is_anonymous_user'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', user.models.UserManager()),
+            ],
+        ),
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0005_user_email_ci_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最后活跃时间'),
+        ),
+        # SQLite 加字段时会重建用户表，丢失迁移 0005 中手工创建的索引；其他数据库上索引已存在，不做任何事
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX IF NOT EXISTS user_user_email_ci_uniq ON user_user (LOWER(email)) WHERE email <> ''",
+            migrations.RunSQL.noop,
+        ),
+    ]
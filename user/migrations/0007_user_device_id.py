@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0006_user_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='device_id',
+            field=models.CharField(blank=True, max_length=128, null=True, verbose_name='设备标识'),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_anonymous_user', True)), fields=('device_id',), name='user_anonymous_device_uniq'),
+        ),
+        # SQLite 上加字段和约束会重建用户表，重新创建迁移 0005 中的邮箱索引
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX IF NOT EXISTS user_user_email_ci_uniq ON user_user (LOWER(email)) WHERE email <> ''",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_user_device_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_anonymous_user', 'last_login'], name='user_anon_last_login_idx'),
+        ),
+    ]
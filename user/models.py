@@ -1,7 +1,77 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.contrib.auth.models import AbstractUser, UserManager as DjangoUserManager
 from django.utils.translation import gettext_lazy as _
 
+from . import hashers, usernames
+
+
+class UserManager(DjangoUserManager):
+    """
+    按邮箱查询统一使用 LOWER(email)，与迁移 0005 中的大小写不敏感唯一索引（email 非空）一致
+    """
+    
+    def filter_email(self, email):
+        """按邮箱查询，不区分大小写"""
+        return self.annotate(email_lower=Lower('email')).filter(email_lower=email.lower()).exclude(email='')
+    
+    def email_exists(self, email, exclude_pk=None):
+        queryset = self.filter_email(email)
+        if exclude_pk is not None:
+            queryset = queryset.exclude(pk=exclude_pk)
+        return queryset.exists()
+    
+    def _create_user(self, username, email, password, **extra_fields):
+        """与 Django 相同，密码哈希通过 set_password 计算，可交给进程池，见 user/hashers.py"""
+        if not username:
+            raise ValueError('The given username must be set')
+        user = self.model(
+            username=self.model.normalize_username(username), email=self.normalize_email(email), **extra_fields
+        )
+        user.set_password(password)
+        user.save(using=self._db)
+        return user
+    
+    def create_anonymous_user(self, username, **extra_fields):
+        """创建匿名用户，密码不可用，不计算密码哈希"""
+        user = self.model(username=username, is_anonymous_user=True, **extra_fields)
+        user.set_unusable_password()
+        user.save(using=self._db)
+        return user
+    
+    def create_user_with_unique_username(self, username, email=None, password=None, **extra_fields):
+        """
+        以 username 为基础创建普通用户，已被占用时自动加随机后缀，见 user/usernames.py
+        
+        用于第三方登录等由系统生成用户名的场景，也可以在管理命令和 shell 中批量创建用户时使用。
+        密码哈希只计算一次。
+        """
+        extra_fields.setdefault('is_staff', False)
+        extra_fields.setdefault('is_superuser', False)
+        user = self.model(email=self.normalize_email(email), **extra_fields)
+        user.set_password(password)
+        return usernames.save_with_unique_username(user, self.model.normalize_username(username), using=self._db)
+    
+    def get_by_login(self, login):
+        """
+        按用户名或邮箱查找用户，只查询一次
+        
+        邮箱一定包含 '@'，不含 '@' 时只按用户名查询；用户名和邮箱分别匹配到不同用户时优先用户名。
+        """
+        if '@' not in login:
+            return self.filter(username=login).first()
+        
+        users = list(
+            self.annotate(email_lower=Lower('email'))
+            .filter(Q(username=login) | (Q(email_lower=login.lower()) & ~Q(email='')))[:2]
+        )
+        for user in users:
+            if user.username == login:
+                return user
+        return users[0] if users else None
+
+
 class User(AbstractUser):
     """
     自定义用户模型，扩展Django默认用户
@@ -25,6 +95,8 @@ class User(AbstractUser):
     # 用户统计
     login_count = models.IntegerField(_('登录次数'), default=0)
     last_login_ip = models.GenericIPAddressField(_('最后登录IP'), blank=True, null=True)
+    # 登录统计和最后活跃时间先写入 Redis，由 flush_login_stats 定期批量写回，见 user/login_stats.py
+    last_seen = models.DateTimeField(_('最后活跃时间'), blank=True, null=True)
     
     # 元数据
     created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
@@ -32,13 +104,44 @@ class User(AbstractUser):
     
     # 匿名用户标识
     is_anonymous_user = models.BooleanField(default=False, verbose_name=_('是否为匿名用户'))
+    # 匿名登录时客户端提供的设备标识，同一设备复用同一个匿名账号
+    device_id = models.CharField(_('设备标识'), max_length=128, blank=True, null=True)
+    
+    objects = UserManager()
     
     class Meta:
+        # 邮箱的大小写不敏感唯一索引由迁移 0005 创建（Django 3.2 不支持表达式约束），
+        # SQLite 上修改用户表的迁移会重建表，需要像 0006 一样重新创建该索引
         verbose_name = _('用户')
         verbose_name_plural = _('用户')
+        constraints = [
+            # 每个设备最多一个匿名账号，同时作为按设备查找匿名账号的索引
+            models.UniqueConstraint(
+                fields=['device_id'],
+                condition=models.Q(is_anonymous_user=True),
+                name='user_anonymous_device_uniq',
+            ),
+        ]
+        indexes = [
+            # 清理长期不活跃的匿名用户，见 purge_anonymous_users
+            models.Index(fields=['is_anonymous_user', 'last_login'], name='user_anon_last_login_idx'),
+        ]
         
     def __str__(self):
         return self.nickname or self.username
+    
+    def set_password(self, raw_password):
+        # 哈希计算可交给进程池，见 user/hashers.py
+        self.password = hashers.make_password(raw_password)
+        self._password = raw_password
+    
+    def check_password(self, raw_password):
+        """校验密码，哈希算法或参数过期时登录成功后自动升级"""
+        def setter(raw_password):
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return hashers.check_password(raw_password, self.password, setter)
 
 class OAuthProvider(models.Model):
     """
@@ -0,0 +1,19 @@
+from oauth2_provider.models import get_application_model
+from rest_framework import permissions
+
+
+class IsStaffOrClientCredentials(permissions.BasePermission):
+    """
+    允许管理员，或使用 OAuth2 客户端凭证模式令牌的服务端调用方
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        if user and user.is_authenticated and user.is_staff:
+            return True
+
+        application = getattr(request.auth, 'application', None)
+        return bool(
+            application
+            and application.authorization_grant_type == get_application_model().GRANT_CLIENT_CREDENTIALS
+        )
@@ -0,0 +1,82 @@
+"""
+认证主体
+
+认证通过后 request.user 是一个只包含少量字段的不可变主体，
+权限判断、限流和令牌内省只用到这些字段；视图访问其他属性时才加载完整的用户记录。
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject, empty
+
+User = get_user_model()
+
+
+class Principal(NamedTuple):
+    """
+    缓存中保存的认证主体
+
+    NamedTuple 没有实例字典，序列化后只有字段值，进程内和 Redis 中的占用都很小。
+    """
+    id: int
+    username: str
+    is_active: bool
+    is_staff: bool
+    is_superuser: bool
+    is_premium: bool
+    premium_expiry: Optional[datetime]
+    is_anonymous_user: bool
+    language: str
+
+    @property
+    def premium_active(self):
+        """付费状态按到期时间实时计算"""
+        return bool(self.is_premium and (self.premium_expiry is None or self.premium_expiry > timezone.now()))
+
+
+# 构建认证主体需要查询的用户字段
+PRINCIPAL_FIELDS = Principal._fields
+
+
+def build_principal(user):
+    """从用户实例提取认证主体"""
+    return Principal(*(getattr(user, name) for name in PRINCIPAL_FIELDS))
+
+
+class PrincipalUser(SimpleLazyObject):
+    """
+    以认证主体为基础的延迟加载用户
+
+    主体字段、pk 和认证状态直接由主体提供；访问其他属性、修改属性或做类型判断时
+    才查询完整的用户记录，之后所有访问都转到该用户实例上。
+    """
+
+    def __init__(self, principal):
+        # LazyObject 的 __setattr__ 会触发加载，直接写入实例字典
+        self.__dict__['principal'] = principal
+        super().__init__(lambda: User.objects.get(pk=principal.id))
+
+    def __getattr__(self, name):
+        if self._wrapped is empty:
+            principal = self.__dict__['principal']
+            if name in PRINCIPAL_FIELDS:
+                return getattr(principal, name)
+            if name == 'pk':
+                return principal.id
+            if name == 'is_authenticated':
+                return True
+            if name == 'is_anonymous':
+                return False
+        return super().__getattr__(name)
+
+    @property
+    def is_loaded(self):
+        """是否已经加载了完整的用户记录"""
+        return self._wrapped is not empty
+
+    def __repr__(self):
+        if self._wrapped is empty:
+            return f'<PrincipalUser: {self.__dict__["principal"].username}>'
+        return super().__repr__()
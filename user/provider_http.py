@@ -0,0 +1,205 @@
+"""
+第三方登录提供商的 HTTP 客户端
+
+每个 worker 共用一个 requests.Session，按主机保持长连接（urllib3 连接池），第三方登录不再每次重新建立
+TLS 连接。每个提供商单独配置连接超时和读取超时，避免慢响应长时间占住同步 worker。
+
+重试次数有上限，等待时间为指数退避加全抖动（0 到 BACKOFF * 2^n 之间随机，不超过 MAX_BACKOFF）：
+- 幂等请求（如获取用户信息）在连接失败、超时和 502/503/504 时重试；
+- 非幂等请求（如用一次性授权码换令牌）只在连接尚未建立时重试，请求可能已被处理时不重试。
+
+每个提供商的请求耗时记录在当前 worker 的直方图中，见 stats()。
+"""
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    # (连接超时, 读取超时) 秒，未单独配置的提供商使用 default
+    'TIMEOUTS': {
+        'default': (3.05, 10),
+    },
+    'RETRIES': 2,
+    'BACKOFF': 0.2,
+    'MAX_BACKOFF': 2,
+    'POOL_CONNECTIONS': 10,  # 保持连接池的主机数
+    'POOL_MAXSIZE': 20,  # 每个主机最多保持的连接数
+    'USER_AGENT': 'UserCenter/1.0',
+}
+
+RETRY_STATUSES = (502, 503, 504)
+
+# 直方图的桶上界（秒），最后一个桶为 +Inf
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+_histograms = {}
+
+
+def get_config():
+    """读取 PROVIDER_HTTP 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'PROVIDER_HTTP', {}))
+    return config
+
+
+def get_session():
+    """当前进程共用的 Session，fork 后的子进程重新创建，不与父进程共用连接"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                config = get_config()
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=config['POOL_CONNECTIONS'],
+                    pool_maxsize=config['POOL_MAXSIZE'],
+                    max_retries=0,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['User-Agent'] = config['USER_AGENT']
+                _session, _session_pid = session, pid
+    return _session
+
+
+def close_session():
+    """关闭连接池，设置变更或测试时使用"""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def timeout_for(provider, config=None):
+    config = config or get_config()
+    timeouts = config['TIMEOUTS']
+    return tuple(timeouts.get(provider, timeouts['default']))
+
+
+def backoff(attempt, config):
+    """第 attempt 次重试前等待的秒数（全抖动）"""
+    return random.uniform(0, min(config['MAX_BACKOFF'], config['BACKOFF'] * 2 ** attempt))
+
+
+def _observe(provider, seconds, outcome):
+    with _lock:
+        histogram = _histograms.get(provider)
+        if histogram is None:
+            histogram = _histograms[provider] = {
+                'buckets': [0] * (len(BUCKETS) + 1), 'count': 0, 'sum': 0.0, 'errors': 0, 'retries': 0,
+            }
+        histogram['buckets'][bisect_left(BUCKETS, seconds)] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        if outcome == 'error':
+            histogram['errors'] += 1
+        elif outcome == 'retry':
+            histogram['retries'] += 1
+
+
+def stats():
+    """当前 worker 各提供商的请求耗时直方图（每次尝试计一次，桶为累计计数）"""
+    with _lock:
+        result = {}
+        for provider, histogram in _histograms.items():
+            cumulative, buckets = 0, {}
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            result[provider] = {
+                'buckets': buckets,
+                'count': histogram['count'],
+                'sum': round(histogram['sum'], 6),
+                'errors': histogram['errors'],
+                'retries': histogram['retries'],
+            }
+        return {'providers': result, 'pid': os.getpid()}
+
+
+def _retryable(error, idempotent):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not idempotent:
+        # 连接被拒绝、DNS 解析失败时请求尚未发出，可以重试；读取超时、连接被重置时请求可能已被处理
+        return isinstance(error, requests.ConnectionError) and _not_sent(error)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def _not_sent(error):
+    # 建立连接阶段的失败由 urllib3 以 NewConnectionError 作为 MaxRetryError.reason 抛出
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _redacted(error, provider, url):
+    """
+    同类型、不含 URL 的异常
+
+    requests 的异常信息中有完整 URL，微信换取令牌的查询参数中有应用密钥；调用方会记录异常或把异常信息
+    返回给客户端，这里只保留异常类型和主机。
+    """
+    message = f'请求 {provider} 失败: {type(error).__name__} ({urlsplit(url).netloc})'
+    return type(error)(message, request=error.request, response=error.response)
+
+
+def request(provider, method, url, idempotent=None, **kwargs):
+    """
+    向提供商发送请求，返回 requests.Response
+
+    idempotent 默认按方法判断（GET、HEAD 为幂等）。所有尝试都失败时抛出与最后一次异常同类型、
+    不含 URL 的异常，重试后仍为 502/503/504 时返回该响应。
+    """
+    config = get_config()
+    if idempotent is None:
+        idempotent = method.upper() in ('GET', 'HEAD')
+    kwargs.setdefault('timeout', timeout_for(provider, config))
+    session = get_session()
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException as exc:
+            retry = attempt < config['RETRIES'] and _retryable(exc, idempotent)
+            _observe(provider, time.perf_counter() - started, 'retry' if retry else 'error')
+            if not retry:
+                raise _redacted(exc, provider, url) from None
+            logger.warning(
+                "请求 %s 失败，第 %s 次重试: %s (%s)", provider, attempt + 1, type(exc).__name__, urlsplit(url).netloc
+            )
+        else:
+            retry = idempotent and response.status_code in RETRY_STATUSES and attempt < config['RETRIES']
+            _observe(provider, time.perf_counter() - started, 'retry' if retry else 'ok')
+            if not retry:
+                return response
+            logger.warning(
+                "请求 %s 返回 %s，第 %s 次重试 (%s)", provider, response.status_code, attempt + 1, urlsplit(url).netloc
+            )
+            response.close()
+        time.sleep(backoff(attempt, config))
+        attempt += 1
+
+
+def get(provider, url, **kwargs):
+    return request(provider, 'GET', url, **kwargs)
+
+
+def post(provider, url, **kwargs):
+    return request(provider, 'POST', url, **kwargs)
@@ -0,0 +1,123 @@
+"""
+第三方登录提供商配置的进程内注册表
+
+提供商配置很少修改，但每次第三方登录都要按 (name, app_id) 查询一到两次（找不到应用专用配置时
+再查 app_id='default'），提供商列表接口每次也要查询。这里在每个 worker 中缓存全部启用的提供商，
+查找和回退都在内存中完成。
+
+- 共享缓存中保存一个版本号，OAuthProvider 保存、删除后（事务提交时）换成新的版本号，
+  当前 worker 的注册表立即清空；
+- worker 最多每 CHECK_INTERVAL 秒读取一次版本号，与本地不同时重新加载，
+  所以其他 worker 最多在 CHECK_INTERVAL 秒后看到修改，修改所在的 worker 立即生效；
+- 读取版本号失败时每 CHECK_INTERVAL 秒直接从数据库重新加载。
+
+注册表中的实例在线程之间共享，调用方不应修改。
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import OAuthProvider
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'VERSION_KEY': 'oauth_providers:version',
+    'CHECK_INTERVAL': 5,
+}
+
+DEFAULT_APP_ID = 'default'
+
+_lock = threading.Lock()
+# (加载时的版本号, 上次确认版本号的时间, (name, app_id) -> 提供商)，整体替换，读取时无需加锁
+_state = (None, None, {})
+
+
+def get_config():
+    """读取 OAUTH_PROVIDER_REGISTRY 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'OAUTH_PROVIDER_REGISTRY', {}))
+    return config
+
+
+def current_version(config):
+    """共享缓存中的版本号，不存在时写入一个新的，缓存不可用时返回 None"""
+    cache = caches[config['CACHE_ALIAS']]
+    try:
+        version = cache.get(config['VERSION_KEY'])
+        if version is None:
+            cache.add(config['VERSION_KEY'], uuid.uuid4().hex, None)
+            version = cache.get(config['VERSION_KEY'])
+        return version
+    except Exception:
+        logger.warning("读取提供商配置版本号失败", exc_info=True)
+        return None
+
+
+def _registry():
+    global _state
+    config = get_config()
+    now = time.monotonic()
+    _, checked_at, providers = _state
+    if checked_at is not None and now - checked_at < config['CHECK_INTERVAL']:
+        return providers
+
+    with _lock:
+        loaded_version, checked_at, providers = _state
+        if checked_at is not None and now - checked_at < config['CHECK_INTERVAL']:
+            return providers
+        version = current_version(config)
+        if version is None or version != loaded_version:
+            providers = {
+                (provider.name, provider.app_id): provider
+                for provider in OAuthProvider.objects.filter(is_active=True).order_by('pk')
+            }
+        _state = (version, now, providers)
+        return providers
+
+
+def get(name, app_id=DEFAULT_APP_ID):
+    """按名称和应用ID查找启用的提供商，没有应用专用配置时使用 app_id='default' 的配置，都没有时返回 None"""
+    registry = _registry()
+    provider = registry.get((name, app_id))
+    if provider is None and app_id != DEFAULT_APP_ID:
+        provider = registry.get((name, DEFAULT_APP_ID))
+    return provider
+
+
+def active():
+    """全部启用的提供商，按主键排序"""
+    return list(_registry().values())
+
+
+def clear():
+    """清空当前 worker 的注册表，下次访问时重新加载"""
+    global _state
+    with _lock:
+        _state = (None, None, {})
+
+
+def bump():
+    """换成新的版本号，所有 worker 在下次确认版本号时重新加载"""
+    config = get_config()
+    try:
+        caches[config['CACHE_ALIAS']].set(config['VERSION_KEY'], uuid.uuid4().hex, None)
+    except Exception:
+        logger.warning("更新提供商配置版本号失败", exc_info=True)
+    clear()
+
+
+def invalidate():
+    """
+    使注册表失效：当前 worker 立即清空，版本号在事务提交后更新
+
+    版本号在提交前更新的话，其他 worker 可能在提交前按新版本号加载到旧配置。
+    """
+    clear()
+    transaction.on_commit(bump)
@@ -0,0 +1,341 @@
+"""
+基于 Redis 的滑动窗口限流
+
+每个接口对应 RATE_LIMITS['POLICIES'] 中的一条策略：
+- rates：{标识: 频率}，标识可以是 ip、user、username、app_id 或用 + 组合（如 ip+username），
+  频率写作 '次数/周期'，周期为 s、m、h、d 或带数字前缀（如 '5/15m'）；
+- failures：可选，登录失败等情况调用 record_failure 按 keys 中的标识计数，window 秒内达到 threshold 次后锁定，
+  锁定时长从 lockout 秒开始按 2 的幂递增，不超过 max_lockout 秒；成功后调用 reset_failures 清零。
+
+一次检查只执行一次 Lua 脚本（一次 Redis 往返），同时判断锁定和所有窗口；窗口使用有序集合保存请求时间，
+被拒绝的请求不计入窗口。缓存不是 Redis 或 Redis 不可用时放行。
+检查结果保存在请求上，由 RateLimitHeadersMiddleware 写入 RateLimit-* 响应头，被拒绝时 DRF 返回 429 和 Retry-After。
+"""
+import logging
+import math
+import re
+import time
+import uuid
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .cache import uses_redis
+from .utils import get_client_ip
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'ratelimit',
+    'POLICIES': {},
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_PATTERN = re.compile(r'^(\d+)/(\d*)([smhd])')
+
+# KEYS: 锁定键..., 窗口键...
+# ARGV: 锁定键数量, 当前毫秒时间, 本次请求的成员, (次数, 窗口毫秒)...
+# 返回: {是否放行, 重试毫秒, 剩余次数, 最紧的窗口的次数上限, 最紧的窗口重置毫秒}
+SLIDING_WINDOW_SCRIPT = """
+local locks = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local member = ARGV[3]
+
+for i = 1, locks do
+    local ttl = redis.call('PTTL', KEYS[i])
+    if ttl > 0 then
+        return {0, ttl, 0, 0, ttl}
+    end
+end
+
+local retry = 0
+local remaining = -1
+local limit = 0
+local reset = 0
+for i = locks + 1, #KEYS do
+    local arg = 4 + (i - locks - 1) * 2
+    local max_count = tonumber(ARGV[arg])
+    local window = tonumber(ARGV[arg + 1])
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now - window)
+    local count = redis.call('ZCARD', KEYS[i])
+    local oldest = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+    local window_reset = window
+    if oldest[2] then
+        window_reset = tonumber(oldest[2]) + window - now
+    end
+    if count >= max_count then
+        retry = math.max(retry, window_reset)
+    end
+    local left = max_count - count - 1
+    if remaining < 0 or left < remaining then
+        remaining = left
+        limit = max_count
+        reset = window_reset
+    end
+end
+
+if retry > 0 then
+    return {0, retry, 0, limit, reset}
+end
+
+for i = locks + 1, #KEYS do
+    local window = tonumber(ARGV[4 + (i - locks - 1) * 2 + 1])
+    redis.call('ZADD', KEYS[i], now, member)
+    redis.call('PEXPIRE', KEYS[i], window)
+end
+return {1, 0, math.max(remaining, 0), limit, reset}
+"""
+
+# KEYS: 失败计数键, 锁定键
+# ARGV: 计数窗口秒, 阈值, 初始锁定秒, 最长锁定秒
+# 返回: 锁定秒数，未锁定为 0
+FAILURE_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+end
+local threshold = tonumber(ARGV[2])
+if count < threshold then
+    return 0
+end
+local lockout = math.floor(math.min(tonumber(ARGV[3]) * 2 ^ (count - threshold), tonumber(ARGV[4])))
+redis.call('SET', KEYS[2], 1, 'EX', lockout)
+redis.call('EXPIRE', KEYS[1], math.max(tonumber(ARGV[1]), lockout))
+return lockout
+"""
+
+_scripts = {}
+
+
+def get_config():
+    """读取 RATE_LIMITS 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'RATE_LIMITS', {}))
+    return config
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60)，'5/15m' -> (5, 900)"""
+    match = RATE_PATTERN.match(rate)
+    if match is None:
+        raise ValueError(f'无效的限流频率: {rate}')
+    count, multiplier, period = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[period]
+
+
+def identify(request, name):
+    """
+    按标识名取请求的标识值，取不到时返回 None（该窗口不参与本次检查）
+    """
+    values = []
+    for part in name.split('+'):
+        if part == 'ip':
+            value = get_client_ip(request)
+        elif part == 'user':
+            user = getattr(request, 'user', None)
+            value = user.pk if user is not None and user.is_authenticated else None
+        elif part in ('username', 'app_id'):
+            data = getattr(request, 'data', None) or {}
+            value = data.get(part) if hasattr(data, 'get') else None
+            value = value or request.query_params.get(part)
+            if part == 'username' and value:
+                value = str(value).strip().lower()
+        else:
+            raise ValueError(f'未知的限流标识: {part}')
+        if value in (None, ''):
+            return None
+        values.append(str(value))
+    return ':'.join(values)
+
+
+def _connection(config):
+    if not config['ENABLED'] or not uses_redis(config['CACHE_ALIAS']):
+        return None
+    from django_redis import get_redis_connection
+
+    return get_redis_connection(config['CACHE_ALIAS'])
+
+
+def _run_script(connection, source, keys, args):
+    # Script 对象使用 EVALSHA，服务器上没有脚本时自动改用 EVAL
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = connection.register_script(source)
+    return script(keys=keys, args=args, client=connection)
+
+
+def _lock_key(config, policy, name, value):
+    return f"{config['KEY_PREFIX']}:{policy}:lock:{name}:{value}"
+
+
+def _failure_key(config, policy, name, value):
+    return f"{config['KEY_PREFIX']}:{policy}:fail:{name}:{value}"
+
+
+class RateLimitResult:
+    """一次检查的结果，时间单位为秒"""
+
+    def __init__(self, allowed, retry_after, remaining, limit, reset):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.remaining = remaining
+        self.limit = limit
+        self.reset = reset
+
+
+def check(policy, request):
+    """
+    检查请求是否超过策略的限制，放行时计入窗口
+
+    返回 RateLimitResult，未启用或没有可用的标识时返回 None。
+    """
+    config = get_config()
+    connection = _connection(config)
+    if connection is None:
+        return None
+    rule = config['POLICIES'][policy]
+
+    lock_keys = []
+    for name in rule.get('failures', {}).get('keys', ()):
+        value = identify(request, name)
+        if value is not None:
+            lock_keys.append(_lock_key(config, policy, name, value))
+
+    window_keys = []
+    args = []
+    for name, rate in rule.get('rates', {}).items():
+        value = identify(request, name)
+        if value is None:
+            continue
+        count, seconds = parse_rate(rate)
+        window_keys.append(f"{config['KEY_PREFIX']}:{policy}:{name}:{value}:{seconds}")
+        args += [count, seconds * 1000]
+
+    if not lock_keys and not window_keys:
+        return None
+
+    try:
+        allowed, retry_ms, remaining, limit, reset_ms = _run_script(
+            connection,
+            SLIDING_WINDOW_SCRIPT,
+            keys=lock_keys + window_keys,
+            args=[len(lock_keys), int(time.time() * 1000), uuid.uuid4().hex] + args,
+        )
+    except Exception:
+        logger.warning("限流检查失败，放行请求: policy=%s", policy, exc_info=True)
+        return None
+    return RateLimitResult(
+        bool(allowed), math.ceil(retry_ms / 1000), remaining, limit, math.ceil(reset_ms / 1000)
+    )
+
+
+def record_failure(policy, request):
+    """
+    记录一次失败（如密码错误），达到阈值后锁定对应标识
+
+    返回最长的锁定秒数，未锁定为 0。
+    """
+    config = get_config()
+    connection = _connection(config)
+    rule = config['POLICIES'].get(policy, {}).get('failures')
+    if connection is None or not rule:
+        return 0
+
+    lockout = 0
+    try:
+        for name in rule['keys']:
+            value = identify(request, name)
+            if value is None:
+                continue
+            lockout = max(lockout, _run_script(
+                connection,
+                FAILURE_SCRIPT,
+                keys=[_failure_key(config, policy, name, value), _lock_key(config, policy, name, value)],
+                args=[rule.get('window', 900), rule.get('threshold', 5), rule.get('lockout', 60), rule.get('max_lockout', 3600)],
+            ))
+    except Exception:
+        logger.warning("记录失败次数失败: policy=%s", policy, exc_info=True)
+    if lockout:
+        logger.warning("请求被临时锁定: policy=%s, IP=%s, 锁定 %s 秒", policy, get_client_ip(request), lockout)
+    return int(lockout)
+
+
+def reset_failures(policy, request):
+    """成功后清除失败计数"""
+    config = get_config()
+    connection = _connection(config)
+    rule = config['POLICIES'].get(policy, {}).get('failures')
+    if connection is None or not rule:
+        return
+    keys = []
+    for name in rule['keys']:
+        value = identify(request, name)
+        if value is not None:
+            keys.append(_failure_key(config, policy, name, value))
+    if keys:
+        try:
+            connection.delete(*keys)
+        except Exception:
+            logger.warning("清除失败次数失败: policy=%s", policy, exc_info=True)
+
+
+class PolicyThrottle(BaseThrottle):
+    """
+    按策略限流的 DRF 节流类，子类设置 policy
+    """
+    policy = None
+
+    def allow_request(self, request, view):
+        self.result = check(self.policy, request)
+        if self.result is None:
+            return True
+        # 供 RateLimitHeadersMiddleware 写入响应头
+        request._request.rate_limit = self.result
+        return self.result.allowed
+
+    def wait(self):
+        return self.result.retry_after if self.result is not None else None
+
+
+class LoginThrottle(PolicyThrottle):
+    policy = 'login'
+
+
+class RegisterThrottle(PolicyThrottle):
+    policy = 'register'
+
+
+class AnonymousLoginThrottle(PolicyThrottle):
+    policy = 'anonymous_login'
+
+
+class RedeemCodeThrottle(PolicyThrottle):
+    policy = 'redeem_code'
+
+
+class FeedbackThrottle(PolicyThrottle):
+    policy = 'feedback'
+
+
+class AvailabilityThrottle(PolicyThrottle):
+    policy = 'availability'
+
+
+class RateLimitHeadersMiddleware:
+    """
+    为经过限流检查的请求添加 RateLimit-Limit / RateLimit-Remaining / RateLimit-Reset 响应头
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        result = getattr(request, 'rate_limit', None)
+        if result is not None and result.limit:
+            response['RateLimit-Limit'] = result.limit
+            response['RateLimit-Remaining'] = result.remaining
+            response['RateLimit-Reset'] = result.reset
+        return response
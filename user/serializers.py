@@ -1,7 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from .models import UserOAuth, OAuthProvider
-from .utils import datetime_to_timestamp
+from .utils import datetime_to_timestamp, unique_violation_field
 
 User = get_user_model()
 
@@ -11,6 +12,7 @@ class UserSerializer(serializers.ModelSerializer):
     """
     date_joined = serializers.SerializerMethodField()
     last_login = serializers.SerializerMethodField()
+    last_seen = serializers.SerializerMethodField()
     premium_expiry = serializers.SerializerMethodField()
     
     class Meta:
@@ -19,7 +21,7 @@ class UserSerializer(serializers.ModelSerializer):
             'id', 'username', 'email', 'nickname', 'avatar', 
             'is_verified', 'is_premium', 'premium_expiry', 
             'language', 'timezone', 'is_anonymous_user',  # 添加匿名用户标识
-            'created_at', 'updated_at', 'date_joined', 'last_login'
+            'created_at', 'updated_at', 'date_joined', 'last_login', 'last_seen'
         ]
         read_only_fields = ['id', 'is_verified', 'is_premium', 'premium_expiry', 'created_at', 'updated_at']
     
@@ -28,6 +30,9 @@ class UserSerializer(serializers.ModelSerializer):
     
     def get_last_login(self, obj):
         return datetime_to_timestamp(obj.last_login)
+    
+    def get_last_seen(self, obj):
+        return datetime_to_timestamp(obj.last_seen)
         
     def get_premium_expiry(self, obj):
         return datetime_to_timestamp(obj.premium_expiry)
@@ -61,33 +66,37 @@ class SocialLoginSerializer(serializers.Serializer):
     app_id = serializers.CharField(required=False, default='default')  # 添加 app_id 字段
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
-    """用户注册序列化器"""
+    """
+    用户注册序列化器
+    
+    用户名、邮箱（不区分大小写）、手机号是否重复不预先查询，由数据库唯一约束判断，
+    插入冲突时转换为对应字段的错误。
+    """
     password = serializers.CharField(write_only=True, style={'input_type': 'password'})
     confirm_password = serializers.CharField(write_only=True, style={'input_type': 'password'})
     
+    # 唯一约束冲突时各字段的错误信息
+    unique_error_messages = {
+        'username': '该用户名已被使用',
+        'email': '该邮箱已被注册',
+        'phone': '该手机号已被使用',
+    }
+    
     class Meta:
         model = User
         fields = ['username', 'email', 'password', 'confirm_password', 'nickname', 'phone']
         extra_kwargs = {
             'email': {'required': True},
-            'nickname': {'required': False}
+            'nickname': {'required': False},
+            # 去掉 UniqueValidator，保留格式校验
+            'username': {'validators': [User.username_validator]},
+            'phone': {'validators': []},
         }
     
     def validate(self, data):
         # 验证两次密码是否一致
         if data.get('password') != data.get('confirm_password'):
             raise serializers.ValidationError("两次输入的密码不一致")
-        
-        # 验证邮箱是否已被使用
-        email = data.get('email')
-        if email and User.objects.filter(email=email).exists():
-            raise serializers.ValidationError("该邮箱已被注册")
-        
-        # 验证用户名是否已被使用
-        username = data.get('username')
-        if username and User.objects.filter(username=username).exists():
-            raise serializers.ValidationError("该用户名已被使用")
-        
         return data
     
     def create(self, validated_data):
@@ -95,15 +104,23 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         validated_data.pop('confirm_password', None)
         
         # 创建用户
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data.get('email', ''),
-            password=validated_data['password'],
-            nickname=validated_data.get('nickname', ''),
-            phone=validated_data.get('phone', ''),
-            is_active=validated_data.get('is_active', True),
-            is_verified=validated_data.get('is_verified', True)
-        )
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    username=validated_data['username'],
+                    email=validated_data.get('email', ''),
+                    password=validated_data['password'],
+                    nickname=validated_data.get('nickname', ''),
+                    # 手机号唯一，未填写时保存为 NULL，否则第二个不填手机号的用户会冲突
+                    phone=validated_data.get('phone') or None,
+                    is_active=validated_data.get('is_active', True),
+                    is_verified=validated_data.get('is_verified', True)
+                )
+        except IntegrityError as exc:
+            field = unique_violation_field(exc, list(self.unique_error_messages))
+            if field is None:
+                raise
+            raise serializers.ValidationError({field: [self.unique_error_messages[field]]}, code='unique')
         
         return user
 
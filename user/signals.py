@@ -0,0 +1,87 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from oauth2_provider.models import get_access_token_model, get_application_model
+from rest_framework.authtoken.models import Token
+
+from . import availability, providers
+from .authentication import oauth2_cache, oauth2_cache_key, token_cache
+from .models import OAuthProvider
+from .principal import PRINCIPAL_FIELDS
+
+AccessToken = get_access_token_model()
+Application = get_application_model()
+User = get_user_model()
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def invalidate_cached_access_token(sender, instance, created=False, **kwargs):
+    """访问令牌被吊销（删除）、刷新或修改后删除其缓存"""
+    if not created:
+        oauth2_cache.delete(oauth2_cache_key(instance.token))
+
+
+@receiver(pre_save, sender=AccessToken)
+def invalidate_replaced_access_token(sender, instance, **kwargs):
+    """不轮换刷新令牌时，DOT 刷新会原地替换访问令牌的值，需要删除旧值的缓存"""
+    if instance.pk is None:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list('token', flat=True).first()
+    if previous and previous != instance.token:
+        oauth2_cache.delete(oauth2_cache_key(previous))
+
+
+@receiver(post_save, sender=Application)
+def invalidate_application_access_tokens(sender, instance, created=False, **kwargs):
+    """应用信息（如授权类型）变更后删除其访问令牌的缓存，应用删除时令牌随之级联删除"""
+    if created:
+        return
+    tokens = AccessToken.objects.filter(application_id=instance.pk).values_list('token', flat=True)
+    oauth2_cache.delete(*(oauth2_cache_key(token) for token in tokens))
+
+
+def _invalidate_principal(user_id):
+    """删除用户的认证主体缓存（各令牌和 uid:<用户ID>），事务提交后再删除一次"""
+    keys = [f'uid:{user_id}'] + list(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+    token_cache.delete(*keys)
+    # 提交前其他请求可能按旧数据重新写入缓存
+    transaction.on_commit(lambda: token_cache.delete(*keys))
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_principal(sender, instance, created=False, update_fields=None, **kwargs):
+    """用户被禁用、权限或付费状态等主体字段变更后删除认证缓存，只更新其他字段的保存跳过"""
+    if created or (update_fields is not None and not set(PRINCIPAL_FIELDS) & set(update_fields)):
+        return
+    _invalidate_principal(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def invalidate_deleted_principal(sender, instance, **kwargs):
+    """删除用户前删除认证缓存，令牌随用户级联删除后无法再查到"""
+    _invalidate_principal(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def add_user_to_availability_filter(sender, instance, update_fields=None, **kwargs):
+    """用户名、邮箱在事务提交后加入可用性过滤器，只更新其他字段的保存跳过"""
+    if update_fields is not None and not {'username', 'email'} & set(update_fields):
+        return
+    items = availability.user_items(instance.username, instance.email)
+    transaction.on_commit(lambda: availability.add(items))
+
+
+@receiver(post_delete, sender=User)
+def mark_availability_filter_stale(sender, instance, **kwargs):
+    """删除的用户名、邮箱无法从过滤器中移除，计入失效条目数"""
+    count = len(availability.user_items(instance.username, instance.email))
+    transaction.on_commit(lambda: availability.mark_stale(count))
+
+
+@receiver(post_save, sender=OAuthProvider)
+@receiver(post_delete, sender=OAuthProvider)
+def invalidate_provider_registry(sender, instance, **kwargs):
+    """提供商配置修改、删除后使各 worker 的提供商注册表失效"""
+    providers.invalidate()
@@ -1,14 +1,31 @@
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from django.core.cache import cache
+from django.test import override_settings
+from django.utils import timezone
+from datetime import timedelta
 from unittest.mock import patch, MagicMock
+from io import StringIO
+from django.core.management import call_command
+from rest_framework.exceptions import AuthenticationFailed
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 import json
+import jwt
+import fakeredis
 
 from .models import OAuthProvider, UserOAuth
+from .authentication import (
+    BearerTokenAuthentication, DispatchingAuthentication, dispatch_stats, invalidate_user_tokens, issue_token,
+    oauth2_cache, token_cache,
+)
+from . import hashers, login_stats, token_expiry, tokens
+from .principal import Principal
+from .oauth import secret_cache
 
 User = get_user_model()
 
@@ -206,7 +223,7 @@ class OAuthTests(TestCase):
             is_active=True
         )
     
-    @patch('requests.get')
+    @patch('user.provider_http.get')
     def test_wechat_login(self, mock_get):
         """测试微信登录"""
         # 模拟微信API响应
@@ -257,7 +274,7 @@ class OAuthTests(TestCase):
             ).exists()
         )
     
-    @patch('requests.post')
+    @patch('user.provider_http.post')
     @patch('jwt.decode')
     def test_apple_login(self, mock_jwt_decode, mock_post):
         """测试苹果登录"""
@@ -420,3 +437,2002 @@ class UserProfileTests(TestCase):
         self.assertEqual(len(response.data['data']), 1)
         self.assertEqual(response.data['data'][0]['provider']['name'], 'test_provider')
         self.assertEqual(response.data['data'][0]['provider_user_id'], 'test_user_id')
+
+
+class TokenCacheTests(TestCase):
+    """令牌认证缓存测试"""
+    
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        self.factory = APIRequestFactory()
+        self.test_user = User.objects.create_user(
+            username='cacheuser',
+            email='cache@example.com',
+            password='testpassword123'
+        )
+        self.token = Token.objects.create(user=self.test_user)
+    
+    def authenticate(self, key=None):
+        request = self.factory.get('/', HTTP_AUTHORIZATION=key or self.token.key)
+        return BearerTokenAuthentication().authenticate(request)
+    
+    def test_repeat_authentication_skips_database(self):
+        """测试重复认证命中缓存"""
+        with self.assertNumQueries(1):
+            self.authenticate()
+        local_hits = token_cache.stats()['local_hits']
+        
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        
+        self.assertEqual(user.pk, self.test_user.pk)
+        self.assertEqual(user.username, 'cacheuser')
+        self.assertEqual(token.key, self.token.key)
+        self.assertEqual(token_cache.stats()['local_hits'], local_hits + 1)
+    
+    def test_shared_tier_after_local_eviction(self):
+        """测试本地缓存被清空后从共享缓存读取"""
+        self.authenticate()
+        token_cache.clear_local()
+        
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+        self.assertEqual(user.pk, self.test_user.pk)
+    
+    def test_invalid_token(self):
+        """测试无效令牌"""
+        self.assertIsNone(self.authenticate('invalid-token'))
+    
+    def test_inactive_user(self):
+        """测试禁用用户的令牌不能认证"""
+        self.authenticate()
+        self.test_user.is_active = False
+        self.test_user.save()
+        
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+    
+    def test_user_changes_invalidate_cache(self):
+        """测试在任何地方修改主体字段或删除用户后缓存失效，只修改其他字段时保留缓存"""
+        from .authentication import user_principal
+        self.authenticate()
+        user_principal(self.test_user.pk)
+        
+        self.test_user.nickname = 'renamed'
+        self.test_user.save(update_fields=['nickname'])
+        self.assertIsNotNone(token_cache.get(self.token.key))
+        self.assertIsNotNone(token_cache.get(f'uid:{self.test_user.pk}'))
+        
+        self.test_user.is_staff = True
+        self.test_user.save(update_fields=['is_staff'])
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertIsNone(token_cache.get(f'uid:{self.test_user.pk}'))
+        user, _ = self.authenticate()
+        self.assertTrue(user.is_staff)
+        
+        self.test_user.delete()
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertIsNone(self.authenticate())
+    
+    def test_logout_invalidates_cache(self):
+        """测试注销后缓存失效"""
+        self.authenticate()
+        
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token.key)
+        response = client.post('/api/users/logout/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(self.authenticate())
+    
+    def test_premium_update_invalidates_cache(self):
+        """测试更新付费状态后缓存失效"""
+        admin = User.objects.create_user(username='admin', password='adminpassword', is_staff=True)
+        self.authenticate()
+        
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        response = client.post(
+            f'/api/users/{self.test_user.pk}/update_premium_status/',
+            {'is_premium': True},
+            format='json'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user, _ = self.authenticate()
+        self.assertTrue(user.is_premium)
+
+
+def generate_private_key_pem():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode('utf-8')
+
+
+class SignedTokenTests(TestCase):
+    """签名访问令牌测试"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signed_settings = override_settings(SIGNED_TOKENS={
+            'ENABLED': True,
+            'PRIVATE_KEY': generate_private_key_pem(),
+        })
+        cls.signed_settings.enable()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.signed_settings.disable()
+        super().tearDownClass()
+    
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        self.client = APIClient()
+        self.test_user = User.objects.create_user(
+            username='jwtuser',
+            email='jwt@example.com',
+            password='testpassword123',
+            language='en'
+        )
+        self.token = Token.objects.create(user=self.test_user)
+    
+    def test_issue_and_decode(self):
+        """测试签发的访问令牌载荷"""
+        data = tokens.issue_signed_tokens(self.test_user, self.token)
+        claims = tokens.decode_signed_token(data['access_token'])
+        
+        self.assertEqual(claims['user_id'], self.test_user.pk)
+        self.assertEqual(claims['language'], 'en')
+        self.assertFalse(claims['is_premium'])
+        self.assertFalse(claims['is_anonymous_user'])
+    
+    def test_refresh_token_is_not_access_token(self):
+        """测试刷新令牌不能用作访问令牌"""
+        data = tokens.issue_signed_tokens(self.test_user, self.token)
+        with self.assertRaises(jwt.InvalidTokenError):
+            tokens.decode_signed_token(data['refresh_token'])
+    
+    def test_authenticate_with_access_token(self):
+        """测试使用访问令牌访问接口"""
+        data = tokens.issue_signed_tokens(self.test_user, self.token)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {data['access_token']}")
+        
+        response = self.client.get('/api/users/me/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['username'], 'jwtuser')
+    
+    def test_refresh(self):
+        """测试刷新访问令牌，注销后刷新令牌失效"""
+        data = tokens.issue_signed_tokens(self.test_user, self.token)
+        
+        response = self.client.post('/api/auth/token/refresh/', {'refresh_token': data['refresh_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access_token', response.data['data'])
+        
+        self.token.delete()
+        response = self.client.post('/api/auth/token/refresh/', {'refresh_token': data['refresh_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_jwks(self):
+        """测试公钥集合可以校验签发的令牌"""
+        response = self.client.get('/api/auth/jwks.json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        
+        jwk = response.data['keys'][0]
+        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk)
+        access_token = tokens.issue_signed_tokens(self.test_user, self.token)['access_token']
+        self.assertEqual(jwt.get_unverified_header(access_token)['kid'], jwk['kid'])
+        claims = jwt.decode(access_token, public_key, algorithms=['RS256'], issuer='usercenter')
+        self.assertEqual(claims['user_id'], self.test_user.pk)
+
+
+class TokenIntrospectionTests(TestCase):
+    """批量令牌内省测试"""
+    
+    url = '/api/auth/introspect/batch/'
+    
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        login_stats._seen = None
+        self.client = APIClient()
+        self.users = [
+            User.objects.create_user(username=f'introspect{i}', password='testpassword123')
+            for i in range(3)
+        ]
+        self.tokens = [Token.objects.create(user=user) for user in self.users]
+        self.admin = User.objects.create_user(username='gateway', password='adminpassword', is_staff=True)
+    
+    def test_batch_introspection(self):
+        """测试批量校验只查询一次数据库，另外一次批量记录最后活跃时间（缓存不是 Redis 时直接写数据库，有节流）"""
+        self.client.force_authenticate(user=self.admin)
+        keys = [token.key for token in self.tokens] + ['invalid-token']
+        
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {'tokens': keys}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual(data[self.tokens[0].key]['user_id'], self.users[0].pk)
+        self.assertTrue(data[self.tokens[0].key]['active'])
+        self.assertFalse(data[self.tokens[0].key]['is_premium'])
+        self.assertEqual(data['invalid-token'], {'active': False})
+        
+        with self.assertNumQueries(1):
+            self.client.post(self.url, {'tokens': keys}, format='json')
+    
+    def test_shares_single_token_cache(self):
+        """测试批量内省的结果可供单令牌认证使用"""
+        self.client.force_authenticate(user=self.admin)
+        self.client.post(self.url, {'tokens': [self.tokens[0].key]}, format='json')
+        
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.tokens[0].key)
+        with self.assertNumQueries(0):
+            user, _ = BearerTokenAuthentication().authenticate(request)
+        self.assertEqual(user.pk, self.users[0].pk)
+    
+    def test_client_credentials_caller(self):
+        """测试客户端凭证令牌可以调用"""
+        from oauth2_provider.models import AccessToken, Application
+        application = Application.objects.create(
+            name='gateway',
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS
+        )
+        access_token = AccessToken.objects.create(
+            token='gateway-access-token',
+            application=application,
+            expires=timezone.now() + timedelta(hours=1),
+            scope='read'
+        )
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token.token}')
+        response = self.client.post(self.url, {'tokens': [self.tokens[0].key]}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_regular_user_forbidden(self):
+        """测试普通用户不能调用"""
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.post(self.url, {'tokens': [self.tokens[1].key]}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    @override_settings(TOKEN_INTROSPECTION_BATCH_LIMIT=2)
+    def test_batch_limit(self):
+        """测试超过批量上限"""
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(self.url, {'tokens': [token.key for token in self.tokens]}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class IntrospectionFastPathTests(TestCase):
+    """令牌内省快速通道测试"""
+    
+    def setUp(self):
+        from .fastpath import IntrospectionWSGIApp
+        cache.clear()
+        token_cache.clear_local()
+        self.user = User.objects.create_user(username='fastpath', password='testpassword123')
+        self.token = Token.objects.create(user=self.user)
+        self.downstream = MagicMock(return_value=[b'django'])
+        self.app = IntrospectionWSGIApp(self.downstream)
+    
+    def call(self, path='/api/auth/introspect/', **headers):
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', **headers}
+        start_response = MagicMock()
+        body = b''.join(self.app(environ, start_response))
+        return start_response, body
+    
+    def test_introspect_token(self):
+        """测试快速通道返回内省结果，第二次请求不访问数据库"""
+        start_response, body = self.call(HTTP_AUTHORIZATION=f'Bearer {self.token.key}')
+        
+        self.assertEqual(start_response.call_args[0][0], '200 OK')
+        data = json.loads(body)['data']
+        self.assertEqual(data['user_id'], self.user.pk)
+        self.assertTrue(data['active'])
+        self.downstream.assert_not_called()
+        
+        with self.assertNumQueries(0):
+            _, cached_body = self.call(HTTP_AUTHORIZATION=self.token.key)
+        self.assertEqual(cached_body, body)
+    
+    def test_invalid_token(self):
+        """测试无效令牌"""
+        _, body = self.call(HTTP_AUTHORIZATION='invalid-token')
+        self.assertEqual(json.loads(body)['data'], {'active': False})
+        
+        _, body = self.call()
+        self.assertEqual(json.loads(body)['data'], {'active': False})
+    
+    def test_token_scheme(self):
+        """测试与认证类相同，支持 Token 认证方案"""
+        _, body = self.call(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        data = json.loads(body)['data']
+        self.assertEqual(data['user_id'], self.user.pk)
+        self.assertTrue(data['active'])
+    
+    def test_malformed_header_rejected_without_query(self):
+        """测试格式不符的令牌和不支持的认证方案不查询数据库"""
+        for authorization in (
+            'invalid-token', 'Bearer not-a-drf-token', 'Token abc', f'Basic {self.token.key}',
+            f'Token {self.token.key}x', 'Bearer ' + 'g' * 40,
+        ):
+            with self.assertNumQueries(0):
+                _, body = self.call(HTTP_AUTHORIZATION=authorization)
+            self.assertEqual(json.loads(body)['data'], {'active': False}, authorization)
+    
+    def test_invalidation(self):
+        """测试令牌缓存失效后重新生成结果"""
+        self.call(HTTP_AUTHORIZATION=self.token.key)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_user_tokens(self.user.pk)
+        
+        _, body = self.call(HTTP_AUTHORIZATION=self.token.key)
+        self.assertFalse(json.loads(body)['data']['active'])
+    
+    def test_other_paths_pass_through(self):
+        """测试其他路径交给 Django 处理"""
+        _, body = self.call(path='/api/users/me/', HTTP_AUTHORIZATION=self.token.key)
+        self.assertEqual(body, b'django')
+        self.downstream.assert_called_once()
+
+
+class AuthenticationDispatchTests(TestCase):
+    """认证后端分发测试"""
+    
+    def setUp(self):
+        from oauth2_provider.models import AccessToken, Application
+        cache.clear()
+        token_cache.clear_local()
+        self.user = User.objects.create_user(username='dispatch', password='testpassword123')
+        self.token = Token.objects.create(user=self.user)
+        application = Application.objects.create(
+            name='dispatch',
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE
+        )
+        self.access_token = AccessToken.objects.create(
+            token='dispatch-access-token',
+            user=self.user,
+            application=application,
+            expires=timezone.now() + timedelta(hours=1),
+            scope='read'
+        )
+    
+    def authenticate(self, **headers):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.request import Request
+        request = Request(APIRequestFactory().get('/', **headers))
+        before = dispatch_stats()
+        with CaptureQueriesContext(connection) as queries:
+            result = DispatchingAuthentication().authenticate(request)
+        after = dispatch_stats()
+        used = [name for name in before if name != 'pid' and after[name] != before[name]]
+        return result, used, [query['sql'] for query in queries.captured_queries]
+    
+    def test_drf_token(self):
+        """测试 DRF 令牌只走令牌后端"""
+        for header in (self.token.key, f'Token {self.token.key}'):
+            token_cache.clear_local()
+            cache.clear()
+            (user, _), used, _ = self.authenticate(HTTP_AUTHORIZATION=header)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(used, ['token'])
+    
+    def test_oauth2_token_skips_token_table(self):
+        """测试 OAuth2 访问令牌不再查询 DRF 令牌表"""
+        (user, _), used, queries = self.authenticate(HTTP_AUTHORIZATION=f'Bearer {self.access_token.token}')
+        
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(used, ['oauth2'])
+        self.assertFalse(any('authtoken_token' in sql for sql in queries))
+    
+    def test_session_without_header(self):
+        """测试没有 Authorization 头时使用会话认证"""
+        result, used, _ = self.authenticate()
+        self.assertIsNone(result)
+        self.assertEqual(used, ['session'])
+    
+    def test_unsupported_scheme(self):
+        """测试不支持的认证前缀不访问任何后端"""
+        result, used, queries = self.authenticate(HTTP_AUTHORIZATION='Basic dXNlcjpwYXNz')
+        self.assertIsNone(result)
+        self.assertEqual(used, ['unsupported'])
+        self.assertEqual(queries, [])
+    
+    def test_malformed_drf_token_rejected_without_query(self):
+        """测试不符合 DRF 令牌格式的值不查询令牌表"""
+        for header in ('not-a-token', f'Token {self.token.key}x', self.token.key.upper()):
+            result, used, queries = self.authenticate(HTTP_AUTHORIZATION=header)
+            self.assertIsNone(result)
+            self.assertEqual(used, ['unsupported'])
+            self.assertEqual(queries, [])
+
+
+class PrincipalUserTests(TestCase):
+    """精简认证主体测试"""
+    
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        self.test_user = User.objects.create_user(
+            username='principal',
+            password='testpassword123',
+            nickname='Principal'
+        )
+        self.token = Token.objects.create(user=self.test_user)
+        # 预热缓存
+        self.authenticate()
+    
+    def authenticate(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.token.key)
+        return BearerTokenAuthentication().authenticate(request)
+    
+    def test_principal_fields_without_query(self):
+        """测试主体字段不需要加载用户"""
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+            self.assertEqual(user.pk, self.test_user.pk)
+            self.assertEqual(user.id, self.test_user.pk)
+            self.assertTrue(user.is_authenticated)
+            self.assertFalse(user.is_staff)
+            self.assertEqual(token.user_id, self.test_user.pk)
+        self.assertFalse(user.is_loaded)
+        self.assertIsInstance(user.principal, Principal)
+    
+    def test_lazy_full_load(self):
+        """测试访问其他属性时加载完整用户"""
+        user, _ = self.authenticate()
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(user.nickname, 'Principal')
+            self.assertTrue(user.check_password('testpassword123'))
+        self.assertTrue(user.is_loaded)
+        self.assertIsInstance(user, User)
+    
+    def test_writes_go_to_full_user(self):
+        """测试修改属性写入完整用户"""
+        user, _ = self.authenticate()
+        user.nickname = 'Changed'
+        user.save(update_fields=['nickname'])
+        
+        self.test_user.refresh_from_db()
+        self.assertEqual(self.test_user.nickname, 'Changed')
+    
+    def test_me_endpoint(self):
+        """测试通过令牌访问 /me"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token.key)
+        response = client.get('/api/users/me/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['nickname'], 'Principal')
+
+
+@override_settings(TOKEN_EXPIRY={'ENABLED': True, 'ABSOLUTE_LIFETIME': 86400 * 10, 'IDLE_TIMEOUT': 86400})
+class TokenExpiryTests(TestCase):
+    """DRF 令牌有效期测试"""
+    
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        self.test_user = User.objects.create_user(username='expiry', password='testpassword123')
+        self.token = Token.objects.create(user=self.test_user)
+        # 开始记录使用情况的时间早于空闲超时
+        cache.set(token_expiry.TRACKING_SINCE_KEY, (timezone.now() - timedelta(days=30)).timestamp(), None)
+    
+    def age_token(self, days):
+        Token.objects.filter(key=self.token.key).update(created=timezone.now() - timedelta(days=days))
+    
+    def authenticate(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.token.key)
+        return BearerTokenAuthentication().authenticate(request)
+    
+    def test_absolute_expiry(self):
+        """测试超过绝对有效期的令牌被删除"""
+        self.age_token(11)
+        
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        self.assertIsNone(token_cache.get(self.token.key))
+    
+    def test_idle_expiry(self):
+        """测试长时间未使用的令牌过期"""
+        self.age_token(2)
+        
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+    
+    def test_sliding_renewal(self):
+        """测试使用记录让令牌持续有效，且续期不写数据库"""
+        self.authenticate()
+        self.age_token(2)
+        token_cache.clear_local()
+        
+        user, _ = self.authenticate()
+        self.assertEqual(user.pk, self.test_user.pk)
+        self.assertIsNotNone(cache.get(token_expiry.activity_key(self.token.key)))
+    
+    def test_login_replaces_expired_token(self):
+        """测试登录时替换已过期的令牌"""
+        self.age_token(11)
+        
+        token, created = issue_token(self.test_user)
+        self.assertTrue(created)
+        self.assertNotEqual(token.key, self.token.key)
+        
+        same_token, created = issue_token(self.test_user)
+        self.assertFalse(created)
+        self.assertEqual(same_token.key, token.key)
+    
+    def test_purge_command(self):
+        """测试分批清理过期令牌"""
+        self.age_token(11)
+        active_user = User.objects.create_user(username='active', password='testpassword123')
+        active_token = Token.objects.create(user=active_user)
+        
+        call_command('purge_expired_tokens', batch_size=1, sleep=0, stdout=StringIO())
+        
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        self.assertTrue(Token.objects.filter(key=active_token.key).exists())
+    
+    def test_tokens_issued_before_tracking_keep_full_lifetime(self):
+        """测试上线前签发的令牌从开始记录时算起，上线后第一次请求不会被判为过期"""
+        cache.delete(token_expiry.TRACKING_SINCE_KEY)
+        self.age_token(200)
+        
+        user, _ = self.authenticate()
+        self.assertEqual(user.pk, self.test_user.pk)
+        call_command('purge_expired_tokens', sleep=0, stdout=StringIO())
+        self.assertTrue(Token.objects.filter(key=self.token.key).exists())
+    
+    def test_anonymous_tokens_exempt(self):
+        """测试匿名用户的令牌不过期，也不会被清理命令删除"""
+        User.objects.filter(pk=self.test_user.pk).update(is_anonymous_user=True)
+        self.age_token(11)
+        
+        user, _ = self.authenticate()
+        self.assertEqual(user.pk, self.test_user.pk)
+        call_command('purge_expired_tokens', sleep=0, stdout=StringIO())
+        self.assertTrue(Token.objects.filter(key=self.token.key).exists())
+        
+        with override_settings(TOKEN_EXPIRY={'ABSOLUTE_LIFETIME': 86400 * 10, 'EXEMPT_ANONYMOUS': False}):
+            token_cache.clear_local()
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate()
+
+
+class OAuth2TokenCacheTests(TestCase):
+    """OAuth2 访问令牌缓存测试"""
+    
+    def setUp(self):
+        from oauth2_provider.models import AccessToken, Application
+        cache.clear()
+        token_cache.clear_local()
+        oauth2_cache.clear_local()
+        self.test_user = User.objects.create_user(username='oauth2cache', password='testpassword123')
+        self.application = Application.objects.create(
+            name='integration',
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE
+        )
+        self.access_token = AccessToken.objects.create(
+            token='cached-access-token',
+            user=self.test_user,
+            application=self.application,
+            expires=timezone.now() + timedelta(hours=1),
+            scope='read write'
+        )
+    
+    def authenticate(self):
+        from rest_framework.request import Request
+        request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.access_token.token}'))
+        return DispatchingAuthentication().authenticate(request)
+    
+    def test_repeat_authentication_skips_database(self):
+        """测试重复认证命中缓存"""
+        self.authenticate()
+        
+        with self.assertNumQueries(0):
+            user, access_token = self.authenticate()
+            self.assertEqual(user.pk, self.test_user.pk)
+            self.assertEqual(access_token.pk, self.access_token.pk)
+            self.assertTrue(access_token.allow_scopes(['read']))
+            self.assertEqual(access_token.application.pk, self.application.pk)
+    
+    def test_miss_and_hit_return_principal(self):
+        """测试缓存未命中和命中时都返回精简认证主体"""
+        from .principal import PrincipalUser
+        user, _ = self.authenticate()
+        self.assertIs(type(user), PrincipalUser)
+        user, _ = self.authenticate()
+        self.assertIs(type(user), PrincipalUser)
+    
+    def test_revoke_invalidates_cache(self):
+        """测试吊销令牌后缓存失效"""
+        self.authenticate()
+        self.access_token.revoke()
+        
+        self.assertIsNone(self.authenticate())
+    
+    def test_replaced_token_value_invalidates_cache(self):
+        """测试刷新时原地替换令牌值后旧值失效"""
+        old_token = self.access_token.token
+        self.authenticate()
+        self.access_token.token = 'refreshed-access-token'
+        self.access_token.save()
+        
+        self.access_token.token = old_token
+        self.assertIsNone(self.authenticate())
+    
+    def test_scope_change_invalidates_cache(self):
+        """测试修改权限范围后缓存失效"""
+        self.authenticate()
+        self.access_token.scope = 'read'
+        self.access_token.save()
+        
+        _, access_token = self.authenticate()
+        self.assertFalse(access_token.allow_scopes(['write']))
+    
+    def test_expired_cached_token(self):
+        """测试缓存中的令牌过期后不能认证"""
+        self.authenticate()
+        
+        with patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(hours=2)):
+            self.assertIsNone(self.authenticate())
+
+
+class ClientCredentialsTokenTests(TestCase):
+    """客户端凭证模式令牌端点测试"""
+    
+    url = '/o/token/'
+    
+    def setUp(self):
+        from oauth2_provider.models import Application
+        cache.clear()
+        secret_cache.clear_local()
+        self.secret = 'client-credentials-secret'
+        self.application = Application.objects.create(
+            name='backend',
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS,
+            client_secret=self.secret
+        )
+    
+    def request_token(self, secret=None, scope='read'):
+        return self.client.post(self.url, {
+            'grant_type': 'client_credentials',
+            'client_id': self.application.client_id,
+            'client_secret': secret or self.secret,
+            'scope': scope,
+        })
+    
+    def test_secret_verification_cached(self):
+        """测试密钥校验成功后不再重复计算哈希"""
+        from oauth2_provider import oauth2_validators
+        with patch.object(oauth2_validators, 'check_password', wraps=oauth2_validators.check_password) as check:
+            self.assertEqual(self.request_token().status_code, 200)
+            self.assertEqual(self.request_token().status_code, 200)
+        self.assertEqual(check.call_count, 1)
+    
+    def test_wrong_secret_not_cached(self):
+        """测试错误的密钥每次都会校验失败"""
+        self.assertEqual(self.request_token().status_code, 200)
+        self.assertEqual(self.request_token(secret='wrong-secret').status_code, 401)
+        self.assertEqual(self.request_token(secret='wrong-secret').status_code, 401)
+    
+    def test_reuse_unexpired_token(self):
+        """测试复用同一权限范围下未过期的令牌"""
+        from oauth2_provider.models import AccessToken
+        first = self.request_token().json()
+        second = self.request_token().json()
+        
+        self.assertEqual(first['access_token'], second['access_token'])
+        self.assertLessEqual(second['expires_in'], first['expires_in'])
+        self.assertEqual(AccessToken.objects.filter(application=self.application).count(), 1)
+        
+        other_scope = self.request_token(scope='read write').json()
+        self.assertNotEqual(other_scope['access_token'], first['access_token'])
+    
+    def test_revoked_token_not_reused(self):
+        """测试已吊销的令牌不会被复用"""
+        from oauth2_provider.models import AccessToken
+        first = self.request_token().json()
+        AccessToken.objects.get(token=first['access_token']).revoke()
+        
+        second = self.request_token().json()
+        self.assertNotEqual(first['access_token'], second['access_token'])
+
+
+class PurgeExpiredOAuth2Tests(TestCase):
+    """过期 OAuth2 数据清理测试"""
+    
+    def setUp(self):
+        from oauth2_provider.models import AccessToken, Application, Grant
+        cache.clear()
+        self.test_user = User.objects.create_user(username='purgeoauth', password='testpassword123')
+        application = Application.objects.create(
+            name='purge',
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
+            redirect_uris='https://example.com/callback'
+        )
+        now = timezone.now()
+        self.expired = [
+            AccessToken.objects.create(
+                token=f'expired-{i}', user=self.test_user, application=application,
+                expires=now - timedelta(hours=1), scope='read'
+            )
+            for i in range(3)
+        ]
+        self.active = AccessToken.objects.create(
+            token='active', user=self.test_user, application=application,
+            expires=now + timedelta(hours=1), scope='read'
+        )
+        Grant.objects.create(
+            user=self.test_user, application=application, code='expired-code',
+            expires=now - timedelta(minutes=1), redirect_uri='https://example.com/callback'
+        )
+    
+    def test_purge(self):
+        """测试分批删除过期令牌和授权码并输出表大小"""
+        from oauth2_provider.models import AccessToken, Grant
+        out = StringIO()
+        call_command('purge_expired_oauth2', batch_size=2, sleep=0, stdout=out)
+        
+        self.assertEqual(list(AccessToken.objects.values_list('token', flat=True)), ['active'])
+        self.assertFalse(Grant.objects.exists())
+        self.assertIn('已过期的访问令牌: 删除 3 条', out.getvalue())
+        self.assertIn('oauth2_provider_accesstoken: 1 行', out.getvalue())
+    
+    def test_time_budget(self):
+        """测试时间预算用完后停止"""
+        from oauth2_provider.models import AccessToken
+        from .maintenance import TimeBudget, delete_in_batches
+        budget = TimeBudget(1)
+        
+        with patch.object(TimeBudget, 'exhausted', new=property(lambda self: AccessToken.objects.count() < 3)):
+            deleted, complete = delete_in_batches(
+                AccessToken.objects.filter(expires__lt=timezone.now()), 2, budget
+            )
+        
+        self.assertEqual(deleted, 2)
+        self.assertFalse(complete)
+    
+    def test_skip_when_locked(self):
+        """测试其他节点持有锁时跳过"""
+        from oauth2_provider.models import AccessToken
+        from .maintenance import cache_lock
+        out = StringIO()
+        with cache_lock('purge_expired_oauth2', 60) as acquired:
+            self.assertTrue(acquired)
+            call_command('purge_expired_oauth2', stdout=out)
+        
+        self.assertIn('跳过', out.getvalue())
+        self.assertEqual(AccessToken.objects.count(), 4)
+
+
+class UsernameOrEmailBackendTests(TestCase):
+    """用户名或邮箱登录测试"""
+    
+    def setUp(self):
+        self.test_user = User.objects.create_user(
+            username='backenduser',
+            email='Backend@Example.com',
+            password='testpassword123'
+        )
+    
+    def login(self, username, password='testpassword123'):
+        from django.contrib.auth import authenticate
+        from django.contrib.auth.hashers import MD5PasswordHasher
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with patch.object(MD5PasswordHasher, 'verify', autospec=True, side_effect=MD5PasswordHasher.verify) as verify:
+            with CaptureQueriesContext(connection) as queries:
+                user = authenticate(username=username, password=password)
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT') and 'user_user' in q['sql']]
+        return user, len(selects), verify.call_count
+    
+    def test_username_login(self):
+        """测试用户名登录"""
+        user, selects, checks = self.login('backenduser')
+        self.assertEqual(user, self.test_user)
+        self.assertEqual((selects, checks), (1, 1))
+    
+    def test_email_login_case_insensitive(self):
+        """测试邮箱登录不区分大小写，只查询一次"""
+        user, selects, checks = self.login('backend@example.COM')
+        self.assertEqual(user, self.test_user)
+        self.assertEqual((selects, checks), (1, 1))
+    
+    def test_wrong_password_single_check(self):
+        """测试密码错误时只校验一次，不再尝试其他后端"""
+        user, selects, checks = self.login('backend@example.com', password='wrong')
+        self.assertIsNone(user)
+        self.assertEqual((selects, checks), (1, 1))
+    
+    def test_email_unique_case_insensitive(self):
+        """测试邮箱唯一索引不区分大小写，空邮箱不受限制"""
+        from django.db import IntegrityError, transaction
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username='duplicate', email='backend@example.com', password='x')
+        
+        User.objects.create_user(username='noemail1', password='x')
+        User.objects.create_user(username='noemail2', password='x')
+    
+    def test_registration_rejects_email_in_other_case(self):
+        """测试注册时邮箱查重不区分大小写（由唯一索引判断）"""
+        from rest_framework.exceptions import ValidationError
+        from .serializers import UserRegistrationSerializer
+        serializer = UserRegistrationSerializer(data={
+            'username': 'another',
+            'email': 'BACKEND@example.com',
+            'password': 'testpassword123',
+            'confirm_password': 'testpassword123',
+        })
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(ValidationError) as context:
+            serializer.save()
+        self.assertIn('email', context.exception.detail)
+
+
+@override_settings(
+    PASSWORD_HASHERS=[
+        'user.hashers.ScryptPasswordHasher',
+        'user.hashers.TunedPBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ],
+    PASSWORD_HASHING={'SCRYPT_WORK_FACTOR': 2 ** 4, 'PBKDF2_ITERATIONS': 1000},
+)
+class PasswordHashingTests(TestCase):
+    """密码哈希测试"""
+    
+    def setUp(self):
+        self.test_user = User.objects.create_user(username='hashuser', password='testpassword123')
+    
+    def login(self, password='testpassword123'):
+        from django.contrib.auth import authenticate
+        return authenticate(username='hashuser', password=password)
+    
+    def test_scrypt_format(self):
+        """测试 scrypt 哈希格式与参数"""
+        algorithm, work_factor, salt, block_size, parallelism, hash_ = self.test_user.password.split('$')
+        self.assertEqual((algorithm, work_factor, block_size, parallelism), ('scrypt', '16', '8', '1'))
+        self.assertTrue(self.test_user.check_password('testpassword123'))
+        self.assertFalse(self.test_user.check_password('wrong'))
+    
+    def test_legacy_hash_upgraded_on_login(self):
+        """测试旧算法的哈希在登录成功后升级"""
+        from django.contrib.auth.hashers import make_password
+        User.objects.filter(pk=self.test_user.pk).update(
+            password=make_password('testpassword123', hasher='md5')
+        )
+        
+        self.assertIsNone(self.login(password='wrong'))
+        self.test_user.refresh_from_db()
+        self.assertTrue(self.test_user.password.startswith('md5$'))
+        
+        self.assertEqual(self.login(), self.test_user)
+        self.test_user.refresh_from_db()
+        self.assertTrue(self.test_user.password.startswith('scrypt$16$'))
+    
+    def test_parameter_change_upgraded_on_login(self):
+        """测试修改哈希参数后，旧参数的哈希在登录成功后升级"""
+        with self.settings(PASSWORD_HASHING={'SCRYPT_WORK_FACTOR': 2 ** 5}):
+            self.assertEqual(self.login(), self.test_user)
+        self.test_user.refresh_from_db()
+        self.assertTrue(self.test_user.password.startswith('scrypt$32$'))
+    
+    def test_create_user_uses_hashing_pool(self):
+        """测试注册和 create_user、create_superuser 的密码哈希经过 hashers.run，可交给进程池"""
+        with patch.object(hashers, 'run', wraps=hashers.run) as run:
+            user = User.objects.create_user(username='pooled', email='Pooled@EXAMPLE.com', password='testpassword123')
+            User.objects.create_superuser(username='pooled-admin', email='', password='testpassword123')
+            response = APIClient().post('/api/auth/register/', {
+                'username': 'pooled-register',
+                'email': 'pooled-register@example.com',
+                'password': 'testpassword123',
+                'confirm_password': 'testpassword123',
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(user.email, 'Pooled@example.com')
+        self.assertTrue(User.objects.get(username='pooled-register').check_password('testpassword123'))
+    
+    def test_process_pool(self):
+        """测试哈希计算在进程池中执行"""
+        import os
+        with self.settings(PASSWORD_HASHING={'SCRYPT_WORK_FACTOR': 2 ** 4, 'POOL_WORKERS': 1}):
+            try:
+                self.assertNotEqual(hashers.run(os.getpid), os.getpid())
+                encoded = hashers.make_password('pooled-password')
+                self.assertTrue(hashers.check_password('pooled-password', encoded))
+                self.assertFalse(hashers.check_password('wrong', encoded))
+            finally:
+                hashers.shutdown_pool()
+
+
+# 使用 fakeredis 的 django-redis 缓存，用于测试依赖 Redis 命令的写缓冲
+FAKE_REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://fake-redis:6379/0',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection},
+        },
+    }
+}
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES)
+class LoginStatsTests(TestCase):
+    """登录统计写缓冲测试"""
+    
+    def setUp(self):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+        self.redis.flushall()
+        login_stats._local().clear()
+        token_cache.clear_local()
+        self.test_user = User.objects.create_user(username='statsuser', password='testpassword123')
+        self.client = APIClient()
+    
+    def login(self):
+        return self.client.post('/api/auth/token/', {
+            'username': 'statsuser',
+            'password': 'testpassword123'
+        }, format='json', REMOTE_ADDR='10.0.0.1')
+    
+    def test_login_buffered_then_flushed(self):
+        """测试登录统计先写入缓冲，写回时用 F() 累加"""
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 200)
+        
+        self.test_user.refresh_from_db()
+        self.assertEqual(self.test_user.login_count, 0)
+        self.assertIsNone(self.test_user.last_login)
+        
+        # 写回前数据库中的值被其他途径修改，写回时在其基础上累加
+        User.objects.filter(pk=self.test_user.pk).update(login_count=5)
+        
+        out = StringIO()
+        call_command('flush_login_stats', stdout=out)
+        self.assertIn('写回 1 个用户', out.getvalue())
+        
+        self.test_user.refresh_from_db()
+        self.assertEqual(self.test_user.login_count, 7)
+        self.assertEqual(self.test_user.last_login_ip, '10.0.0.1')
+        self.assertIsNotNone(self.test_user.last_login)
+        self.assertIsNotNone(self.test_user.last_seen)
+        self.assertEqual(login_stats.flush(), 0)
+    
+    def test_me_merges_buffered_values(self):
+        """测试 /me 合并缓冲中尚未写回的值"""
+        token = self.login().json()['data']['token']
+        self.client.credentials(HTTP_AUTHORIZATION=token)
+        
+        data = self.client.get('/api/users/me/').json()['data']
+        self.assertIsNotNone(data['last_login'])
+        self.assertIsNotNone(data['last_seen'])
+    
+    def test_merged_values(self):
+        """测试数据库中的值与缓冲中的值合并"""
+        login_stats.record_login(self.test_user)
+        login_stats.record_login(self.test_user)
+        
+        user = User.objects.get(pk=self.test_user.pk)
+        user.login_count = 3
+        login_stats.apply_pending([user])
+        self.assertEqual(user.login_count, 5)
+        self.assertIsNotNone(user.last_login)
+    
+    def test_token_use_touches_last_seen_once(self):
+        """测试令牌使用时记录最后活跃时间，并按间隔节流"""
+        token = Token.objects.create(user=self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=token.key)
+        self.client.get('/api/users/me/')
+        
+        key = login_stats.stats_key(self.test_user.pk)
+        first = self.redis.hget(key, 'last_seen')
+        self.assertIsNotNone(first)
+        self.assertIsNone(self.redis.hget(key, 'login_count'))
+        
+        self.redis.delete(key)
+        self.client.get('/api/users/me/')
+        self.assertIsNone(self.redis.hget(key, 'last_seen'))
+    
+    def test_failed_write_restores_buffer(self):
+        """测试写回数据库失败时缓冲中的值不丢失"""
+        login_stats.record_login(self.test_user)
+        with patch.object(login_stats, '_write', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                login_stats.flush()
+        
+        self.assertEqual(login_stats.flush(), 1)
+        self.test_user.refresh_from_db()
+        self.assertEqual(self.test_user.login_count, 1)
+    
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_without_redis_writes_directly(self):
+        """测试缓存不是 Redis 时直接更新数据库"""
+        self.assertEqual(self.login().status_code, 200)
+        self.test_user.refresh_from_db()
+        self.assertEqual(self.test_user.login_count, 1)
+        self.assertEqual(self.test_user.last_login_ip, '10.0.0.1')
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES, RATE_LIMITS={
+    'POLICIES': {
+        'login': {
+            'rates': {'ip': '4/m'},
+            'failures': {'keys': ['ip+username'], 'window': 900, 'threshold': 2, 'lockout': 60, 'max_lockout': 3600},
+        },
+        'redeem_code': {
+            'rates': {'user': '10/h'},
+            'failures': {'keys': ['user'], 'window': 3600, 'threshold': 2, 'lockout': 300, 'max_lockout': 86400},
+        },
+    },
+})
+class RateLimitTests(TestCase):
+    """接口限流测试"""
+    
+    def setUp(self):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+        self.redis.flushall()
+        token_cache.clear_local()
+        self.test_user = User.objects.create_user(username='limituser', password='testpassword123')
+        self.client = APIClient()
+    
+    def login(self, username='limituser', password='testpassword123', ip='10.0.0.1', **extra):
+        return self.client.post('/api/auth/token/', {
+            'username': username,
+            'password': password
+        }, format='json', REMOTE_ADDR=ip, **extra)
+    
+    def test_parse_rate(self):
+        """测试频率格式"""
+        from .ratelimit import parse_rate
+        self.assertEqual(parse_rate('10/m'), (10, 60))
+        self.assertEqual(parse_rate('5/15m'), (5, 900))
+        self.assertEqual(parse_rate('100/day'), (100, 86400))
+        with self.assertRaises(ValueError):
+            parse_rate('ten/m')
+    
+    def test_sliding_window_headers(self):
+        """测试窗口内超出次数返回 429，并带有限流响应头"""
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['RateLimit-Limit'], '4')
+        self.assertEqual(response['RateLimit-Remaining'], '3')
+        
+        for _ in range(3):
+            self.login()
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        
+        # 窗口按 IP 计数，其他 IP 不受影响，也不能通过更换用户名绕过
+        self.assertEqual(self.login(username='other').status_code, 429)
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 200)
+    
+    @override_settings(TRUSTED_PROXY_COUNT=1)
+    def test_forged_forwarded_for_ignored(self):
+        """测试客户端伪造的 X-Forwarded-For 不影响限流和失败锁定，按代理追加的地址计数"""
+        for index in range(2):
+            response = self.login(password='wrong', HTTP_X_FORWARDED_FOR=f'192.0.2.{index}, 10.0.0.9')
+            self.assertEqual(response.status_code, 400)
+        response = self.login(password='wrong', HTTP_X_FORWARDED_FOR='192.0.2.99, 10.0.0.9')
+        self.assertEqual(response.status_code, 429)
+        
+        from .utils import get_client_ip
+        request = APIRequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.9', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(get_client_ip(request), '10.0.0.9')
+        with override_settings(TRUSTED_PROXY_COUNT=0):
+            self.assertEqual(get_client_ip(request), '127.0.0.1')
+    
+    @override_settings(RATE_LIMITS={'POLICIES': {'login': {
+        'failures': {'keys': ['ip+username'], 'window': 900, 'threshold': 2, 'lockout': 60, 'max_lockout': 3600},
+    }}})
+    def test_failures_lock_out_with_backoff(self):
+        """测试连续失败后锁定，成功登录清除失败计数"""
+        from . import ratelimit
+        self.assertEqual(self.login(password='wrong').status_code, 400)
+        self.assertEqual(self.login().status_code, 200)
+        
+        self.assertEqual(self.login(password='wrong').status_code, 400)
+        self.assertEqual(self.login(password='wrong').status_code, 400)
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 55)
+        
+        # 锁定只针对该 IP
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 200)
+        
+        # 再次失败时锁定时长翻倍
+        from rest_framework.parsers import JSONParser
+        from rest_framework.request import Request
+        request = APIRequestFactory().post('/api/auth/token/', {'username': 'limituser'}, format='json', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(ratelimit.record_failure('login', Request(request, parsers=[JSONParser()])), 120)
+    
+    def test_redeem_code_failures(self):
+        """测试连续兑换不存在的优惠码后锁定"""
+        token = Token.objects.create(user=self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION=token.key)
+        for _ in range(2):
+            response = self.client.post('/api/magics/redeem/', {'code': 'NOPE'}, format='json')
+            self.assertEqual(response.status_code, 404)
+        response = self.client.post('/api/magics/redeem/', {'code': 'NOPE'}, format='json')
+        self.assertEqual(response.status_code, 429)
+    
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_without_redis_not_limited(self):
+        """测试缓存不是 Redis 时不限流"""
+        for _ in range(5):
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('RateLimit-Limit', response)
+
+
+class AnonymousLoginTests(TestCase):
+    """匿名登录测试"""
+    
+    def setUp(self):
+        self.client = APIClient()
+    
+    def test_anonymous_login_fast_path(self):
+        """测试匿名登录不计算密码哈希，用户和令牌各插入一次，登录信息随创建写入"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with patch.object(hashers, 'run') as run:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/anonymous/login/', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response.status_code, 200)
+        run.assert_not_called()
+        statements = [q['sql'].split()[0] for q in queries.captured_queries
+                      if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        self.assertEqual(statements, ['INSERT', 'INSERT'])
+        
+        data = response.json()['data']
+        user = User.objects.get(pk=data['user']['id'])
+        self.assertTrue(user.is_anonymous_user)
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual((user.login_count, user.last_login_ip), (1, '10.0.0.3'))
+        self.assertEqual(Token.objects.get(user=user).key, data['token'])
+        
+        # 令牌可以直接使用
+        self.client.credentials(HTTP_AUTHORIZATION=data['token'])
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+    
+    def test_device_reuses_anonymous_account(self):
+        """测试同一设备复用匿名账号，响应格式不变"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        first = self.client.post('/api/anonymous/login/', {'device_id': 'device-1'}, format='json')
+        self.assertEqual(first.status_code, 200)
+        
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.post('/api/anonymous/login/', {'device_id': 'device-1'}, format='json')
+        self.assertEqual(second.status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('INSERT')])
+        self.assertEqual(set(second.json()['data']), set(first.json()['data']))
+        self.assertEqual(second.json()['data']['user']['id'], first.json()['data']['user']['id'])
+        self.assertEqual(second.json()['data']['token'], first.json()['data']['token'])
+        
+        other = self.client.post('/api/anonymous/login/', {'device_id': 'device-2'}, format='json')
+        self.assertNotEqual(other.json()['data']['user']['id'], first.json()['data']['user']['id'])
+        self.assertEqual(User.objects.filter(is_anonymous_user=True).count(), 2)
+    
+    def test_device_mapping_rechecked(self):
+        """测试缓存的设备映射过时（账号已转正）时重新创建匿名账号"""
+        first = self.client.post('/api/anonymous/login/', {'device_id': 'device-3'}, format='json')
+        User.objects.filter(pk=first.json()['data']['user']['id']).update(is_anonymous_user=False)
+        
+        second = self.client.post('/api/anonymous/login/', {'device_id': 'device-3'}, format='json')
+        self.assertNotEqual(second.json()['data']['user']['id'], first.json()['data']['user']['id'])
+    
+    def test_device_concurrent_first_login(self):
+        """测试同一设备并发首次登录时，唯一约束冲突的一方复用已创建的账号"""
+        from . import anonymous
+        existing = User.objects.create_anonymous_user(username='anon_existing', device_id='device-4')
+        with patch.object(anonymous, 'find_device_user', side_effect=[None, existing]):
+            response = self.client.post('/api/anonymous/login/', {'device_id': 'device-4'}, format='json')
+        self.assertEqual(response.json()['data']['user']['id'], existing.pk)
+        self.assertEqual(User.objects.filter(device_id='device-4').count(), 1)
+    
+    def test_device_id_too_long(self):
+        """测试设备标识长度校验"""
+        response = self.client.post('/api/anonymous/login/', {'device_id': 'x' * 129}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES)
+class PurgeAnonymousUsersTests(TestCase):
+    """不活跃匿名用户清理测试"""
+    
+    def setUp(self):
+        from django_redis import get_redis_connection
+        from magics.models import MagicCode, MagicCodeUsage
+        get_redis_connection('default').flushall()
+        self.old = timezone.now() - timedelta(days=100)
+        self.stale = []
+        for i in range(3):
+            user = User.objects.create_anonymous_user(
+                username=f'anon_stale_{i}', device_id=f'stale-device-{i}', last_login=self.old
+            )
+            Token.objects.create(user=user)
+            self.stale.append(user)
+        code = MagicCode.objects.create(code='PURGE1', max_uses=10)
+        MagicCodeUsage.objects.create(code=code, user=self.stale[0])
+        provider = OAuthProvider.objects.create(name='google', app_id='purge', client_id='id', client_secret='secret')
+        UserOAuth.objects.create(user=self.stale[1], provider=provider, provider_user_id='g-1', access_token='t')
+        
+        # 从未记录登录时间的旧账号按注册时间判断
+        self.legacy = User.objects.create_anonymous_user(username='anon_legacy')
+        User.objects.filter(pk=self.legacy.pk).update(date_joined=self.old)
+        
+        self.recent = User.objects.create_anonymous_user(username='anon_recent', last_login=timezone.now())
+        self.seen = User.objects.create_anonymous_user(
+            username='anon_seen', last_login=self.old, last_seen=timezone.now()
+        )
+        self.regular = User.objects.create_user(username='purge_regular', password='testpassword123')
+        User.objects.filter(pk=self.regular.pk).update(last_login=self.old)
+    
+    def test_purge(self):
+        """测试分批删除不活跃的匿名用户及其令牌、第三方账号关联和优惠码使用记录"""
+        from magics.models import MagicCodeUsage
+        out = StringIO()
+        call_command('purge_anonymous_users', batch_size=2, sleep=0, stdout=out)
+        
+        remaining = set(User.objects.values_list('username', flat=True))
+        self.assertEqual(remaining, {'anon_recent', 'anon_seen', 'purge_regular'})
+        self.assertFalse(Token.objects.filter(user_id__in=[user.pk for user in self.stale]).exists())
+        self.assertFalse(MagicCodeUsage.objects.exists())
+        self.assertFalse(UserOAuth.objects.exists())
+        self.assertIn('第 1 批: 扫描 2 个，删除 2 个', out.getvalue())
+        self.assertIn('删除 4 个', out.getvalue())
+        self.assertIn('已完成', out.getvalue())
+    
+    def test_buffered_login_skipped(self):
+        """测试缓冲中尚未写回的登录记录也视为活跃"""
+        login_stats.record_login(self.stale[0])
+        call_command('purge_anonymous_users', sleep=0, stdout=StringIO())
+        self.assertTrue(User.objects.filter(pk=self.stale[0].pk).exists())
+        self.assertFalse(User.objects.filter(pk=self.stale[1].pk).exists())
+    
+    def test_caches_cleared(self):
+        """测试删除后认证缓存和设备映射失效"""
+        from . import anonymous
+        token = Token.objects.get(user=self.stale[0])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=token.key)
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+        self.assertEqual(anonymous.find_device_user('stale-device-0'), self.stale[0])
+        
+        call_command('purge_anonymous_users', sleep=0, stdout=StringIO())
+        
+        self.assertEqual(client.get('/api/users/me/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertIsNone(anonymous.find_device_user('stale-device-0'))
+        self.assertIsNone(cache.get(anonymous.device_cache_key('stale-device-0')))
+    
+    def test_introspection_counts_as_activity(self):
+        """测试只经网关内省（快速通道和批量内省）使用的匿名账号不会被清理"""
+        from .authentication import resolve_principals
+        from .fastpath import introspect
+        login_stats._seen = None
+        token_cache.clear_local()
+        keys = [Token.objects.get(user=user).key for user in self.stale[:2]]
+        
+        self.assertTrue(json.loads(introspect(f'Token {keys[0]}'))['data']['active'])
+        self.assertEqual(set(resolve_principals([keys[1]])), {keys[1]})
+        call_command('purge_anonymous_users', sleep=0, stdout=StringIO())
+        
+        self.assertTrue(User.objects.filter(pk=self.stale[0].pk).exists())
+        self.assertTrue(User.objects.filter(pk=self.stale[1].pk).exists())
+        self.assertFalse(User.objects.filter(pk=self.stale[2].pk).exists())
+    
+    def test_resume_after_time_budget(self):
+        """测试时间预算用完后停止，再次执行继续删除剩余部分"""
+        from .maintenance import TimeBudget
+        out = StringIO()
+        stale_pk = self.stale[0].pk
+        with patch.object(TimeBudget, 'exhausted', new=property(
+            lambda budget: not User.objects.filter(pk=stale_pk).exists()
+        )):
+            call_command('purge_anonymous_users', batch_size=1, sleep=0, stdout=out)
+        self.assertIn('剩余部分下次继续', out.getvalue())
+        self.assertEqual(User.objects.filter(is_anonymous_user=True).count(), 5)
+        
+        call_command('purge_anonymous_users', batch_size=1, sleep=0, stdout=StringIO())
+        self.assertEqual(User.objects.filter(is_anonymous_user=True).count(), 2)
+    
+    def test_dry_run(self):
+        """测试只统计不删除"""
+        out = StringIO()
+        call_command('purge_anonymous_users', days=30, dry_run=True, stdout=out)
+        self.assertIn('待删除约 5 个', out.getvalue())
+        self.assertEqual(User.objects.count(), 7)
+
+
+class RegistrationTests(TestCase):
+    """注册测试"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        User.objects.create_user(username='testuser', email='test@example.com', password='testpassword123')
+        self.user_data = {
+            'username': 'newuser',
+            'email': 'newuser@example.com',
+            'password': 'newpassword123',
+            'confirm_password': 'newpassword123',
+        }
+    
+    def test_user_registration_duplicates(self):
+        """测试用户名、邮箱（不区分大小写）重复由唯一约束判断，返回对应字段的错误"""
+        for field, value in (('username', 'testuser'), ('email', 'TEST@example.com')):
+            data = {**self.user_data, field: value}
+            response = self.client.post('/api/auth/register/', data, format='json')
+            
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['msg'], '注册失败')
+            self.assertIn(field, response.data['data'])
+        self.assertEqual(User.objects.count(), 1)
+        self.assertFalse(Token.objects.exists())
+    
+    def test_user_registration_queries(self):
+        """测试注册不做重复性预查询，用户和令牌在同一事务中各插入一次"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/auth/register/', self.user_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        statements = [q['sql'].split()[0] for q in queries.captured_queries
+                      if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        self.assertEqual(statements, ['INSERT', 'INSERT'])
+        self.assertEqual(Token.objects.get(user__username='newuser').key, response.data['data']['token'])
+    
+    def test_user_registration_without_phone(self):
+        """测试多个用户不填手机号注册不会冲突，重复的手机号返回字段错误"""
+        for i in range(2):
+            data = {**self.user_data, 'username': f'nophone{i}', 'email': f'nophone{i}@example.com', 'phone': ''}
+            response = self.client.post('/api/auth/register/', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.filter(phone__isnull=True).count(), 3)
+        
+        self.client.post('/api/auth/register/', {**self.user_data, 'phone': '13800000000'}, format='json')
+        data = {**self.user_data, 'username': 'samephone', 'email': 'samephone@example.com', 'phone': '13800000000'}
+        response = self.client.post('/api/auth/register/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('phone', response.data['data'])
+
+
+class UsernameAllocationTests(TestCase):
+    """唯一用户名分配测试"""
+    
+    def test_base_username_free(self):
+        """测试用户名未被占用时直接使用，只插入一次"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            user = User.objects.create_user_with_unique_username('apple_001', password='testpassword123')
+        self.assertEqual(user.username, 'apple_001')
+        self.assertTrue(user.check_password('testpassword123'))
+        statements = [q['sql'].split()[0] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(statements, ['INSERT'])
+    
+    def test_taken_username_gets_suffix(self):
+        """测试用户名被占用时改用随机后缀，不逐个查询已有后缀"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        User.objects.create_user(username='wx_nick', password='testpassword123')
+        with patch.object(hashers, 'make_password', wraps=hashers.make_password) as make_password:
+            with CaptureQueriesContext(connection) as queries:
+                user = User.objects.create_user_with_unique_username('wx_nick', password='testpassword123')
+        self.assertRegex(user.username, r'^wx_nick_[a-z0-9]{6}$')
+        self.assertEqual(make_password.call_count, 1)
+        statements = [q['sql'].split()[0] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(statements, ['INSERT', 'INSERT'])
+    
+    def test_admin_add_user(self):
+        """测试后台新建用户使用同一个分配逻辑：用户名留空时按邮箱生成，已被占用时加随机后缀"""
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='testpassword123')
+        User.objects.create_user(username='zhangsan', password='testpassword123')
+        self.client.force_login(admin_user)
+        url = '/admin/user/user/add/'
+        for username, email, pattern in (
+            ('lisi', '', r'^lisi$'),
+            ('', 'wangwu@example.com', r'^wangwu$'),
+            ('', 'zhangsan@example.com', r'^zhangsan_[a-z0-9]{6}$'),
+        ):
+            response = self.client.post(url, {
+                'username': username, 'email': email,
+                'password1': 'Xq7#kLm2pR9v', 'password2': 'Xq7#kLm2pR9v',
+            })
+            self.assertEqual(response.status_code, 302)
+            user = User.objects.latest('pk')
+            self.assertRegex(user.username, pattern)
+            self.assertTrue(user.check_password('Xq7#kLm2pR9v'))
+    
+    def test_long_username_truncated(self):
+        """测试加后缀后不超过用户名的最大长度"""
+        base = 'x' * 150
+        User.objects.create_user(username=base)
+        user = User.objects.create_user_with_unique_username(base)
+        self.assertEqual(len(user.username), 150)
+        self.assertNotEqual(user.username, base)
+    
+    def test_existing_user_and_other_conflicts(self):
+        """测试更新已有用户时同样分配用户名，其他字段冲突直接抛出"""
+        from django.db import IntegrityError
+        from .usernames import save_with_unique_username
+        User.objects.create_user(username='taken', email='taken@example.com')
+        user = User.objects.create_anonymous_user(username='anon_convert')
+        save_with_unique_username(user, 'taken')
+        user.refresh_from_db()
+        self.assertTrue(user.username.startswith('taken_'))
+        
+        user.email = 'TAKEN@example.com'
+        with self.assertRaises(IntegrityError):
+            save_with_unique_username(user, 'another')
+
+
+class PasswordValidationTests(TestCase):
+    """密码校验器测试，与 Django 自带的校验器结果相同"""
+    
+    @classmethod
+    def setUpClass(cls):
+        import gzip
+        import random
+        import tempfile
+        from django.contrib.auth import password_validation as django_validation
+        from . import password_validation
+        super().setUpClass()
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.compiled_path = f'{cls.tempdir.name}/common-passwords.txt'
+        password_validation.compile_password_list(
+            django_validation.CommonPasswordValidator.DEFAULT_PASSWORD_LIST_PATH, cls.compiled_path
+        )
+        cls.ours = password_validation.CommonPasswordValidator(compiled_path=cls.compiled_path)
+        cls.django = django_validation.CommonPasswordValidator()
+        with gzip.open(django_validation.CommonPasswordValidator.DEFAULT_PASSWORD_LIST_PATH, 'rt') as f:
+            cls.common = [line.strip() for line in f]
+        rng = random.Random(20)
+        cls.random = [
+            ''.join(rng.choice('abcXYZ019 _-@é中') for _ in range(rng.randint(0, 16))) for _ in range(2000)
+        ]
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.tempdir.cleanup()
+        super().tearDownClass()
+    
+    def assert_same(self, ours, django, password, user=None):
+        from django.core.exceptions import ValidationError
+        results = []
+        for validator in (ours, django):
+            try:
+                validator.validate(password, user)
+                results.append(None)
+            except ValidationError as exc:
+                results.append((exc.error_list[0].code, str(exc.error_list[0].message) % (exc.error_list[0].params or {})))
+        self.assertEqual(results[0], results[1], password)
+    
+    def test_common_passwords(self):
+        """测试常见密码列表中的每一项及其大小写、空白变体，以及随机密码"""
+        passwords = self.common + [p.upper() for p in self.common[::7]] + [f' {p} ' for p in self.common[::11]]
+        passwords += [p + 'x' for p in self.common[::13]] + self.random
+        for password in passwords:
+            self.assert_same(self.ours, self.django, password)
+    
+    def test_user_attribute_similarity(self):
+        """测试与用户属性的相似度判断"""
+        from django.contrib.auth import password_validation as django_validation
+        from . import password_validation
+        users = [
+            User(username='testclient', first_name='Test', last_name='Client', email='testclient@example.com'),
+            User(username='a', email='a.b-c@d.com'),
+            User(username='中文用户', first_name='', email=''),
+            User(username='x' * 150),
+        ]
+        for max_similarity in (0.1, 0.5, 0.7, 1.0):
+            ours = password_validation.UserAttributeSimilarityValidator(max_similarity=max_similarity)
+            django = django_validation.UserAttributeSimilarityValidator(max_similarity=max_similarity)
+            passwords = ['', 'testclient', 'TestClient1', 'tneilctset', 'example', 'a', 'ab', '中文', 'x' * 20]
+            for user in users:
+                for password in passwords + self.random[:300]:
+                    self.assert_same(ours, django, password, user)
+            self.assert_same(ours, django, 'testclient', None)
+    
+    def test_compiled_list_used(self):
+        """测试编译结果通过校验时用 mmap 查找"""
+        self.assertIsNotNone(self.ours.compiled)
+        self.assertIn(b'password', self.ours.compiled)
+        self.assertNotIn(b'password-not-common', self.ours.compiled)
+    
+    def test_untrusted_compiled_list_ignored(self):
+        """测试编译结果被改动、可被其他用户写入或不存在时退回 Django 的内存集合，仍然拒绝常见密码"""
+        import os
+        import shutil
+        from django.core.exceptions import ValidationError
+        from . import password_validation
+        
+        def copy(name):
+            path = f'{self.tempdir.name}/{name}'
+            shutil.copyfile(self.compiled_path, path)
+            return path
+        
+        edited = copy('edited.txt')
+        with open(edited, 'r+b') as f:
+            f.seek(-20, os.SEEK_END)
+            f.write(b'\n' * 20)
+        emptied = copy('emptied.txt')
+        with open(emptied, 'r+b') as f:
+            f.truncate(len(f.readline()))
+        writable = copy('writable.txt')
+        os.chmod(writable, 0o666)
+        
+        for path in (edited, emptied, writable, f'{self.tempdir.name}/missing.txt'):
+            with self.assertLogs('user', 'WARNING'):
+                validator = password_validation.CommonPasswordValidator(compiled_path=path)
+            self.assertIsNone(validator.compiled, path)
+            with self.assertRaises(ValidationError):
+                validator.validate('password')
+        
+        # 源文件变化后编译结果过期
+        source = f'{self.tempdir.name}/source.txt'
+        with open(source, 'w') as f:
+            f.write('hunter2\n')
+        with self.assertLogs('user', 'WARNING'):
+            validator = password_validation.CommonPasswordValidator(source, compiled_path=self.compiled_path)
+        self.assertIsNone(validator.compiled)
+        with self.assertRaises(ValidationError):
+            validator.validate('hunter2')
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES)
+class IdempotencyTests(TestCase):
+    """Idempotency-Key 幂等请求测试"""
+    
+    def setUp(self):
+        from django_redis import get_redis_connection
+        get_redis_connection('default').flushall()
+        self.client = APIClient()
+        self.register_data = {
+            'username': 'idempotent',
+            'email': 'idempotent@example.com',
+            'password': 'testpassword123',
+            'confirm_password': 'testpassword123',
+        }
+    
+    def stored(self):
+        keys = cache.keys('idempotency:*')
+        self.assertEqual(len(keys), 1)
+        return keys[0], cache.get(keys[0])
+    
+    def test_register_replayed(self):
+        """测试重试注册返回第一次的响应，不再计算密码哈希和插入"""
+        first = self.client.post('/api/auth/register/', self.register_data, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        
+        with patch.object(hashers, 'make_password') as make_password:
+            second = self.client.post('/api/auth/register/', self.register_data, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        make_password.assert_not_called()
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(User.objects.filter(username='idempotent').count(), 1)
+        
+        # 没有请求头时按普通请求处理
+        third = self.client.post('/api/auth/register/', self.register_data, format='json')
+        self.assertEqual(third.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_provider_failure_not_stored(self):
+        """测试第三方登录连接提供商失败时返回 502，不保存响应，提供商恢复后同一个 Key 可以重试"""
+        import requests
+        OAuthProvider.objects.create(
+            name='wechat', client_id='wx_client_id', client_secret='wx_client_secret', is_active=True
+        )
+        data = {'provider': 'wechat', 'code': 'code-1'}
+        
+        def response(payload):
+            result = MagicMock()
+            result.status_code = 200
+            result.json.return_value = payload
+            return result
+        
+        with patch('user.provider_http.time.sleep'), \
+                patch('requests.Session.request', side_effect=requests.ConnectTimeout('boom')):
+            first = self.client.post('/api/auth/social-login/', data, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(first.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(cache.keys('idempotency:*'), [])
+        
+        with patch('requests.Session.request', side_effect=[
+            response({'access_token': 'wx-token', 'openid': 'openid-1'}),
+            response({'openid': 'openid-1', 'nickname': 'wx-user'}),
+        ]) as provider_request:
+            second = self.client.post('/api/auth/social-login/', data, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(provider_request.call_count, 2)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', second)
+    
+    def test_anonymous_login_and_redeem(self):
+        """测试匿名登录重试不会创建多个账号，兑换优惠码重试不会返回已使用"""
+        from magics.models import MagicCode
+        responses = [self.client.post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='anon') for _ in range(2)]
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(User.objects.filter(is_anonymous_user=True).count(), 1)
+        
+        MagicCode.objects.create(code='IDEMPOTENT', days=7, max_uses=10)
+        self.client.credentials(HTTP_AUTHORIZATION=responses[0].json()['data']['token'])
+        responses = [
+            self.client.post('/api/magics/redeem/', {'code': 'IDEMPOTENT'}, format='json', HTTP_IDEMPOTENCY_KEY='anon')
+            for _ in range(2)
+        ]
+        self.assertEqual([r.status_code for r in responses], [200, 200])
+        self.assertEqual(responses[0].json(), responses[1].json())
+    
+    def test_key_bound_to_caller(self):
+        """测试未登录时其他调用方使用相同的 Key 和参数不会拿到第一个调用方的令牌"""
+        first = self.client.post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='shared', REMOTE_ADDR='10.0.0.1')
+        second = APIClient().post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='shared', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual([first.status_code, second.status_code], [200, 200])
+        self.assertNotIn('Idempotent-Replayed', second)
+        self.assertNotEqual(first.json()['data']['token'], second.json()['data']['token'])
+        
+        third = APIClient().post(
+            '/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='shared', REMOTE_ADDR='10.0.0.1', HTTP_USER_AGENT='other'
+        )
+        self.assertNotEqual(first.json()['data']['token'], third.json()['data']['token'])
+    
+    def test_key_reused_with_other_parameters(self):
+        """测试相同的 Key 用于参数不同的请求返回 422"""
+        self.client.post('/api/auth/register/', self.register_data, format='json', HTTP_IDEMPOTENCY_KEY='k2')
+        data = {**self.register_data, 'username': 'other', 'email': 'other@example.com'}
+        response = self.client.post('/api/auth/register/', data, format='json', HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(User.objects.filter(username='other').exists())
+    
+    def test_concurrent_duplicate_waits(self):
+        """测试首个请求执行中时，重复请求等待其结果；等待超时返回 409"""
+        from . import idempotency
+        first = self.client.post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='k3')
+        key, entry = self.stored()
+        cache.set(key, {**entry, 'state': idempotency.PENDING, 'status': None, 'data': None})
+        
+        with patch.object(idempotency.time, 'sleep', side_effect=lambda seconds: cache.set(key, entry)) as sleep:
+            second = self.client.post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='k3')
+        sleep.assert_called_once()
+        self.assertEqual(second.json(), first.json())
+        
+        cache.set(key, {**entry, 'state': idempotency.PENDING})
+        with override_settings(IDEMPOTENCY={'WAIT_TIMEOUT': 0}):
+            third = self.client.post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='k3')
+        self.assertEqual(third.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(User.objects.filter(is_anonymous_user=True).count(), 1)
+    
+    def test_server_error_not_stored(self):
+        """测试执行失败时不保存响应，可以用同一个 Key 重试"""
+        from . import anonymous
+        with patch.object(anonymous, 'anonymous_login', side_effect=RuntimeError('boom')):
+            failed = self.client.post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='k4')
+        self.assertEqual(failed.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(cache.keys('idempotency:*'))
+        
+        retried = self.client.post('/api/anonymous/login/', HTTP_IDEMPOTENCY_KEY='k4')
+        self.assertEqual(retried.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', retried)
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES, AVAILABILITY={'CAPACITY': 1000, 'ERROR_RATE': 0.01})
+class AvailabilityTests(TestCase):
+    """用户名、邮箱可用性检查测试"""
+    
+    def setUp(self):
+        from django_redis import get_redis_connection
+        get_redis_connection('default').flushall()
+        self.client = APIClient()
+        User.objects.create_user(username='taken', email='Taken@Example.com', password='testpassword123')
+    
+    def check(self, **params):
+        response = self.client.get('/api/auth/availability/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['data']
+    
+    def test_without_filter_uses_database(self):
+        """测试过滤器尚未构建时按数据库精确查询"""
+        from . import availability
+        self.assertFalse(availability.ready())
+        self.assertEqual(self.check(username='taken', email='taken@example.com'), {'username': False, 'email': False})
+        self.assertEqual(self.check(username='free'), {'username': True})
+        self.assertEqual(self.client.get('/api/auth/availability/').status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_filter_answers_absent_names_without_query(self):
+        """测试过滤器判断不存在时不查询数据库，可能存在时精确查询"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        out = StringIO()
+        call_command('rebuild_availability_filter', batch_size=1, stdout=out)
+        self.assertIn('已重建可用性过滤器: 1 个用户', out.getvalue())
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.check(username='free-name', email='free@example.com'),
+                             {'username': True, 'email': True})
+        self.assertEqual(len(queries.captured_queries), 0)
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.check(username='taken', email='TAKEN@example.com'),
+                             {'username': False, 'email': False})
+        self.assertEqual(len(queries.captured_queries), 2)
+    
+    def test_kept_current_by_signals(self):
+        """测试新用户在事务提交后加入过滤器，删除的用户计入失效条目"""
+        from . import availability
+        call_command('rebuild_availability_filter', stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(username='newcomer', email='newcomer@example.com')
+        self.assertEqual(availability.might_contain(['u:newcomer', 'e:newcomer@example.com']), [True, True])
+        self.assertEqual(self.check(username='newcomer'), {'username': False})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(availability.stale_count(), 2)
+        self.assertEqual(self.check(username='newcomer'), {'username': True})
+        
+        out = StringIO()
+        call_command('rebuild_availability_filter', min_stale=10, stdout=out)
+        self.assertIn('跳过', out.getvalue())
+        call_command('rebuild_availability_filter', min_stale=2, stdout=StringIO())
+        self.assertEqual(availability.stale_count(), 0)
+        self.assertEqual(availability.might_contain(['u:newcomer']), [False])
+
+
+class ProviderHTTPTests(TestCase):
+    """第三方登录 HTTP 客户端测试"""
+    
+    def setUp(self):
+        from . import provider_http
+        self.provider_http = provider_http
+        provider_http._histograms.clear()
+        provider_http.close_session()
+        self.addCleanup(provider_http.close_session)
+        self.session = MagicMock()
+        patcher = patch('requests.Session.request', self.session.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sleep = patch('user.provider_http.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+    
+    def response(self, status_code):
+        response = MagicMock()
+        response.status_code = status_code
+        return response
+    
+    def test_idempotent_request_retries_on_gateway_error(self):
+        """测试幂等请求在 503 和连接失败后重试，使用提供商的超时设置并记录耗时"""
+        import requests
+        ok = self.response(200)
+        url = 'https://api.weixin.qq.com/sns/oauth2/access_token?appid=wx&secret=app-secret'
+        self.session.request.side_effect = [
+            self.response(503), requests.ConnectionError(f'Max retries exceeded with url: {url}'), ok,
+        ]
+        
+        with self.assertLogs('user', 'WARNING') as logs:
+            self.assertIs(self.provider_http.get('wechat', url), ok)
+        self.assertNotIn('app-secret', '\n'.join(logs.output))
+        self.assertIn('api.weixin.qq.com', logs.output[-1])
+        self.assertEqual(self.session.request.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assertEqual(self.session.request.call_args.kwargs['timeout'], (3.05, 5))
+        
+        stats = self.provider_http.stats()['providers']['wechat']
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['buckets']['+Inf'], 3)
+    
+    def test_retries_are_bounded(self):
+        """测试重试次数有上限，最后一次的异常抛给调用方"""
+        import requests
+        self.session.request.side_effect = requests.Timeout('slow: https://api.weixin.qq.com/?secret=app-secret')
+        with override_settings(PROVIDER_HTTP={'RETRIES': 1}):
+            with self.assertRaises(requests.Timeout) as raised:
+                self.provider_http.get('wechat', 'https://api.weixin.qq.com/sns/oauth2/access_token?secret=app-secret')
+        self.assertNotIn('app-secret', str(raised.exception))
+        self.assertEqual(self.session.request.call_count, 2)
+        self.assertEqual(self.provider_http.stats()['providers']['wechat']['errors'], 1)
+        
+        for attempt in range(10):
+            self.assertLessEqual(self.provider_http.backoff(attempt, self.provider_http.get_config()), 2)
+    
+    def test_code_exchange_is_not_retried_after_it_may_have_been_sent(self):
+        """测试非幂等请求只在连接尚未建立时重试，读取超时和 5xx 不重试"""
+        import requests
+        self.session.request.side_effect = requests.ReadTimeout('slow')
+        with self.assertRaises(requests.ReadTimeout):
+            self.provider_http.post('apple', 'https://appleid.apple.com/auth/token', data={'code': 'x'})
+        self.assertEqual(self.session.request.call_count, 1)
+        
+        self.session.request.reset_mock()
+        bad_gateway = self.response(502)
+        self.session.request.side_effect = [bad_gateway]
+        self.assertIs(self.provider_http.post('apple', 'https://appleid.apple.com/auth/token'), bad_gateway)
+        
+        self.session.request.reset_mock()
+        ok = self.response(200)
+        self.session.request.side_effect = [requests.ConnectTimeout('connect'), ok]
+        self.assertIs(self.provider_http.post('apple', 'https://appleid.apple.com/auth/token'), ok)
+        self.assertEqual(self.session.request.call_count, 2)
+    
+    def test_session_is_shared_per_process(self):
+        """测试同一进程复用 Session，进程号变化后重新创建"""
+        provider_http = self.provider_http
+        session = provider_http.get_session()
+        self.assertIs(provider_http.get_session(), session)
+        self.assertEqual(session.get_adapter('https://appleid.apple.com').max_retries.total, 0)
+        with patch('user.provider_http.os.getpid', return_value=-1):
+            self.assertIsNot(provider_http.get_session(), session)
+
+
+class AppleClientSecretTests(TestCase):
+    """苹果登录 client_secret 缓存测试"""
+    
+    def setUp(self):
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from . import apple
+        self.apple = apple
+        apple.clear()
+        self.addCleanup(apple.clear)
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        self.provider = OAuthProvider.objects.create(
+            name='apple',
+            client_id='com.example.app',
+            client_secret='unused',
+            redirect_uri='https://example.com/callback',
+            team_id='TEAM123456',
+            key_id='KEY1234567',
+            private_key=self.pem(self.private_key),
+        )
+    
+    def pem(self, key):
+        return key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode('utf-8')
+    
+    def test_secret_is_signed_once_and_verifiable(self):
+        """测试 client_secret 可以用公钥验证，重复获取时不再签名"""
+        secret = self.apple.client_secret(self.provider)
+        payload = jwt.decode(
+            secret, self.private_key.public_key(), algorithms=['ES256'], audience='https://appleid.apple.com'
+        )
+        self.assertEqual(payload['iss'], 'TEAM123456')
+        self.assertEqual(payload['sub'], 'com.example.app')
+        self.assertEqual(jwt.get_unverified_header(secret)['kid'], 'KEY1234567')
+        
+        with patch('user.apple.jwt.encode') as encode:
+            self.assertEqual(self.apple.client_secret(self.provider), secret)
+            provider = OAuthProvider.objects.get(pk=self.provider.pk)
+            self.assertEqual(self.apple.client_secret(provider), secret)
+        encode.assert_not_called()
+    
+    def test_secret_refreshes_when_config_changes(self):
+        """测试修改 key_id 或私钥后重新签名，私钥对象按内容复用"""
+        from cryptography.hazmat.primitives.asymmetric import ec
+        secret = self.apple.client_secret(self.provider)
+        
+        self.provider.key_id = 'KEY7654321'
+        self.provider.save()
+        with patch('user.apple.serialization.load_pem_private_key') as load:
+            rotated = self.apple.client_secret(self.provider)
+        load.assert_not_called()
+        self.assertNotEqual(rotated, secret)
+        self.assertEqual(jwt.get_unverified_header(rotated)['kid'], 'KEY7654321')
+        
+        new_key = ec.generate_private_key(ec.SECP256R1())
+        self.provider.private_key = self.pem(new_key)
+        self.provider.save()
+        secret = self.apple.client_secret(self.provider)
+        jwt.decode(secret, new_key.public_key(), algorithms=['ES256'], audience='https://appleid.apple.com')
+    
+    def test_secret_refreshes_ahead_of_expiry(self):
+        """测试距离过期不足 REFRESH_BEFORE 秒时重新签名"""
+        import time
+        with override_settings(APPLE_LOGIN={'CLIENT_SECRET_LIFETIME': 3600, 'REFRESH_BEFORE': 600}):
+            now = time.time()
+            secret = self.apple.client_secret(self.provider)
+            with patch('user.apple.time.time', return_value=now + 2990):
+                self.assertEqual(self.apple.client_secret(self.provider), secret)
+            with patch('user.apple.time.time', return_value=now + 3010):
+                self.assertNotEqual(self.apple.client_secret(self.provider), secret)
+    
+    def test_incomplete_config_is_rejected(self):
+        """测试缺少 team_id 时报错且不缓存"""
+        self.provider.team_id = ''
+        with self.assertRaisesMessage(ValueError, 'team_id'):
+            self.apple.client_secret(self.provider)
+        self.assertEqual(self.apple._secrets, {})
+
+
+class OAuthProviderRegistryTests(TestCase):
+    """第三方登录提供商注册表测试"""
+    
+    def setUp(self):
+        from . import providers
+        self.providers = providers
+        providers.clear()
+        self.addCleanup(providers.clear)
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.default = OAuthProvider.objects.create(
+                name='wechat', client_id='wx_default', client_secret='secret', redirect_uri='https://example.com/cb'
+            )
+            self.ios = OAuthProvider.objects.create(
+                name='wechat', app_id='ios', client_id='wx_ios', client_secret='secret',
+                redirect_uri='https://example.com/cb'
+            )
+            OAuthProvider.objects.create(
+                name='apple', client_id='apple', client_secret='secret', redirect_uri='https://example.com/cb',
+                is_active=False
+            )
+    
+    def test_lookup_with_default_fallback_in_memory(self):
+        """测试按应用ID查找、回退到默认配置，加载后不再查询数据库"""
+        self.assertEqual(self.providers.get('wechat', 'ios').client_id, 'wx_ios')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.providers.get('wechat', 'android').client_id, 'wx_default')
+            self.assertEqual(self.providers.get('wechat').client_id, 'wx_default')
+            self.assertIsNone(self.providers.get('apple'))
+            self.assertIsNone(self.providers.get('qq', 'ios'))
+    
+    def test_version_bump_reloads_registry(self):
+        """测试提供商保存、删除后版本号变化，其他 worker 确认版本号时重新加载"""
+        import time
+        self.providers.get('wechat')
+        version = self.providers.current_version(self.providers.get_config())
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ios.client_id = 'wx_ios_new'
+            self.ios.save()
+        self.assertNotEqual(self.providers.current_version(self.providers.get_config()), version)
+        self.assertEqual(self.providers.get('wechat', 'ios').client_id, 'wx_ios_new')
+        
+        # 模拟另一个 worker：本地为旧版本，确认间隔过后才重新加载
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ios.delete()
+        self.providers._state = (version, time.monotonic(), {('wechat', 'ios'): self.ios})
+        self.assertEqual(self.providers.get('wechat', 'ios'), self.ios)
+        self.providers._state = (version, time.monotonic() - 60, {('wechat', 'ios'): self.ios})
+        self.assertEqual(self.providers.get('wechat', 'ios').client_id, 'wx_default')
+    
+    def test_provider_list_served_from_registry(self):
+        """测试提供商列表接口只返回启用的提供商且不查询数据库"""
+        self.providers.get('wechat')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/oauth-providers/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.default.pk, self.ios.pk])
+    
+    def test_unknown_provider_rejected_without_query(self):
+        """测试社交登录查找不到提供商时返回 400"""
+        self.providers.get('wechat')
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                '/api/auth/social-login/', {'provider': 'qq', 'code': 'x', 'app_id': 'ios'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['msg'], '不支持的登录方式: qq (app_id: ios)')
@@ -0,0 +1,187 @@
+"""
+DRF 令牌有效期
+
+令牌有两种过期方式：
+- 绝对有效期：超过 ABSOLUTE_LIFETIME 秒后过期，从令牌创建时间和开始记录使用情况的时间中较晚者算起；
+- 滑动有效期：连续 IDLE_TIMEOUT 秒未使用后过期。
+
+使用记录保存在缓存中，每次使用时续期，请求不会写数据库；同一 worker 在 TOUCH_INTERVAL 秒内
+对同一令牌只续期一次。缓存中没有使用记录时，以令牌创建时间和开始记录使用情况的时间中较晚者
+作为最后使用时间。两种有效期都以开始记录的时间为下限，上线或 Redis 数据丢失后，
+之前签发的令牌重新获得完整的有效期，不会被一次性判为过期并删除；缓存不可用时无法确定该下限，不判定过期。
+
+匿名用户除令牌外没有其他凭证，令牌删除后账号无法找回。EXEMPT_ANONYMOUS 为 True 时匿名用户的令牌
+不会过期，匿名账号由 purge_anonymous_users 按最后活跃时间清理。
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authtoken.models import Token
+
+from .cache import LocalLRU, get_config as get_cache_config
+
+logger = logging.getLogger('user')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ABSOLUTE_LIFETIME': 86400 * 180,
+    'IDLE_TIMEOUT': 86400 * 30,
+    'TOUCH_INTERVAL': 300,
+    'CACHE_ALIAS': 'default',
+    'EXEMPT_ANONYMOUS': True,
+}
+
+# 开始记录使用情况的时间，缓存中没有令牌的使用记录时作为最后使用时间的下限
+TRACKING_SINCE_KEY = 'auth:activity:since'
+
+# 令牌 -> 绝对有效期的起算时间戳，记录当前 worker 最近续期过的令牌
+_touched = None
+
+
+def get_config():
+    """读取 TOKEN_EXPIRY 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'TOKEN_EXPIRY', {}))
+    return config
+
+
+def activity_key(key):
+    return f'auth:activity:{key}'
+
+
+def _local():
+    global _touched
+    if _touched is None:
+        _touched = LocalLRU(get_cache_config()['LOCAL_MAXSIZE'])
+    return _touched
+
+
+def _tracking_since(cache, now):
+    since = cache.get(TRACKING_SINCE_KEY)
+    if since is None:
+        cache.add(TRACKING_SINCE_KEY, now, timeout=None)
+        since = cache.get(TRACKING_SINCE_KEY, now)
+    return since
+
+
+def _evaluate(created_map, touch, exempt=()):
+    """
+    判断令牌是否仍然有效
+
+    Args:
+        created_map: {令牌: 创建时间}，创建时间未知时为 None，需要时从数据库补齐
+        touch: 是否为有效令牌续期
+        exempt: 匿名用户的令牌，EXEMPT_ANONYMOUS 为 True 时不过期
+
+    Returns:
+        有效令牌的集合
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return set(created_map)
+
+    now = time.time()
+    absolute_deadline = now - config['ABSOLUTE_LIFETIME']
+    idle_deadline = now - config['IDLE_TIMEOUT']
+    local = _local()
+
+    active = set()
+    pending = {}
+    for key, created in created_map.items():
+        if config['EXEMPT_ANONYMOUS'] and key in exempt:
+            active.add(key)
+            continue
+        # 本地和缓存中保存的是绝对有效期的起算时间
+        started_ts = local.get(key) if touch else None
+        if started_ts is not None and started_ts > absolute_deadline:
+            active.add(key)
+            continue
+        pending[key] = created.timestamp() if created is not None else None
+    if not pending:
+        return active
+
+    cache = caches[config['CACHE_ALIAS']]
+    try:
+        recorded = cache.get_many([activity_key(key) for key in pending])
+        since = _tracking_since(cache, now)
+    except Exception:
+        # 缓存不可用时无法确定起算时间的下限，不判定过期
+        logger.warning("读取令牌使用记录失败", exc_info=True)
+        recorded = since = None
+
+    unknown = [key for key, created_ts in pending.items()
+               if created_ts is None and (recorded is None or activity_key(key) not in recorded)]
+    if unknown:
+        pending.update(
+            (key, created.timestamp())
+            for key, created in Token.objects.filter(key__in=unknown).values_list('key', 'created')
+        )
+
+    renewed = {}
+    for key, created_ts in pending.items():
+        if recorded is not None and activity_key(key) in recorded:
+            started_ts = max(recorded[activity_key(key)], since)
+        elif created_ts is None:
+            # 令牌已不存在
+            continue
+        elif recorded is None:
+            active.add(key)
+            continue
+        else:
+            started_ts = max(created_ts, since)
+            if started_ts < idle_deadline:
+                continue
+        if started_ts <= absolute_deadline:
+            continue
+        active.add(key)
+        renewed[key] = started_ts
+
+    if touch and renewed:
+        try:
+            cache.set_many(
+                {activity_key(key): started_ts for key, started_ts in renewed.items()},
+                config['IDLE_TIMEOUT']
+            )
+        except Exception:
+            logger.warning("写入令牌使用记录失败", exc_info=True)
+        for key, started_ts in renewed.items():
+            local.set(key, started_ts, config['TOUCH_INTERVAL'])
+    return active
+
+
+def active_tokens(created_map, exempt=()):
+    """返回仍然有效的令牌，并为其续期；exempt 为匿名用户的令牌"""
+    return _evaluate(created_map, touch=True, exempt=exempt)
+
+
+def expired_tokens(created_map, exempt=()):
+    """返回已过期的令牌，不续期；exempt 为匿名用户的令牌"""
+    return set(created_map) - _evaluate(created_map, touch=False, exempt=exempt)
+
+
+def record_activity(token):
+    """记录令牌的一次使用，登录签发令牌时调用"""
+    config = get_config()
+    if not config['ENABLED']:
+        return
+    created_ts = token.created.timestamp()
+    try:
+        caches[config['CACHE_ALIAS']].set(activity_key(token.key), created_ts, config['IDLE_TIMEOUT'])
+    except Exception:
+        logger.warning("写入令牌使用记录失败", exc_info=True)
+    _local().set(token.key, created_ts, config['TOUCH_INTERVAL'])
+
+
+def forget(keys):
+    """删除令牌的使用记录"""
+    if not keys:
+        return
+    local = _local()
+    for key in keys:
+        local.delete(key)
+    try:
+        caches[get_config()['CACHE_ALIAS']].delete_many([activity_key(key) for key in keys])
+    except Exception:
+        logger.warning("删除令牌使用记录失败", exc_info=True)
@@ -0,0 +1,191 @@
+"""
+签名访问令牌（JWT）
+
+开启 SIGNED_TOKENS['ENABLED'] 后，登录接口在原有 DRF 令牌之外额外签发短期访问令牌和刷新令牌。
+下游服务可以从 JWKS 接口获取公钥，在本地校验访问令牌，无需回调 /api/users/me/。
+刷新令牌绑定当前的 DRF 令牌，用户注销或删除令牌后刷新令牌随之失效。
+"""
+import base64
+import hashlib
+import json
+import time
+import uuid
+from functools import lru_cache
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from django.conf import settings
+from django.utils import timezone
+from jwt.algorithms import RSAAlgorithm
+
+from .utils import datetime_to_timestamp
+
+DEFAULTS = {
+    'ENABLED': False,
+    'ALGORITHM': 'RS256',
+    'PRIVATE_KEY': '',
+    'PRIVATE_KEY_PATH': '',
+    'KEY_ID': '',
+    'PREVIOUS_PUBLIC_KEYS': [],
+    'ISSUER': 'usercenter',
+    'ACCESS_TOKEN_LIFETIME': 900,
+    'REFRESH_TOKEN_LIFETIME': 86400 * 30,
+    'JWKS_MAX_AGE': 3600,
+}
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+def get_config():
+    """读取 SIGNED_TOKENS 设置，未配置的项使用默认值"""
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'SIGNED_TOKENS', {}))
+    return config
+
+
+def is_enabled():
+    config = get_config()
+    return bool(config['ENABLED'] and (config['PRIVATE_KEY'] or config['PRIVATE_KEY_PATH']))
+
+
+def looks_like_jwt(value):
+    """JWT 由三段 base64url 组成，DRF 和 OAuth2 的不透明令牌都不含 '.'"""
+    return value.count('.') == 2
+
+
+@lru_cache(maxsize=4)
+def _read_key_file(path):
+    with open(path, 'r') as key_file:
+        return key_file.read()
+
+
+def _key_id(public_key):
+    """RFC 7638 JWK 指纹，作为默认的 kid"""
+    jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    canonical = json.dumps({name: jwk[name] for name in ('e', 'kty', 'n')}, separators=(',', ':'))
+    digest = hashlib.sha256(canonical.encode('utf-8')).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+@lru_cache(maxsize=4)
+def _load_private_key(pem):
+    """解析 PEM 私钥，返回 (公钥指纹, 私钥)"""
+    private_key = serialization.load_pem_private_key(pem.encode('utf-8'), password=None)
+    return _key_id(private_key.public_key()), private_key
+
+
+@lru_cache(maxsize=8)
+def _load_public_key(pem):
+    """解析 PEM 公钥，返回 (公钥指纹, 公钥)"""
+    public_key = serialization.load_pem_public_key(pem.encode('utf-8'))
+    return _key_id(public_key), public_key
+
+
+def _signing_key(config):
+    pem = config['PRIVATE_KEY'] or _read_key_file(config['PRIVATE_KEY_PATH'])
+    kid, private_key = _load_private_key(pem)
+    return config['KEY_ID'] or kid, private_key
+
+
+def _verification_keys(config):
+    """当前签名公钥以及轮换期间仍然接受的旧公钥，按 kid 索引"""
+    keys = {}
+    if config['PRIVATE_KEY'] or config['PRIVATE_KEY_PATH']:
+        kid, private_key = _signing_key(config)
+        keys[kid] = private_key.public_key()
+    for pem in config['PREVIOUS_PUBLIC_KEYS']:
+        kid, public_key = _load_public_key(pem)
+        keys.setdefault(kid, public_key)
+    return keys
+
+
+def session_id(token_key):
+    """刷新令牌中记录的 DRF 令牌摘要，避免在 JWT 中暴露令牌原文"""
+    return hashlib.sha256(token_key.encode('utf-8')).hexdigest()[:32]
+
+
+def _encode(claims, config):
+    kid, private_key = _signing_key(config)
+    return jwt.encode(claims, private_key, algorithm=config['ALGORITHM'], headers={'kid': kid})
+
+
+def issue_signed_tokens(user, token):
+    """为用户签发访问令牌和刷新令牌"""
+    config = get_config()
+    now = int(time.time())
+    premium_active = bool(
+        user.is_premium and (user.premium_expiry is None or user.premium_expiry > timezone.now())
+    )
+
+    access_claims = {
+        'iss': config['ISSUER'],
+        'sub': str(user.pk),
+        'iat': now,
+        'exp': now + config['ACCESS_TOKEN_LIFETIME'],
+        'jti': uuid.uuid4().hex,
+        'typ': ACCESS,
+        'user_id': user.pk,
+        'is_premium': premium_active,
+        'premium_expiry': datetime_to_timestamp(user.premium_expiry),
+        'language': user.language,
+        'is_anonymous_user': user.is_anonymous_user,
+    }
+    refresh_claims = {
+        'iss': config['ISSUER'],
+        'sub': str(user.pk),
+        'iat': now,
+        'exp': now + config['REFRESH_TOKEN_LIFETIME'],
+        'jti': uuid.uuid4().hex,
+        'typ': REFRESH,
+        'sid': session_id(token.key),
+    }
+    return {
+        'access_token': _encode(access_claims, config),
+        'refresh_token': _encode(refresh_claims, config),
+        'token_type': 'Bearer',
+        'expires_in': config['ACCESS_TOKEN_LIFETIME'],
+    }
+
+
+def signed_token_data(user, token):
+    """登录响应中附加的签名令牌字段，未开启时为空"""
+    if not is_enabled():
+        return {}
+    return issue_signed_tokens(user, token)
+
+
+def decode_signed_token(value, token_type=ACCESS):
+    """
+    校验签名令牌并返回声明
+
+    Raises:
+        jwt.InvalidTokenError: 签名、有效期、签发者或令牌类型不正确
+    """
+    config = get_config()
+    header = jwt.get_unverified_header(value)
+    public_key = _verification_keys(config).get(header.get('kid'))
+    if public_key is None:
+        raise jwt.InvalidTokenError('未知的签名密钥')
+
+    claims = jwt.decode(
+        value,
+        public_key,
+        algorithms=[config['ALGORITHM']],
+        issuer=config['ISSUER'],
+        options={'require': ['exp', 'iat', 'sub', 'typ']},
+    )
+    if claims['typ'] != token_type:
+        raise jwt.InvalidTokenError('令牌类型不正确')
+    return claims
+
+
+def public_jwks():
+    """JWKS 格式的公钥集合"""
+    config = get_config()
+    keys = []
+    for kid, public_key in _verification_keys(config).items():
+        jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+        jwk.update({'kid': kid, 'use': 'sig', 'alg': config['ALGORITHM']})
+        keys.append(jwk)
+    return {'keys': keys}
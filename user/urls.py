@@ -11,7 +11,12 @@ urlpatterns = [
     path('', include(router.urls)),
     path('auth/token/', views.obtain_auth_token, name='api-token-auth'),
     path('auth/register/', views.register, name='api-register'),
+    path('auth/availability/', views.check_availability, name='api-availability'),
     path('auth/social-login/', views.social_login, name='api-social-login'),
+    path('auth/token/refresh/', views.refresh_signed_token, name='api-token-refresh'),
+    path('auth/jwks.json', views.jwks, name='api-jwks'),
+    path('auth/introspect/batch/', views.introspect_tokens, name='api-token-introspect-batch'),
+    path('auth/stats/', views.auth_stats, name='api-auth-stats'),
     path('languages/', views.get_available_languages, name='available_languages'),
     path('set-language/', views.set_language, name='set_language'),
 ] 
\ No newline at end of file
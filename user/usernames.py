@@ -0,0 +1,45 @@
+"""
+唯一用户名分配
+
+第三方登录、匿名账号转正等场景下用户名由系统生成（如 wx_<openid>、apple_<sub>、第三方昵称），
+不再逐个查询 base_1、base_2……是否被占用：先直接以 base 保存，唯一约束冲突时改用
+base_<随机后缀> 重试。随机后缀的取值空间足够大，通常一次、最多两次写入即可完成，且没有并发竞争。
+"""
+from django.db import IntegrityError, transaction
+from django.utils.crypto import get_random_string
+
+from .utils import unique_violation_field
+
+SUFFIX_LENGTH = 6
+SUFFIX_CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+MAX_ATTEMPTS = 5
+
+
+def candidates(base, max_length=150, attempts=MAX_ATTEMPTS):
+    """base 本身，然后是 base_<随机后缀>，总长度不超过 max_length"""
+    base = base[:max_length]
+    yield base
+    prefix = base[:max_length - SUFFIX_LENGTH - 1]
+    for _ in range(attempts - 1):
+        yield f'{prefix}_{get_random_string(SUFFIX_LENGTH, SUFFIX_CHARS)}'
+
+
+def save_with_unique_username(user, base, **save_kwargs):
+    """
+    以 base 为用户名保存用户（新建或更新），用户名已被占用时换一个随机后缀重试
+
+    每次写入在单独的保存点中执行，可以在外层事务中调用；其他字段的约束冲突直接抛出。
+    """
+    max_length = user._meta.get_field('username').max_length
+    error = None
+    for username in candidates(base, max_length):
+        user.username = username
+        try:
+            with transaction.atomic():
+                user.save(**save_kwargs)
+            return user
+        except IntegrityError as exc:
+            if unique_violation_field(exc, ['username']) is None:
+                raise
+            error = exc
+    raise error
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.utils import timezone
 import time
 
@@ -31,4 +32,57 @@ def datetime_to_timestamp(dt):
     """
     if not dt:
         return None
-    return int(time.mktime(dt.timetuple()))
\ No newline at end of file
+    return int(time.mktime(dt.timetuple()))
+
+def get_client_ip(request):
+    """
+    获取客户端IP
+    
+    反向代理（nginx 的 $proxy_add_x_forwarded_for）把它看到的来源地址追加到 X-Forwarded-For 末尾，
+    列表前面的部分由客户端任意填写。因此从右往左数 TRUSTED_PROXY_COUNT 个地址，取最后一个可信代理
+    看到的来源地址；TRUSTED_PROXY_COUNT 为 0（不经过代理）时忽略该请求头，使用 REMOTE_ADDR。
+    
+    Args:
+        request: 请求对象
+    
+    Returns:
+        str: 客户端IP
+    """
+    proxies = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and x_forwarded_for:
+        entries = [entry.strip() for entry in x_forwarded_for.split(',') if entry.strip()]
+        if entries:
+            # 地址数少于代理层数说明请求没有经过全部代理，取最左边（最早的代理追加）的地址
+            return entries[max(len(entries) - proxies, 0)]
+    return request.META.get('REMOTE_ADDR')
+
+def unique_violation_field(error, fields):
+    """
+    唯一约束冲突（IntegrityError）对应的字段名
+
+    PostgreSQL 按约束名匹配，其他数据库按错误信息第一行中的列名或索引名匹配（不含冲突的值）。
+
+    Args:
+        error: IntegrityError
+        fields: 候选字段名，按顺序匹配
+    
+    Returns:
+        str: 字段名，不是唯一约束冲突或无法识别时返回 None
+    """
+    cause = error.__cause__
+    diag = getattr(cause, 'diag', None)
+    if diag is not None:
+        if getattr(cause, 'pgcode', None) != '23505':
+            return None
+        text = diag.constraint_name or ''
+    else:
+        text = str(error).split('\n')[0]
+        if 'unique' not in text.lower() and 'duplicate' not in text.lower():
+            return None
+        # MySQL 的错误信息包含冲突的值，只看键名部分
+        text = text.rsplit(' for key ', 1)[-1]
+    for field in fields:
+        if field in text:
+            return field
+    return None
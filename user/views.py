@@ -1,15 +1,14 @@
 import json
-import time
-import uuid
-from django.utils.crypto import get_random_string
 
 from django.contrib.auth import get_user_model, authenticate
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes, authentication_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta, datetime
 import requests
@@ -22,6 +21,16 @@ from django.core.cache import cache
 from django.core.mail import send_mail
 from django.utils.translation import gettext as _
 from .utils import api_response
+from .authentication import (
+    invalidate_user_tokens, token_cache, resolve_principals, introspection_payload, dispatch_stats, issue_token,
+    oauth2_cache, create_token,
+)
+from .idempotency import idempotent
+from .permissions import IsStaffOrClientCredentials
+from .usernames import save_with_unique_username
+from . import anonymous, apple, availability, login_stats, provider_http, providers, ratelimit, token_expiry, tokens
+from .ratelimit import AnonymousLoginThrottle, AvailabilityThrottle, LoginThrottle, RegisterThrottle
+from django.utils.cache import patch_cache_control
 from django.contrib.auth.models import UserManager
 from django.utils import translation
 import pytz
@@ -66,8 +75,12 @@ class UserViewSet(viewsets.ModelViewSet):
             user.is_premium = False
             user.premium_expiry = None
             user.save(update_fields=['is_premium', 'premium_expiry'])
+            invalidate_user_tokens(user.id)
             logger.info(f"用户 {user.username} (ID: {user.id}) 的付费状态已过期并更新")
         
+        # 合并尚未写回数据库的登录统计
+        login_stats.apply_pending([user])
+        
         serializer = self.get_serializer(user)
         return Response(api_response(
             code=200,
@@ -101,6 +114,7 @@ class UserViewSet(viewsets.ModelViewSet):
         # 设置新密码
         request.user.set_password(new_password)
         request.user.save()
+        invalidate_user_tokens(request.user.id)
         
         return Response(api_response(
             code=200,
@@ -113,7 +127,7 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         获取用户关联的第三方账号
         """
-        oauth_accounts = UserOAuth.objects.filter(user=request.user).select_related('provider')
+        oauth_accounts = UserOAuth.objects.filter(user_id=request.user.id).select_related('provider')
         
         # 自定义序列化
         data = []
@@ -143,6 +157,7 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         try:
             # 删除用户的认证令牌
+            invalidate_user_tokens(request.user.id)
             request.user.auth_token.delete()
 
             return Response(api_response(
@@ -169,6 +184,7 @@ class UserViewSet(viewsets.ModelViewSet):
             user = request.user
 
             # 删除用户的认证令牌
+            invalidate_user_tokens(user.id)
             Token.objects.filter(user=user).delete()
 
             # 删除用户的OAuth关联
@@ -252,6 +268,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
                 # 保存用户
                 user.save()
+                invalidate_user_tokens(user.id)
 
                 # 确认更新
                 user.refresh_from_db()
@@ -288,6 +305,13 @@ class OAuthProviderViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = OAuthProvider.objects.filter(is_active=True)
     serializer_class = OAuthProviderSerializer
     permission_classes = [permissions.AllowAny]
+    
+    def list(self, request, *args, **kwargs):
+        # 列表使用进程内注册表，不查询数据库
+        page = self.paginate_queryset(providers.active())
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(providers.active(), many=True).data)
 
 class SocialLoginView(APIView):
     """
@@ -295,6 +319,7 @@ class SocialLoginView(APIView):
     """
     permission_classes = [permissions.AllowAny]
     
+    @idempotent('social_login')
     def post(self, request):
         serializer = SocialLoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -304,19 +329,14 @@ class SocialLoginView(APIView):
         redirect_uri = serializer.validated_data.get('redirect_uri')
         app_id = serializer.validated_data.get('app_id', 'default')  # 添加 app_id 参数
         
-        try:
-            # 根据 provider_name 和 app_id 查找提供商配置
-            provider = OAuthProvider.objects.get(name=provider_name, app_id=app_id, is_active=True)
-        except OAuthProvider.DoesNotExist:
-            # 如果找不到特定应用的配置，尝试查找默认配置
-            try:
-                provider = OAuthProvider.objects.get(name=provider_name, app_id='default', is_active=True)
-            except OAuthProvider.DoesNotExist:
-                return Response(api_response(
-                    code=400,
-                    message=f'不支持的登录方式: {provider_name} (app_id: {app_id})',
-                    data=None
-                ), status=status.HTTP_400_BAD_REQUEST)
+        # 根据 provider_name 和 app_id 查找提供商配置，找不到特定应用的配置时使用默认配置
+        provider = providers.get(provider_name, app_id)
+        if provider is None:
+            return Response(api_response(
+                code=400,
+                message=f'不支持的登录方式: {provider_name} (app_id: {app_id})',
+                data=None
+            ), status=status.HTTP_400_BAD_REQUEST)
         
         # 根据不同的提供商处理OAuth流程
         handler_method = getattr(self, f'handle_{provider_name}_login', None)
@@ -329,6 +349,15 @@ class SocialLoginView(APIView):
         
         try:
             return handler_method(provider, code, redirect_uri)
+        except requests.RequestException as e:
+            # 连接失败、超时、提供商返回无法解析的响应（如重试后仍为 5xx）属于暂时性错误，返回 502，
+            # 幂等请求不保存 5xx 响应，客户端可以用同一个 Idempotency-Key 重试
+            logger.warning("社交登录请求提供商失败: %s: %s", provider_name, type(e).__name__)
+            return Response(api_response(
+                code=502,
+                message='第三方登录服务暂时不可用，请稍后重试',
+                data=None
+            ), status=status.HTTP_502_BAD_GATEWAY)
         except Exception as e:
             logger.exception(f"社交登录失败: {provider_name}")
             return Response(api_response(
@@ -353,7 +382,8 @@ class SocialLoginView(APIView):
             'grant_type': 'authorization_code'
         }
         
-        token_response = requests.get(token_url, params=token_params)
+        # 授权码只能使用一次，换取令牌的请求不能在可能已被处理后重试
+        token_response = provider_http.get('wechat', token_url, params=token_params, idempotent=False)
         token_data = token_response.json()
         
         if 'errcode' in token_data:
@@ -371,7 +401,7 @@ class SocialLoginView(APIView):
             'lang': 'zh_CN'
         }
         
-        user_response = requests.get(user_url, params=user_params)
+        user_response = provider_http.get('wechat', user_url, params=user_params)
         user_data = user_response.json()
         
         if 'errcode' in user_data:
@@ -441,17 +471,16 @@ class SocialLoginView(APIView):
         try:
             logger.info("正在发送请求到Apple授权服务器...")
             
-            # 设置超时和额外的headers
+            # 超时和重试由 provider_http 按提供商配置，授权码只能使用一次，不在可能已被处理后重试
             headers = {
-                'User-Agent': 'Mozilla/5.0 (compatible; YourApp/1.0)',
                 'Content-Type': 'application/x-www-form-urlencoded'
             }
             
-            token_response = requests.post(
+            token_response = provider_http.post(
+                'apple',
                 token_url, 
                 data=token_data, 
                 headers=headers,
-                timeout=30
             )
             
             logger.info("Apple response status: %s", token_response.status_code)
@@ -617,58 +646,9 @@ class SocialLoginView(APIView):
             ), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def _generate_apple_client_secret(self, provider):
-        """生成苹果客户端密钥"""
+        """获取苹果客户端密钥，签名结果按提供商缓存，见 user/apple.py"""
         try:
-            # 获取必要的参数
-            team_id = provider.team_id
-            client_id = provider.client_id
-            key_id = provider.key_id
-            private_key = provider.private_key
-            
-            # 记录关键参数（不包含敏感信息）
-            logger.info(f"生成Apple客户端密钥: team_id={team_id}, client_id={client_id}, key_id={key_id}")
-            
-            # 如果没有直接提供私钥，尝试从文件读取
-            if not private_key and provider.private_key_path:
-                try:
-                    logger.info(f"从文件读取私钥: {provider.private_key_path}")
-                    private_key = provider.private_key_path.read().decode('utf-8')
-                except Exception as e:
-                    logger.error(f"读取苹果私钥文件失败: {str(e)}")
-                    raise ValueError(f"读取苹果私钥文件失败: {str(e)}")
-            
-            if not all([team_id, client_id, key_id, private_key]):
-                missing = []
-                if not team_id: missing.append('team_id')
-                if not client_id: missing.append('client_id')
-                if not key_id: missing.append('key_id')
-                if not private_key: missing.append('private_key')
-                error_msg = f"苹果登录配置不完整，缺少: {', '.join(missing)}"
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-            
-            # 生成JWT
-            now = int(time.time())
-            expiry = now + 86400 * 180  # 180天
-            
-            headers = {
-                'kid': key_id,
-                'alg': 'ES256'  # 显式指定算法
-            }
-            
-            payload = {
-                'iss': team_id,
-                'iat': now,
-                'exp': expiry,
-                'aud': 'https://appleid.apple.com',
-                'sub': client_id
-            }
-            
-            # 生成并返回JWT
-            logger.info("正在生成JWT客户端密钥")
-            client_secret = jwt.encode(payload, private_key, algorithm='ES256', headers=headers)
-            logger.info("JWT客户端密钥生成成功")
-            return client_secret
+            return apple.client_secret(provider)
         except Exception as e:
             logger.exception(f"生成苹果客户端密钥失败: {str(e)}")
             raise ValueError(f"生成苹果客户端密钥失败: {str(e)}")
@@ -693,42 +673,32 @@ class SocialLoginView(APIView):
             oauth.save()
             
             # 更新用户信息
+            update_fields = []
             if nickname and not user.nickname:
                 user.nickname = nickname
+                update_fields.append('nickname')
             if avatar and not user.avatar:
                 user.avatar = avatar
+                update_fields.append('avatar')
+            if update_fields:
+                user.save(update_fields=update_fields)
             
             # 更新登录统计
-            user.login_count += 1
-            user.last_login = timezone.now()
-            if hasattr(self.request, 'META'):
-                x_forwarded_for = self.request.META.get('HTTP_X_FORWARDED_FOR')
-                if x_forwarded_for:
-                    user.last_login_ip = x_forwarded_for.split(',')[0]
-                else:
-                    user.last_login_ip = self.request.META.get('REMOTE_ADDR')
-            
-            user.save()
+            login_stats.record_login(user, self.request)
             
         except UserOAuth.DoesNotExist:
             # 创建新用户
             # 检查邮箱是否已被使用
-            if email and User.objects.filter(email=email).exists():
+            existing_user = User.objects.filter_email(email).first() if email else None
+            if existing_user:
                 # 如果邮箱已被使用，尝试使用该邮箱的用户
-                user = User.objects.get(email=email)
+                user = existing_user
             else:
-                # 确保用户名唯一
-                base_username = username
-                counter = 1
-                while User.objects.filter(username=username).exists():
-                    username = f"{base_username}_{counter}"
-                    counter += 1
-                
-                # 创建新用户
+                # 创建新用户，用户名已被占用时自动加随机后缀
                 user_manager = UserManager()
                 random_password = user_manager.make_random_password()
 
-                user = User.objects.create_user(
+                user = User.objects.create_user_with_unique_username(
                     username=username,
                     email=email,
                     password=random_password,
@@ -749,7 +719,7 @@ class SocialLoginView(APIView):
             )
         
         # 获取或创建令牌
-        token, created = Token.objects.get_or_create(user=user)
+        token, created = issue_token(user)
         
         # 返回用户信息和令牌
         return Response(api_response(
@@ -757,7 +727,8 @@ class SocialLoginView(APIView):
             message=_('登录成功'),
             data={
                 'token': token.key,
-                'user': UserSerializer(user).data
+                'user': UserSerializer(user).data,
+                **tokens.signed_token_data(user, token)
             }
         ))
 
@@ -806,6 +777,8 @@ def social_login(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RegisterThrottle])
+@idempotent('register')
 def register(request):
     """
     用户注册
@@ -813,31 +786,58 @@ def register(request):
     serializer = UserRegistrationSerializer(data=request.data)
     
     if serializer.is_valid():
-        user = serializer.save()
-        
-        # 添加日志记录
-        logger.info("新用户注册成功: username=%s, email=%s", user.username, user.email)
-        
-        # 创建认证令牌
-        token, created = Token.objects.get_or_create(user=user)
-        
-        return Response(api_response(
-            code=200,
-            message='注册成功',
-            data={
-                'token': token.key,
-                'user': UserSerializer(user).data
-            }
-        ), status=status.HTTP_201_CREATED)
+        try:
+            # 用户和认证令牌在同一事务中创建，用户名、邮箱重复由唯一约束判断
+            with transaction.atomic():
+                user = serializer.save()
+                token = create_token(user)
+        except ValidationError as exc:
+            errors = exc.detail
+        else:
+            # 添加日志记录
+            logger.info("新用户注册成功: username=%s, email=%s", user.username, user.email)
+            
+            return Response(api_response(
+                code=200,
+                message='注册成功',
+                data={
+                    'token': token.key,
+                    'user': UserSerializer(user).data,
+                    **tokens.signed_token_data(user, token)
+                }
+            ), status=status.HTTP_201_CREATED)
+    else:
+        errors = serializer.errors
     
     # 添加日志记录
-    logger.warning("用户注册失败: %s", serializer.errors)
+    logger.warning("用户注册失败: %s", errors)
     return Response(api_response(
         code=400,
         message='注册失败',
-        data=serializer.errors
+        data=errors
     ), status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@authentication_classes([])
+@throttle_classes([AvailabilityThrottle])
+def check_availability(request):
+    """
+    检查用户名、邮箱是否可用（未被注册），供注册表单实时提示
+
+    只是提示，注册时仍以数据库唯一约束为准。
+    """
+    username = request.query_params.get('username', '').strip()
+    email = request.query_params.get('email', '').strip()
+    if not username and not email:
+        return Response(api_response(
+            code=400,
+            message='请提供 username 或 email',
+            data=None
+        ), status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(api_response(data=availability.check(username=username, email=email)))
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def verify_email(request):
@@ -874,7 +874,7 @@ def verify_email(request):
         cache.delete(cache_key)
         
         # 创建认证令牌
-        token, _ = Token.objects.get_or_create(user=user)
+        token, _ = issue_token(user)
         
         return Response({
             'detail': _('邮箱验证成功'),
@@ -927,6 +927,7 @@ def send_verification_email(email, code):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([LoginThrottle])
 def obtain_auth_token(request):
     """
     获取认证令牌
@@ -942,19 +943,13 @@ def obtain_auth_token(request):
             data=None
         ), status=status.HTTP_400_BAD_REQUEST)
     
-    user = authenticate(username=username, password=password)
+    # UsernameOrEmailBackend 一次查询同时匹配用户名和邮箱
+    user = authenticate(request, username=username, password=password)
     
     if not user:
-        # 尝试使用邮箱登录
-        try:
-            user_obj = User.objects.get(email=username)
-            user = authenticate(username=user_obj.username, password=password)
-        except User.DoesNotExist:
-            user = None
-    
-    if not user:
-        # 不泄露具体哪个字段错误
+        # 不泄露具体哪个字段错误；连续失败后临时锁定该 IP 对该用户名的登录
         logger.warning("登录失败: 用户名或密码错误 (尝试用户名: %s)", username)
+        ratelimit.record_failure('login', request)
         return Response(api_response(
             code=400,
             message='用户名或密码错误',
@@ -969,29 +964,82 @@ def obtain_auth_token(request):
             data=None
         ), status=status.HTTP_400_BAD_REQUEST)
     
-    # 更新登录统计
-    user.login_count += 1
-    user.last_login = timezone.now()
-    
-    # 记录IP地址
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        user.last_login_ip = x_forwarded_for.split(',')[0]
-    else:
-        user.last_login_ip = request.META.get('REMOTE_ADDR')
+    ratelimit.reset_failures('login', request)
     
-    user.save(update_fields=['login_count', 'last_login', 'last_login_ip'])
+    # 更新登录统计
+    login_stats.record_login(user, request)
     
     # 获取或创建令牌
-    token, created = Token.objects.get_or_create(user=user)
+    token, created = issue_token(user)
     
     logger.info("用户登录成功: username=%s, IP=%s", username, user.last_login_ip)
     return Response(api_response(
         code=200,
         message=_('登录成功'),
-        data={'token': token.key}
+        data={'token': token.key, **tokens.signed_token_data(user, token)}
     ))
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def refresh_signed_token(request):
+    """
+    使用刷新令牌换取新的签名访问令牌
+    刷新令牌绑定签发时的 DRF 令牌，注销后即失效
+    """
+    if not tokens.is_enabled():
+        return Response(api_response(
+            code=400,
+            message=_('未启用签名令牌'),
+            data=None
+        ), status=status.HTTP_400_BAD_REQUEST)
+    
+    refresh_token = request.data.get('refresh_token')
+    if not refresh_token:
+        return Response(api_response(
+            code=400,
+            message=_('刷新令牌不能为空'),
+            data=None
+        ), status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        claims = tokens.decode_signed_token(refresh_token, token_type=tokens.REFRESH)
+        token = Token.objects.select_related('user').get(user_id=claims['sub'])
+    except (jwt.InvalidTokenError, Token.DoesNotExist):
+        return Response(api_response(
+            code=401,
+            message=_('刷新令牌无效或已过期'),
+            data=None
+        ), status=status.HTTP_401_UNAUTHORIZED)
+    
+    if (claims.get('sid') != tokens.session_id(token.key) or not token.user.is_active
+            or not token_expiry.active_tokens(
+                {token.key: token.created}, exempt={token.key} if token.user.is_anonymous_user else ())):
+        return Response(api_response(
+            code=401,
+            message=_('刷新令牌无效或已过期'),
+            data=None
+        ), status=status.HTTP_401_UNAUTHORIZED)
+    
+    # 只用签名令牌访问的客户端在刷新时也记录最后活跃时间
+    login_stats.touch(token.user_id)
+    return Response(api_response(
+        code=200,
+        message=_('刷新成功'),
+        data=tokens.issue_signed_tokens(token.user, token)
+    ))
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def jwks(request):
+    """
+    签名令牌公钥集合（JWKS）
+    下游服务缓存后即可在本地校验访问令牌
+    """
+    response = Response(tokens.public_jwks())
+    patch_cache_control(response, public=True, max_age=tokens.get_config()['JWKS_MAX_AGE'])
+    return response
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def get_available_languages(request):
@@ -1023,6 +1071,7 @@ def set_language(request):
     user = request.user
     user.language = language
     user.save(update_fields=['language'])
+    invalidate_user_tokens(user.id)
     
     # 更新当前会话的语言
     translation.activate(language)
@@ -1034,6 +1083,57 @@ def set_language(request):
         data={'language': language}
     ))
 
+@api_view(['POST'])
+@permission_classes([IsStaffOrClientCredentials])
+def introspect_tokens(request):
+    """
+    批量令牌内省
+    供网关一次校验多个令牌，仅限管理员或 OAuth2 客户端凭证调用方
+    """
+    keys = request.data.get('tokens')
+    limit = settings.TOKEN_INTROSPECTION_BATCH_LIMIT
+    
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        return Response(api_response(
+            code=400,
+            message=_('tokens 必须是字符串列表'),
+            data=None
+        ), status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(keys) > limit:
+        return Response(api_response(
+            code=400,
+            message=_('一次最多校验 {} 个令牌').format(limit),
+            data=None
+        ), status=status.HTTP_400_BAD_REQUEST)
+    
+    keys = list(dict.fromkeys(keys))
+    principals = resolve_principals(keys)
+    
+    return Response(api_response(
+        code=200,
+        message=_('获取成功'),
+        data={
+            key: introspection_payload(principals[key]) if key in principals else {'active': False}
+            for key in keys
+        }
+    ))
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def auth_stats(request):
+    """获取当前 worker 的认证缓存命中统计、各认证后端的查找次数和第三方登录请求耗时"""
+    return Response(api_response(
+        code=200,
+        message=_('获取成功'),
+        data={
+            'token_cache': token_cache.stats(),
+            'oauth2_cache': oauth2_cache.stats(),
+            'backends': dispatch_stats(),
+            'providers': provider_http.stats(),
+        }
+    ))
+
 class AnonymousUserViewSet(viewsets.ViewSet):
     """
     匿名用户视图集
@@ -1041,42 +1141,29 @@ class AnonymousUserViewSet(viewsets.ViewSet):
     """
     permission_classes = [permissions.AllowAny]
     
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_classes=[AnonymousLoginThrottle])
+    @idempotent('anonymous_login')
     def login(self, request):
         """
         匿名登录
-        为未注册用户创建临时账号
+        为未注册用户创建临时账号，带有设备标识 device_id 时复用该设备已有的匿名账号
         """
+        device_id = str(request.data.get('device_id') or '').strip()
+        if len(device_id) > User._meta.get_field('device_id').max_length:
+            return Response(api_response(
+                code=400,
+                message=_('设备标识过长'),
+                data=None
+            ), status=status.HTTP_400_BAD_REQUEST)
+        
         try:
-            # 生成唯一用户名
-            username = f"anon_{uuid.uuid4().hex[:12]}"
-            
-            # 生成随机密码
-            password = get_random_string(16)
-            
-            # 创建匿名用户
-            user = User.objects.create_user(
-                username=username,
-                password=password,
-                is_anonymous_user=True,
-                nickname="username",
-            )
-            
-            # 创建认证令牌
-            token, created = Token.objects.get_or_create(user=user)
-            
-            # 记录登录信息
-            user.login_count = 1
-            user.last_login = timezone.now()
-            
-            # 记录IP地址
-            x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-            if x_forwarded_for:
-                user.last_login_ip = x_forwarded_for.split(',')[0]
-            else:
-                user.last_login_ip = request.META.get('REMOTE_ADDR')
-            
-            user.save()
+            user, token, created = anonymous.anonymous_login(request, device_id)
+            if token is None:
+                return Response(api_response(
+                    code=400,
+                    message=_('用户已被禁用'),
+                    data=None
+                ), status=status.HTTP_400_BAD_REQUEST)
             
             # 返回用户信息和令牌
             return Response(api_response(
@@ -1084,7 +1171,8 @@ class AnonymousUserViewSet(viewsets.ViewSet):
                 message=_('匿名登录成功'),
                 data={
                     'token': token.key,
-                    'user': UserSerializer(user).data
+                    'user': UserSerializer(user).data,
+                    **tokens.signed_token_data(user, token)
                 }
             ))
         except Exception as e:
@@ -1148,7 +1236,7 @@ class AnonymousUserViewSet(viewsets.ViewSet):
             ), status=status.HTTP_400_BAD_REQUEST)
         
         # 检查邮箱是否已存在
-        if email and User.objects.filter(email=email).exclude(id=user.id).exists():
+        if email and User.objects.email_exists(email, exclude_pk=user.id):
             return Response(api_response(
                 code=400,
                 message=_('邮箱已被使用'),
@@ -1164,15 +1252,17 @@ class AnonymousUserViewSet(viewsets.ViewSet):
             user.save()
             
             # 重新生成令牌
+            invalidate_user_tokens(user.id)
             user.auth_token.delete()
-            token, created = Token.objects.get_or_create(user=user)
+            token, created = issue_token(user)
             
             return Response(api_response(
                 code=200,
                 message=_('账号转换成功'),
                 data={
                     'token': token.key,
-                    'user': UserSerializer(user).data
+                    'user': UserSerializer(user).data,
+                    **tokens.signed_token_data(user, token)
                 }
             ))
         except Exception as e:
@@ -1190,19 +1280,14 @@ class AnonymousUserViewSet(viewsets.ViewSet):
         redirect_uri = data.get('redirect_uri')
         app_id = data.get('app_id', 'default')
         
-        try:
-            # 根据 provider_name 和 app_id 查找提供商配置
-            provider = OAuthProvider.objects.get(name=provider_name, app_id=app_id, is_active=True)
-        except OAuthProvider.DoesNotExist:
-            # 如果找不到特定应用的配置，尝试查找默认配置
-            try:
-                provider = OAuthProvider.objects.get(name=provider_name, app_id='default', is_active=True)
-            except OAuthProvider.DoesNotExist:
-                return Response(api_response(
-                    code=400,
-                    message=f'不支持的登录方式: {provider_name} (app_id: {app_id})',
-                    data=None
-                ), status=status.HTTP_400_BAD_REQUEST)
+        # 根据 provider_name 和 app_id 查找提供商配置，找不到特定应用的配置时使用默认配置
+        provider = providers.get(provider_name, app_id)
+        if provider is None:
+            return Response(api_response(
+                code=400,
+                message=f'不支持的登录方式: {provider_name} (app_id: {app_id})',
+                data=None
+            ), status=status.HTTP_400_BAD_REQUEST)
         
         # 创建社交登录视图实例
         social_login_view = SocialLoginView()
@@ -1248,6 +1333,7 @@ class AnonymousUserViewSet(viewsets.ViewSet):
                     # 这里可以添加数据迁移逻辑，如转移用户创建的内容等
                     
                     # 删除匿名用户
+                    invalidate_user_tokens(user.id)
                     user.delete()
                     
                     # 返回OAuth用户的信息
@@ -1265,18 +1351,14 @@ class AnonymousUserViewSet(viewsets.ViewSet):
             # 更新匿名用户信息
             user.is_anonymous_user = False
             
-            # 如果OAuth返回了用户名，尝试更新
-            if 'username' in oauth_user and oauth_user['username']:
-                # 检查用户名是否已存在
-                new_username = oauth_user['username']
-                if not User.objects.filter(username=new_username).exclude(id=user.id).exists():
-                    user.username = new_username
+            # 如果OAuth返回了用户名，保存时使用该用户名，已被占用时自动加随机后缀
+            new_username = oauth_user.get('username')
             
             # 如果OAuth返回了邮箱，尝试更新
             if 'email' in oauth_user and oauth_user['email']:
                 # 检查邮箱是否已存在
                 new_email = oauth_user['email']
-                if not User.objects.filter(email=new_email).exclude(id=user.id).exists():
+                if not User.objects.email_exists(new_email, exclude_pk=user.id):
                     user.email = new_email
             
             # 更新其他信息
@@ -1287,7 +1369,10 @@ class AnonymousUserViewSet(viewsets.ViewSet):
                 user.avatar = oauth_user['avatar']
             
             user.is_verified = True  # 第三方登录视为已验证
-            user.save()
+            if new_username:
+                save_with_unique_username(user, new_username)
+            else:
+                user.save()
             
             # 创建OAuth关联
             UserOAuth.objects.create(
@@ -1301,15 +1386,17 @@ class AnonymousUserViewSet(viewsets.ViewSet):
             )
             
             # 重新生成令牌
+            invalidate_user_tokens(user.id)
             user.auth_token.delete()
-            token, created = Token.objects.get_or_create(user=user)
+            token, created = issue_token(user)
             
             return Response(api_response(
                 code=200,
                 message=_('账号转换成功'),
                 data={
                     'token': token.key,
-                    'user': UserSerializer(user).data
+                    'user': UserSerializer(user).data,
+                    **tokens.signed_token_data(user, token)
                 }
             ))
         except Exception as e:
@@ -1,4 +1,5 @@
-from django.test import TestCase
+import fakeredis
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
@@ -40,3 +41,37 @@ class FeedbackAPITest(APITestCase):
         url = reverse('feedback-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class FeedbackThrottleTest(APITestCase):
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django_redis.cache.RedisCache',
+                'LOCATION': 'redis://fake-redis:6379/0',
+                'OPTIONS': {
+                    'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                    'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection},
+                },
+            }
+        },
+        RATE_LIMITS={'POLICIES': {'feedback': {'rates': {'ip': '2/h'}}}},
+    )
+    def test_create_feedback_throttled_by_ip(self):
+        """测试匿名提交反馈按IP限流"""
+        from django_redis import get_redis_connection
+        get_redis_connection('default').flushall()
+        data = {
+            'email': 'test@example.com',
+            'feedback_type': FeedbackType.BUG,
+            'platform': Platform.IOS,
+            'app_id': 'com.example.app',
+            'content': '测试反馈内容'
+        }
+        for _ in range(2):
+            response = self.client.post('/api/voice/feedback/', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post('/api/voice/feedback/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Feedback.objects.count(), 2)
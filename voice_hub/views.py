@@ -6,6 +6,7 @@ from django.utils.translation import gettext_lazy as _
 from .models import Feedback
 from .serializers import FeedbackSerializer
 from .filters import FeedbackFilter
+from user.ratelimit import FeedbackThrottle
 
 
 class FeedbackViewSet(viewsets.ModelViewSet):
@@ -32,6 +33,14 @@ class FeedbackViewSet(viewsets.ModelViewSet):
             return []
         return [permissions.IsAdminUser()]
     
+    def get_throttles(self):
+        """
+        匿名提交反馈按IP限流
+        """
+        if self.action == 'create':
+            return [FeedbackThrottle()]
+        return super().get_throttles()
+    
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)